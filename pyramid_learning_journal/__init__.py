@@ -7,8 +7,17 @@ def main(global_config, **settings):
     settings['sqlalchemy.url'] = os.environ['DATABASE_URL']
     config = Configurator(settings=settings)
     config.include('pyramid_jinja2')
+    config.include('.fragments')
     config.include('.models')
+    config.include('.rendering')
+    config.include('.preview')
+    config.include('.attachments')
     config.include('.routes')
     config.include('.security')
+    config.include('.events')
+    config.include('.cache')
+    config.include('.subscribers')
+    config.include('.viewcounts')
+    config.include('.drafts')
     config.scan()
     return config.make_wsgi_app()
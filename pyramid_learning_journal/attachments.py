@@ -0,0 +1,153 @@
+"""Store attachment bytes on disk, once per distinct content.
+
+An upload is copied in chunks to a temporary file while its sha256 is worked
+out, then renamed to ``<path>/<first two hex digits>/<sha256>``. If a file
+with that content is already there the copy is dropped, so a file uploaded
+many times is stored once. Stored files never change, which is what lets
+them be served with a far future ``Cache-Control: immutable``.
+
+Files are served by ``AttachmentResponse``. It hands the open file to the
+server's ``wsgi.file_wrapper`` for whole files and for ranges alike, so
+waitress sends the bytes from its main loop instead of a worker thread
+copying them through Python.
+"""
+from hashlib import sha256
+from urllib.parse import quote
+import os
+import tempfile
+import unicodedata
+
+from pyramid.response import FileIter, Response
+from webob.static import FileIter as RangeIter
+
+CHUNK_SIZE = 64 * 1024
+MAX_SIZE = 10 * 1024 * 1024
+
+# types shown in the browser; anything else is downloaded, so an uploaded
+# html or svg file can't run scripts on the journal's origin
+INLINE_TYPES = frozenset([
+    'image/gif', 'image/jpeg', 'image/png', 'image/webp',
+    'application/pdf', 'text/plain',
+])
+
+
+def content_disposition(filename):
+    """Make a Content-Disposition header downloading a file by its name.
+
+    Headers are Latin-1, so the name is sent twice: as plain ASCII for old
+    clients and percent-encoded UTF-8 in ``filename*`` (RFC 6266).
+    """
+    fallback = unicodedata.normalize('NFKD', filename).encode(
+        'ascii', 'ignore').decode('ascii')
+    fallback = ''.join(
+        char for char in fallback if char.isprintable() and char not in '"\\')
+    if not fallback.strip(' .'):
+        fallback = 'file'
+    elif fallback.startswith('.'):
+        fallback = 'file' + fallback
+    return "attachment; filename=\"{}\"; filename*=UTF-8''{}".format(
+        fallback, quote(filename, safe="!#$&+-.^_`|~"))
+
+
+class AttachmentTooLarge(Exception):
+    """The upload is larger than the store allows."""
+
+
+class AttachmentStore(object):
+    """A directory of files named by the sha256 of their content."""
+
+    def __init__(self, path, max_size=MAX_SIZE, chunk_size=CHUNK_SIZE):
+        self.path = os.path.abspath(path)
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+
+    def path_of(self, digest):
+        """Get where the file with this sha256 is stored."""
+        return os.path.join(self.path, digest[:2], digest)
+
+    def exists(self, digest):
+        """Tell whether the file with this sha256 is stored."""
+        return os.path.isfile(self.path_of(digest))
+
+    def save(self, source):
+        """Copy a file object into the store, returning (sha256, size)."""
+        incoming = os.path.join(self.path, 'incoming')
+        if not os.path.isdir(incoming):
+            os.makedirs(incoming, exist_ok=True)
+        digest = sha256()
+        size = 0
+        fd, temp_path = tempfile.mkstemp(dir=incoming)
+        try:
+            with os.fdopen(fd, 'wb') as temp:
+                while True:
+                    chunk = source.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > self.max_size:
+                        raise AttachmentTooLarge(size)
+                    digest.update(chunk)
+                    temp.write(chunk)
+            name = digest.hexdigest()
+            target = self.path_of(name)
+            if os.path.exists(target):
+                os.unlink(temp_path)
+            else:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.chmod(temp_path, 0o644)
+                os.replace(temp_path, target)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+        return name, size
+
+
+class AttachmentResponse(Response):
+    """Send a stored file, honouring Range and If-None-Match.
+
+    The sha256 is the ETag and the file never changes, so browsers keep it
+    for a year without asking again.
+    """
+
+    def __init__(self, request, path, digest, content_type, filename):
+        super(AttachmentResponse, self).__init__(
+            conditional_response=True, content_type=content_type)
+        self._file = open(path, 'rb')
+        self._file_wrapper = request.environ.get('wsgi.file_wrapper')
+        self.app_iter = self._wrap()
+        self.content_length = os.fstat(self._file.fileno()).st_size
+        self.etag = digest
+        self.accept_ranges = 'bytes'
+        self.cache_control = 'public, max-age=31536000, immutable'
+        self.headers['X-Content-Type-Options'] = 'nosniff'
+        if content_type not in INLINE_TYPES:
+            self.content_disposition = content_disposition(filename)
+
+    def _wrap(self):
+        if self._file_wrapper is not None:
+            return self._file_wrapper(self._file, CHUNK_SIZE)
+        return FileIter(self._file, CHUNK_SIZE)
+
+    def app_iter_range(self, start, stop):
+        """Send the bytes from start up to stop, seeking to them first."""
+        if self._file_wrapper is not None:
+            # a file wrapper starts at the file's position and stops after
+            # Content-Length bytes, which webob sets to stop - start
+            self._file.seek(start)
+            return self._wrap()
+        return RangeIter(self._file).app_iter_range(start, stop, CHUNK_SIZE)
+
+
+def get_store(request):
+    """Get the app's attachment store."""
+    return request.registry['attachment_store']
+
+
+def includeme(config):
+    """Set up the attachment store."""
+    settings = config.get_settings()
+    config.registry['attachment_store'] = AttachmentStore(
+        settings.get('journal.attachments.path', 'attachments'),
+        max_size=int(settings.get('journal.attachments.max_size', MAX_SIZE))
+    )
@@ -0,0 +1,680 @@
+"""A cache for the views, shared by every worker process that uses it.
+
+Values are stored as JSON under
+``<prefix>:<namespace>:<generation>.<key generation>:<key>``. Each namespace,
+and each key in it, has a generation counter kept in the backend itself, so
+``invalidate(namespace)`` or ``delete(namespace, key)`` bumps one counter
+and every process sharing the backend stops seeing the old values at once,
+without having to be told. A value made from data read before the bump is
+stored under the old generation, where nobody looks any more. Entries are
+invalidated right after their transaction commits.
+
+Backends, chosen with ``journal.cache.backend``:
+
+- ``memory``: an LRU dict, for a single process.
+- ``sqlite``: a SQLite file at ``journal.cache.path``, shared by the
+  processes on one host.
+- ``redis``: any server speaking the Redis protocol at ``journal.cache.url``.
+- ``none``: no caching at all.
+
+A cache that fails is logged and treated as a miss, never as an error.
+
+Each journal's pages are kept in a namespace of their own (see
+``journal_namespace``), so a change to one journal invalidates only its
+pages. Every backend also keeps at most ``journal.cache.partition_entries``
+values of each such namespace, so one busy journal evicts its own pages
+rather than everyone else's. The listings of every journal together are a
+partition too, ``SITE_LISTS``.
+
+When a value is missing, ``get_or_set`` lets one thread make it while the
+others in the process are given the last value seen (stale-while-revalidate)
+or wait for the new one, so an invalidated home page is built once per
+worker rather than once per thread.
+"""
+from collections import OrderedDict
+from pyramid.exceptions import ConfigurationError
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from urllib.parse import urlparse
+
+log = logging.getLogger(__name__)
+
+
+class CacheError(Exception):
+    """The cache backend could not do what was asked."""
+
+
+class NullBackend(object):
+    """Store nothing."""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def incr(self, key):
+        return 0
+
+    def counter(self, key):
+        return 0
+
+    def counters(self, keys):
+        return [0] * len(keys)
+
+
+# the home page, tag cloud, archive months and most read entries list the
+# entries of every journal, on purpose, so they are not kept with any one
+# journal's pages, but in a partition of their own
+SITE_LISTS = 'site/lists'
+
+
+def journal_namespace(journal_id):
+    """Get the cache namespace of one journal's pages."""
+    return 'journal/{}'.format(journal_id)
+
+
+def _partition(key):
+    """Get the partitioned namespace of a key, or None if it has none."""
+    parts = key.split(':', 2)
+    if len(parts) == 3 and '/' in parts[1]:
+        return parts[1]
+    return None
+
+
+def _members_key(key, partition):
+    """Get the key of the set of keys stored in a key's partition."""
+    return '{}:members:{}'.format(key.split(':', 1)[0], partition)
+
+
+class MemoryBackend(object):
+    """Keep the most recently used values in a dict, in this process only.
+
+    Namespaces with a ``/`` in their name are partitions: each keeps at most
+    ``partition_entries`` values, dropping its own least recently used.
+    """
+
+    def __init__(self, max_entries=1000, partition_entries=None):
+        self.max_entries = max_entries
+        self.partition_entries = partition_entries
+        self._values = OrderedDict()
+        self._partitions = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def _forget(self, key):
+        self._values.pop(key, None)
+        partition = _partition(key)
+        keys = self._partitions.get(partition)
+        if keys is not None:
+            keys.pop(key, None)
+            if not keys:
+                del self._partitions[partition]
+
+    def get(self, key):
+        with self._lock:
+            item = self._values.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires is not None and expires < time.time():
+                self._forget(key)
+                return None
+            self._values.move_to_end(key)
+            keys = self._partitions.get(_partition(key))
+            if keys is not None:
+                keys.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = time.time() + ttl if ttl else None
+        partition = _partition(key)
+        with self._lock:
+            self._values[key] = (value, expires)
+            self._values.move_to_end(key)
+            if partition is not None:
+                keys = self._partitions.setdefault(partition, OrderedDict())
+                keys[key] = None
+                keys.move_to_end(key)
+                while (self.partition_entries and
+                       len(keys) > self.partition_entries):
+                    self._forget(next(iter(keys)))
+            while len(self._values) > self.max_entries:
+                self._forget(next(iter(self._values)))
+
+    def delete(self, key):
+        with self._lock:
+            self._forget(key)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def counter(self, key):
+        with self._lock:
+            return self._counters.get(key, 0)
+
+    def counters(self, keys):
+        with self._lock:
+            return [self._counters.get(key, 0) for key in keys]
+
+
+class _PerThread(object):
+    """Hold one connection per thread, made again after a fork."""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def _connection(self):
+        pid = os.getpid()
+        if getattr(self._local, 'pid', None) != pid:
+            self._local.connection = self._connect()
+            self._local.pid = pid
+        return self._local.connection
+
+    def _reset(self):
+        self._local.pid = None
+
+
+class SQLiteBackend(_PerThread):
+    """Keep values in a SQLite file that every process on the host can use.
+
+    Each value remembers its partition, and setting one drops the oldest
+    values of that partition beyond ``partition_entries``.
+    """
+
+    PRUNE_EVERY = 100
+
+    def __init__(self, path, max_entries=10000, partition_entries=None):
+        super(SQLiteBackend, self).__init__()
+        self.path = path
+        self.max_entries = max_entries
+        self.partition_entries = partition_entries
+        self._sets = 0
+        connection = self._connection()
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS cache ('
+            'key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL, '
+            'partition TEXT)')
+        columns = [row[1] for row in connection.execute(
+            'PRAGMA table_info(cache)')]
+        if 'partition' not in columns:
+            # a cache file made before values had partitions
+            connection.execute('ALTER TABLE cache ADD COLUMN partition TEXT')
+        connection.execute(
+            'CREATE INDEX IF NOT EXISTS cache_partition ON cache (partition)')
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS counters ('
+            'key TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+
+    def _connect(self):
+        connection = sqlite3.connect(
+            self.path, timeout=5, isolation_level=None,
+            check_same_thread=False)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
+
+    def get(self, key):
+        row = self._connection().execute(
+            'SELECT value, expires FROM cache WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return bytes(row[0])
+
+    def set(self, key, value, ttl=None):
+        expires = time.time() + ttl if ttl else None
+        partition = _partition(key)
+        connection = self._connection()
+        connection.execute(
+            'INSERT OR REPLACE INTO cache (key, value, expires, partition) '
+            'VALUES (?, ?, ?, ?)', (key, value, expires, partition))
+        if partition is not None and self.partition_entries:
+            # a replaced row gets a new rowid, so rowid order is write order
+            connection.execute(
+                'DELETE FROM cache WHERE partition = ? AND rowid NOT IN '
+                '(SELECT rowid FROM cache WHERE partition = ? '
+                'ORDER BY rowid DESC LIMIT ?)',
+                (partition, partition, self.partition_entries))
+        self._sets += 1
+        if self._sets % self.PRUNE_EVERY == 0:
+            self.prune()
+
+    def prune(self):
+        """Drop expired values, then the oldest beyond max_entries."""
+        connection = self._connection()
+        connection.execute(
+            'DELETE FROM cache WHERE expires < ?', (time.time(),))
+        connection.execute(
+            'DELETE FROM cache WHERE rowid NOT IN '
+            '(SELECT rowid FROM cache ORDER BY rowid DESC LIMIT ?)',
+            (self.max_entries,))
+
+    def delete(self, key):
+        self._connection().execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def incr(self, key):
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute(
+                'SELECT value FROM counters WHERE key = ?', (key,)).fetchone()
+            value = row[0] + 1 if row else 1
+            connection.execute(
+                'INSERT OR REPLACE INTO counters (key, value) VALUES (?, ?)',
+                (key, value))
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+        return value
+
+    def counter(self, key):
+        row = self._connection().execute(
+            'SELECT value FROM counters WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else 0
+
+    def counters(self, keys):
+        values = dict(self._connection().execute(
+            'SELECT key, value FROM counters WHERE key IN ({})'.format(
+                ', '.join('?' * len(keys))), keys))
+        return [values.get(key, 0) for key in keys]
+
+
+class RedisBackend(_PerThread):
+    """Keep values in a server speaking the Redis protocol (RESP).
+
+    The keys of each partition are kept in a sorted set by when they were
+    set, and setting one drops the oldest beyond ``partition_entries``.
+    """
+
+    def __init__(self, url='redis://localhost:6379/0', timeout=1.0,
+                 partition_entries=None):
+        super(RedisBackend, self).__init__()
+        url = urlparse(url)
+        self.host = url.hostname or 'localhost'
+        self.port = url.port or 6379
+        self.db = int(url.path.strip('/') or 0)
+        self.timeout = timeout
+        self.partition_entries = partition_entries
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        connection = (sock, sock.makefile('rb'))
+        if self.db:
+            self._send(connection, 'SELECT', self.db)
+        return connection
+
+    def _send(self, connection, *args):
+        sock, reader = connection
+        parts = [b'*' + str(len(args)).encode('ascii') + b'\r\n']
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode('utf-8')
+            parts.append(b'$' + str(len(arg)).encode('ascii') + b'\r\n')
+            parts.append(arg + b'\r\n')
+        sock.sendall(b''.join(parts))
+        return self._read(reader)
+
+    def _read(self, reader):
+        line = reader.readline()
+        if not line.endswith(b'\r\n'):
+            raise CacheError('connection closed')
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest
+        if kind == b'-':
+            raise CacheError(rest.decode('utf-8', 'replace'))
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            length = int(rest)
+            if length < 0:
+                return None
+            data = reader.read(length + 2)
+            return data[:-2]
+        if kind == b'*':
+            length = int(rest)
+            if length < 0:
+                return None
+            return [self._read(reader) for _ in range(length)]
+        raise CacheError('bad reply {!r}'.format(line))
+
+    def command(self, *args):
+        """Send one command and get its reply."""
+        try:
+            return self._send(self._connection(), *args)
+        except (OSError, CacheError):
+            # the connection may be half way through a reply; start over
+            self._reset()
+            raise
+
+    def get(self, key):
+        return self.command('GET', key)
+
+    def set(self, key, value, ttl=None):
+        if ttl:
+            self.command('SET', key, value, 'PX', int(ttl * 1000))
+        else:
+            self.command('SET', key, value)
+        partition = _partition(key)
+        if partition is not None and self.partition_entries:
+            members = _members_key(key, partition)
+            self.command('ZADD', members, repr(time.time()), key)
+            oldest = self.command(
+                'ZRANGE', members, 0, -self.partition_entries - 1)
+            if oldest:
+                self.command('DEL', *oldest)
+                self.command('ZREM', members, *oldest)
+
+    def delete(self, key):
+        self.command('DEL', key)
+
+    def incr(self, key):
+        return self.command('INCR', key)
+
+    def counter(self, key):
+        return int(self.command('GET', key) or 0)
+
+    def counters(self, keys):
+        return [int(value or 0) for value in self.command('MGET', *keys)]
+
+
+class _Flight(object):
+    """One value being made, that other threads can wait for."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.failed = False
+        self.waiters = 0
+
+
+class SingleFlight(object):
+    """Let one thread make a missing value while the others wait for it.
+
+    The first thread to miss a key makes the value. Threads that miss it
+    while that is going on get ``stale`` straight away when there is one,
+    and otherwise wait up to ``timeout`` seconds for the first thread to
+    finish. If it takes longer, or fails, they make the value themselves.
+    This only coalesces threads in one process; each worker makes a value
+    at most once.
+    """
+
+    def __init__(self, timeout=5.0):
+        self.timeout = timeout
+        self.counts = {'leaders': 0, 'coalesced': 0, 'stale': 0,
+                       'timeouts': 0, 'wait_seconds': 0.0}
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.counts[name] += amount
+
+    def run(self, key, create, stale=None):
+        """Make the value for key, or share the one being made."""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.counts['leaders'] += 1
+            elif stale is None:
+                flight.waiters += 1
+        if leader:
+            try:
+                flight.value = create()
+            except Exception:
+                flight.failed = True
+                raise
+            finally:
+                with self._lock:
+                    del self._flights[key]
+                flight.done.set()
+            return flight.value
+
+        if stale is not None:
+            self._count('stale')
+            return stale
+        started = time.time()
+        finished = flight.done.wait(self.timeout)
+        self._count('wait_seconds', time.time() - started)
+        if not finished:
+            self._count('timeouts')
+            return create()
+        if flight.failed:
+            return create()
+        self._count('coalesced')
+        return flight.value
+
+    def stats(self):
+        """Get the counts of leaders, coalesced waits and stale answers."""
+        with self._lock:
+            return dict(self.counts)
+
+
+class Cache(object):
+    """Namespaced JSON values on top of a backend, with hit counts.
+
+    The last ``stale_entries`` values read or written are also kept in this
+    process, to hand out while a missing value is being made again.
+    """
+
+    def __init__(self, backend, prefix='journal', ttl=None, stale_entries=256,
+                 flight_timeout=5.0):
+        self.backend = backend
+        self.prefix = prefix
+        self.ttl = ttl
+        self.stale_entries = stale_entries
+        self.flight = SingleFlight(flight_timeout)
+        self.counts = {'hits': 0, 'misses': 0, 'errors': 0}
+        self._stale = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def _failed(self, action):
+        self._count('errors')
+        log.warning('Cache %s failed', action, exc_info=True)
+
+    def _generation_key(self, namespace, key=None):
+        if key is None:
+            return '{}:gen:{}'.format(self.prefix, namespace)
+        return '{}:gen:{}:{}'.format(self.prefix, namespace, key)
+
+    def _key(self, namespace, key):
+        """Get the backend key of a value, and the generation of its key."""
+        generation, key_generation = self.backend.counters([
+            self._generation_key(namespace),
+            self._generation_key(namespace, key)])
+        return '{}:{}:{}.{}:{}'.format(
+            self.prefix, namespace, generation, key_generation, key
+        ), key_generation
+
+    def _keep(self, namespace, key, key_generation, value):
+        if not self.stale_entries:
+            return
+        with self._lock:
+            self._stale[namespace, key] = (key_generation, value)
+            self._stale.move_to_end((namespace, key))
+            while len(self._stale) > self.stale_entries:
+                self._stale.popitem(last=False)
+
+    def _forget(self, namespace, key):
+        with self._lock:
+            self._stale.pop((namespace, key), None)
+
+    def _get(self, namespace, key, full_key, key_generation):
+        try:
+            value = self.backend.get(full_key)
+        except Exception:
+            self._failed('get')
+            return None
+        if value is None:
+            self._count('misses')
+            return None
+        self._count('hits')
+        value = json.loads(value.decode('utf-8'))
+        self._keep(namespace, key, key_generation, value)
+        return value
+
+    def _set(self, namespace, key, full_key, key_generation, value, ttl):
+        data = json.dumps(value, separators=(',', ':')).encode('utf-8')
+        try:
+            self.backend.set(full_key, data, ttl or self.ttl)
+        except Exception:
+            self._failed('set')
+        self._keep(namespace, key, key_generation, value)
+
+    def get(self, namespace, key):
+        """Get a value, or None if it is not cached."""
+        try:
+            full_key, key_generation = self._key(namespace, key)
+        except Exception:
+            self._failed('get')
+            return None
+        return self._get(namespace, key, full_key, key_generation)
+
+    def set(self, namespace, key, value, ttl=None):
+        """Cache a value that can be turned into JSON."""
+        try:
+            full_key, key_generation = self._key(namespace, key)
+        except Exception:
+            self._failed('set')
+            return
+        self._set(namespace, key, full_key, key_generation, value, ttl)
+
+    def get_or_set(self, namespace, key, create, ttl=None):
+        """Get a value, making and caching it if missing. None isn't cached.
+
+        Only one thread makes a missing value; the others get the last value
+        seen here, or wait for the new one. The value is stored under the
+        generations read before it was made, so one made from data that has
+        since changed is never stored as current. The last value seen is
+        only handed out after its namespace was invalidated, never after the
+        key itself was deleted.
+        """
+        try:
+            full_key, key_generation = self._key(namespace, key)
+        except Exception:
+            self._failed('get')
+            return create()
+        value = self._get(namespace, key, full_key, key_generation)
+        if value is not None:
+            return value
+
+        def make():
+            value = create()
+            if value is None:
+                self._forget(namespace, key)
+            else:
+                self._set(namespace, key, full_key, key_generation, value,
+                          ttl)
+            return value
+
+        with self._lock:
+            stale = self._stale.get((namespace, key))
+        if stale is not None and stale[0] == key_generation:
+            stale = stale[1]
+        else:
+            stale = None
+        return self.flight.run(full_key, make, stale)
+
+    def delete(self, namespace, key):
+        """Forget one value, in every process."""
+        self._forget(namespace, key)
+        try:
+            full_key, _ = self._key(namespace, key)
+            self.backend.incr(self._generation_key(namespace, key))
+            self.backend.delete(full_key)
+        except Exception:
+            self._failed('delete')
+
+    def invalidate(self, namespace):
+        """Forget every value in a namespace, in every process."""
+        try:
+            self.backend.incr(self._generation_key(namespace))
+        except Exception:
+            self._failed('invalidate')
+
+    def stats(self):
+        """Get the hit, miss and error counts, and those of the flights."""
+        with self._lock:
+            counts = dict(self.counts)
+        counts.update(self.flight.stats())
+        return counts
+
+
+NULL_CACHE = Cache(NullBackend())
+
+
+def get_cache(request):
+    """Get the app's cache, or one that caches nothing."""
+    return request.registry.get('cache') or NULL_CACHE
+
+
+def make_backend(settings):
+    """Create the cache backend named in the settings."""
+    name = settings.get('journal.cache.backend', 'memory')
+    max_entries = int(settings.get('journal.cache.max_entries', 1000))
+    partition_entries = settings.get('journal.cache.partition_entries')
+    partition_entries = (
+        int(partition_entries) if partition_entries else max_entries // 10)
+    if name == 'memory':
+        return MemoryBackend(max_entries, partition_entries)
+    if name == 'sqlite':
+        return SQLiteBackend(
+            settings.get('journal.cache.path', 'journal-cache.sqlite'),
+            max_entries, partition_entries)
+    if name == 'redis':
+        return RedisBackend(
+            settings.get('journal.cache.url', 'redis://localhost:6379/0'),
+            float(settings.get('journal.cache.timeout', 1.0)),
+            partition_entries)
+    if name == 'none':
+        return NullBackend()
+    raise ConfigurationError('Unknown cache backend {}'.format(name))
+
+
+def invalidate_entries(event):
+    """Forget the cached copies of changed entries and the lists of them."""
+    cache = event.registry.get('cache')
+    if cache is None:
+        return
+    for entry_id in event.entry_ids:
+        cache.delete('entry', entry_id)
+    cache.invalidate(SITE_LISTS)
+    for journal_id in set(event.journal_ids):
+        cache.invalidate(journal_namespace(journal_id))
+
+
+def make_cache(settings):
+    """Create the cache described by the settings."""
+    ttl = settings.get('journal.cache.ttl')
+    return Cache(
+        make_backend(settings),
+        prefix=settings.get('journal.cache.prefix', 'journal'),
+        ttl=float(ttl) if ttl else None,
+        stale_entries=int(settings.get('journal.cache.stale_entries', 256)),
+        flight_timeout=float(settings.get('journal.cache.flight_timeout', 5))
+    )
+
+
+def includeme(config):
+    """Set up the cache. Needs pyramid_learning_journal.events."""
+    config.registry['cache'] = make_cache(config.get_settings())
+    config.add_entry_subscriber(invalidate_entries, inline=True)
@@ -3,7 +3,9 @@
 from __future__ import unicode_literals
 from pyramid import testing
 from pyramid_learning_journal.models.meta import Base
-from pyramid_learning_journal.models import Entry, get_tm_session
+from pyramid_learning_journal.models import Entry, get_engine, get_tm_session
+from sqlalchemy import Integer, create_engine, event, text
+from sqlalchemy.engine.url import make_url
 from passlib.apps import custom_app_context as pwd_context
 import transaction
 import os
@@ -19,14 +21,68 @@ def test_entry():
     )
 
 
+def worker_database_url(url, worker_id):
+    """Give each pytest-xdist worker a database of its own."""
+    url = make_url(url)
+    if not url.database or url.database == ':memory:':
+        return url
+    if url.get_backend_name() == 'sqlite':
+        name, ext = os.path.splitext(url.database)
+        url.database = '{}_{}{}'.format(name, worker_id, ext)
+        return url
+
+    worker_url = make_url(str(url))
+    worker_url.database = '{}_{}'.format(url.database, worker_id)
+    if url.get_backend_name() == 'postgresql':
+        engine = create_engine(url, isolation_level='AUTOCOMMIT')
+        with engine.connect() as connection:
+            exists = connection.execute(
+                text('SELECT 1 FROM pg_database WHERE datname = :name'),
+                name=worker_url.database
+            ).scalar()
+            if not exists:
+                connection.execute('CREATE DATABASE "{}"'.format(
+                    worker_url.database))
+        engine.dispose()
+    return worker_url
+
+
+@pytest.fixture(scope='session')
+def database_url(request):
+    """Get the URL of the test database, in memory SQLite by default."""
+    url = os.environ.get('TEST_DATABASE_URL', 'sqlite://')
+    worker_id = getattr(request.config, 'workerinput', {}).get('workerid')
+    if worker_id:
+        url = str(worker_database_url(url, worker_id))
+    return url
+
+
 @pytest.fixture(scope='session')
-def configuration(request):
+def engine(database_url, request):
+    """Create the database schema once for the whole test session."""
+    engine = get_engine({'sqlalchemy.url': database_url})
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+
+    def teardown():
+        Base.metadata.drop_all(engine)
+        engine.dispose()
+
+    request.addfinalizer(teardown)
+    return engine
+
+
+@pytest.fixture(scope='session')
+def configuration(request, engine, database_url):
     """Setup a database for testing purposes."""
     config = testing.setUp(settings={
-        'sqlalchemy.url': os.environ['TEST_DATABASE_URL']
+        'sqlalchemy.url': database_url
     })
+    config.include('pyramid_jinja2')
+    config.include('pyramid_learning_journal.fragments')
     config.include('pyramid_learning_journal.models')
     config.include("pyramid_learning_journal.routes")
+    config.registry['dbsession_factory'].configure(bind=engine)
 
     def teardown():
         testing.tearDown()
@@ -35,17 +91,57 @@ def configuration(request):
     return config
 
 
+def reset_sequences(connection):
+    """Start Postgres id sequences after the highest id in each table."""
+    if connection.dialect.name != 'postgresql':
+        return
+    for table in Base.metadata.sorted_tables:
+        columns = [c for c in table.primary_key.columns if c.autoincrement is True]
+        if len(columns) != 1 or not isinstance(columns[0].type, Integer):
+            continue
+        connection.execute(text(
+            "SELECT setval(pg_get_serial_sequence(:table, :column), "
+            "COALESCE(MAX({column}), 0) + 1, false) FROM {table}".format(
+                column=columns[0].name, table=table.name)
+        ), table=table.name, column=columns[0].name)
+
+
 @pytest.fixture
-def db_session(configuration, request):
-    """Create a database session for interacting with the test database."""
-    SessionFactory = configuration.registry['dbsession_factory']
-    session = SessionFactory()
-    engine = session.bind
-    Base.metadata.create_all(engine)
+def db_session(configuration, engine, request):
+    """Create a database session for interacting with the test database.
+
+    Everything the test does happens inside of a transaction that is rolled
+    back afterwards. The session works in a SAVEPOINT that is started again
+    whenever the code under test commits or rolls back, so a commit never
+    reaches the outer transaction.
+    """
+    connection = engine.connect()
+    if connection.dialect.name == 'sqlite':
+        # pysqlite only supports SAVEPOINTs if it leaves BEGIN to SQLAlchemy
+        dbapi_connection = connection.connection.connection
+        isolation_level = dbapi_connection.isolation_level
+        dbapi_connection.isolation_level = None
+        event.listen(
+            connection, 'begin', lambda conn: conn.execute('BEGIN'))
+    outer = connection.begin()
+    reset_sequences(connection)
+    session = configuration.registry['dbsession_factory'](bind=connection)
+    session.begin_nested()
+
+    @event.listens_for(session, 'after_transaction_end')
+    def restart_savepoint(session, transaction):
+        if transaction.nested and not transaction._parent.nested:
+            session.expire_all()
+            session.begin_nested()
 
     def teardown():
-        session.transaction.rollback()
-        Base.metadata.drop_all(engine)
+        event.remove(session, 'after_transaction_end', restart_savepoint)
+        session.rollback()
+        session.close()
+        outer.rollback()
+        if connection.dialect.name == 'sqlite':
+            dbapi_connection.isolation_level = isolation_level
+        connection.close()
 
     request.addfinalizer(teardown)
     return session
@@ -72,34 +168,36 @@ def add_entries(dummy_request, test_entries):
 
 
 @pytest.fixture(scope="session")
-def testapp(request):
+def testapp(engine, database_url, tmpdir_factory):
     """Functional test for app."""
     from webtest import TestApp
     from pyramid.config import Configurator
 
     def main():
         settings = {
-            'sqlalchemy.url': os.environ['TEST_DATABASE_URL']
+            'sqlalchemy.url': database_url,
+            'journal.events.workers': '0',
+            'journal.views.flush_interval': '0',
+            'journal.drafts.flush_interval': '0',
+            'journal.attachments.path': str(tmpdir_factory.mktemp('attachments'))
         }
         config = Configurator(settings=settings)
         config.include('pyramid_jinja2')
+        config.include('pyramid_learning_journal.fragments')
         config.include('pyramid_learning_journal.routes')
         config.include('pyramid_learning_journal.models')
         config.include("pyramid_learning_journal.security")
+        config.include('pyramid_learning_journal.events')
+        config.include('pyramid_learning_journal.subscribers')
+        config.include('pyramid_learning_journal.viewcounts')
+        config.include('pyramid_learning_journal.drafts')
+        config.include('pyramid_learning_journal.preview')
+        config.include('pyramid_learning_journal.attachments')
         config.scan()
         return config.make_wsgi_app()
 
     app = main()
-
-    SessionFactory = app.registry["dbsession_factory"]
-    engine = SessionFactory().bind
-    Base.metadata.create_all(bind=engine)
-
-    def tearDown():
-        Base.metadata.drop_all(bind=engine)
-
-    request.addfinalizer(tearDown)
-
+    app.registry['dbsession_factory'].configure(bind=engine)
     return TestApp(app)
 
 
@@ -124,10 +222,8 @@ def fill_the_db(testapp, test_entries):
 
 
 @pytest.fixture
-def empty_the_db(testapp):
+def empty_the_db(testapp, engine):
     """Tear down the database and add a fresh table."""
-    SessionFactory = testapp.app.registry["dbsession_factory"]
-    engine = SessionFactory().bind
     Base.metadata.drop_all(bind=engine)
     Base.metadata.create_all(bind=engine)
 
@@ -165,3 +261,27 @@ def csrf_token(testapp):
     """Get the CSRF token for POST requests."""
     response = testapp.get('/login')
     return response.html.find('input', {'name': 'csrf_token'}).attrs['value']
+
+
+@pytest.fixture
+def logged_in(testapp, csrf_token, username, password):
+    """Log the testapp in to the journal."""
+    testapp.post('/login', {
+        'csrf_token': csrf_token,
+        'username': username,
+        'password': password
+    })
+    return testapp
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_collection_modifyitems(config, items):
+    """Keep the functional tests together on one pytest-xdist worker.
+
+    They share one app and one database, and later tests count on what the
+    earlier ones did, so ``pytest -n auto --dist loadgroup`` runs them in
+    order on a single worker while the rest spread out over the others.
+    """
+    for item in items:
+        if 'testapp' in getattr(item, 'fixturenames', ()):
+            item.add_marker(pytest.mark.xdist_group('testapp'))
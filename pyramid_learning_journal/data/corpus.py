@@ -0,0 +1,190 @@
+"""Seeded synthetic journal entries, for load and scale testing.
+
+The words, tags, posting gaps and times of day are all drawn from the real
+entries in ``entry_history``, so a corpus looks like the journal just kept
+going. The same seed always gives the same corpus.
+"""
+from ..models import Entry
+from ..models.tag import entry_tags, get_tag_ids, parse_tags, recount_tags
+from ..models.archive import rebuild_monthly_counts
+from ..models.related import rebuild_related
+from ..rendering import render_markdown, renderer_key
+from .entry_history import ENTRIES
+from datetime import datetime, timedelta
+from pytz import timezone as tz
+from sqlalchemy import func
+import json
+import random
+import re
+
+BATCH_SIZE = 1000
+FMT = '%Y-%m-%dT%H:%M:%S'
+
+WORDS = sorted(set(
+    word for entry in ENTRIES
+    for word in re.findall(r"[a-z][a-z']+", entry['body'].lower())
+))
+TAGS = sorted(set(
+    tag for entry in ENTRIES for tag in parse_tags(entry.get('tags'))
+))
+_DATES = sorted(entry['creation_date'] for entry in ENTRIES)
+GAPS = [(later - earlier).days for earlier, later in zip(_DATES, _DATES[1:])]
+TIMES = [(date.hour, date.minute) for date in _DATES]
+
+SNIPPETS = [
+    ('python', 'def add(a, b):\n    return a + b'),
+    ('python', 'for i, item in enumerate(items):\n    print(i, item)'),
+    ('python', 'with open(path) as f:\n    data = json.load(f)'),
+    ('bash', 'pip install -e .[testing]\npytest --cov'),
+    ('sql', 'SELECT id, title FROM entries ORDER BY creation_date DESC;'),
+    ('javascript', 'const total = items.reduce((a, b) => a + b, 0);'),
+]
+LINKS = [
+    'https://docs.python.org/3/',
+    'https://docs.pytest.org/en/latest/',
+    'https://trypyramid.com/',
+    'http://www.sqlalchemy.org/',
+    'https://www.postgresql.org/docs/',
+]
+
+
+def _sentence(rng):
+    """Make one sentence of journal words."""
+    words = [rng.choice(WORDS) for _ in range(rng.randint(6, 18))]
+    return ' '.join(words).capitalize() + rng.choice('..!?')
+
+
+def _paragraph(rng):
+    """Make a paragraph, sometimes with a link or inline code in it."""
+    sentences = [_sentence(rng) for _ in range(rng.randint(2, 6))]
+    if rng.random() < 0.2:
+        text = rng.choice(WORDS)
+        sentences.append('See [{}]({}).'.format(text, rng.choice(LINKS)))
+    if rng.random() < 0.2:
+        sentences.insert(0, 'Learned about `{}` today.'.format(
+            rng.choice(WORDS)))
+    return ' '.join(sentences)
+
+
+def _block(rng):
+    """Make one markdown block: a paragraph, heading, list or code."""
+    kind = rng.random()
+    if kind < 0.1:
+        return '## ' + _sentence(rng).rstrip('.!?')
+    if kind < 0.2:
+        marker = rng.choice(['* ', '- ', '1. '])
+        return '\n'.join(
+            marker + _sentence(rng) for _ in range(rng.randint(2, 5))
+        )
+    if kind < 0.3:
+        language, code = rng.choice(SNIPPETS)
+        return '```{}\n{}\n```'.format(language, code)
+    return _paragraph(rng)
+
+
+def generate_body(rng):
+    """Make a markdown body whose length has a long tail."""
+    blocks = max(1, int(rng.lognormvariate(1.0, 0.8)))
+    return '\n\n'.join(_block(rng) for _ in range(blocks))
+
+
+def generate_entries(count, seed=0, start=None):
+    """Make count entry dicts, oldest first, the same for the same seed."""
+    rng = random.Random(seed)
+    day = start or _DATES[0]
+    day = datetime(day.year, day.month, day.day)
+    previous = day
+    for number in range(1, count + 1):
+        hour, minute = rng.choice(TIMES)
+        date = day + timedelta(hours=hour, minutes=minute)
+        if date <= previous:
+            # a second entry on the same day comes a little later
+            date = previous + timedelta(minutes=rng.randint(10, 90))
+        previous = date
+        yield {
+            'title': 'Day {}'.format(number),
+            'body': generate_body(rng),
+            'tags': ', '.join(rng.sample(TAGS, rng.randint(0, 3))),
+            'creation_date': date,
+        }
+        day += timedelta(days=rng.choice(GAPS))
+
+
+def write_jsonl(entries, fileobj):
+    """Write entry dicts to a file, one JSON object per line."""
+    written = 0
+    for entry in entries:
+        entry = dict(entry)
+        entry['creation_date'] = entry['creation_date'].strftime(FMT)
+        fileobj.write(json.dumps(entry, sort_keys=True) + '\n')
+        written += 1
+    return written
+
+
+def read_jsonl(fileobj):
+    """Read back entry dicts written by write_jsonl."""
+    for line in fileobj:
+        if line.strip():
+            entry = json.loads(line)
+            entry['creation_date'] = datetime.strptime(
+                entry['creation_date'], FMT)
+            yield entry
+
+
+def _batches(items, size):
+    """Split an iterable into lists of at most size items."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def load_entries(session, entries, batch_size=BATCH_SIZE, related=True):
+    """Insert entry dicts in batches, then rebuild everything counted.
+
+    Entry ids are handed out here so the entry_tags rows can go in with the
+    same batch, rather than flushing one entry at a time. The bulk insert
+    skips the ORM events, so the html is rendered here as well.
+    """
+    pacific = tz('US/Pacific')
+    html_key = renderer_key()
+    next_id = (session.query(func.max(Entry.id)).scalar() or 0) + 1
+    loaded = 0
+    for batch in _batches(entries, batch_size):
+        rows, links = [], []
+        tag_names = set()
+        for entry in batch:
+            names = parse_tags(entry.get('tags'))
+            tag_names.update(names)
+            rows.append({
+                'id': next_id,
+                'title': entry['title'],
+                'body': entry['body'],
+                'html': render_markdown(entry['body']),
+                'html_key': html_key,
+                'creation_date': pacific.localize(entry['creation_date']),
+            })
+            links.extend((next_id, name) for name in names)
+            next_id += 1
+        tag_ids = get_tag_ids(session, sorted(tag_names))
+        session.bulk_insert_mappings(Entry, rows)
+        if links:
+            session.execute(entry_tags.insert(), [
+                {'entry_id': entry_id, 'tag_id': tag_ids[name]}
+                for entry_id, name in links
+            ])
+        loaded += len(rows)
+
+    if session.get_bind().dialect.name == 'postgresql':
+        session.execute(
+            "SELECT setval('entries_id_seq', (SELECT MAX(id) FROM entries))")
+    recount_tags(session)
+    rebuild_monthly_counts(session)
+    if related:
+        rebuild_related(session)
+    session.flush()
+    return loaded
@@ -8,6 +8,7 @@ FMT = "%m/%d/%Y %I:%M %p"
 ENTRIES = [
     {
         'id': 1,
+        'tags': 'python',
         'title': "Day One",
         'creation_date': datetime.strptime('10/16/2017 4:18 PM', FMT),
         'body': "Finally starting 401! Super excited to finally start \
@@ -23,6 +24,7 @@ JavaScript, with just a simple directory to store the relevant packages."
     },
     {
         'id': 2,
+        'tags': 'pytest, testing',
         'title': "Day Two",
         'creation_date': datetime.strptime('10/17/2017 4:19 PM', FMT),
         'body': "It's testing time! I'm so glad that pytest doesn't stop \
@@ -36,60 +38,70 @@ definitions is super awesome! Especially the * for any number of arguments \
     },
     {
     'id': 3,
+    'tags': 'python, packaging',
     'title': "Day Three",
     'creation_date': datetime.strptime('10/19/2017 5:53 PM', FMT),
     'body': """Lots of collections today. Not much new on that front. I love how easy it is to do slicing and reversing of sequences.\n\nI was wondering how you did a package.json for python, kinda a bummer that you need to type it out by hand. I bet there is a package to do it for you. Is there an easy way to save new dependancies to your setup.py, or do you need to do it manually? ...I bet there is a package for that too >.> It is interesting that you can specify dependancies that are only required for testing and such and separate them from the required dependancies."""
     },
     {
     'id': 4,
+    'tags': 'python, error handling',
     'title': "Day Four",
     'creation_date': datetime.strptime('10/20/2017 8:44 PM', FMT),
     'body': """So far so good. It's Friday and we finished up doing the basics today. More details on collections. They basically act the same as the collections I have used in other languages, so that is reassuring.\n\nI love the error handling! It can make 'if' statements so much cleaner if used properly. Indeed it is "easier to ask forgiveness than permission." :D"""
     },
     {
     'id': 5,
+    'tags': 'codewars, python',
     'title': "Day Five",
     'creation_date': datetime.strptime('10/21/2017 4:07 PM', FMT),
     'body': """So much coding :D\n\nHad fun with some kata in the fundamentals section of CodeWars. Not as difficult as some of the other ones I have done, in the sense that I didn't bang my head against them for days. However, I did notice that my solutions are not nearly as pythonic as basically anyone else's in the best-practices section. Need more practice writing Python..."""
     },
     {
     'id': 6,
+    'tags': 'sockets, networking',
     'title': "Day Six",
     'creation_date': datetime.strptime('10/23/2017 9:07 PM', FMT),
     'body': """I understand how sockets work. They are created in order to make connections between computers and usually the client side sockets are short lived. However, I do not know why there are always two sockets in the list of sockets at pretty much any port on localhost. Is localhost just constantly listening? Also, when we started our server, another socket was not added to the list. Is this because the server socket replaces the original one? Or is there something else going on here?\n\nI'm good on data structures. Implemented a bunch of these already in Java, so it's just a matter of translating."""
     },
     {
     'id': 7,
+    'tags': 'http, oop',
     'title': "Day Seven",
     'creation_date': datetime.strptime('10/24/2017 10:11 PM', FMT),
     'body': """It is interesting how many similarities there are between the class structures in Java and Python. But, I guess that they should be the same in pretty much every object oriented language.\n\nThe HTTP request/response format seems pretty straight forward, but I was wondering how you are supposed to put the '' at the end of each line. It is probably some special characters, but is it alright to just use a new-line character?"""
     },
     {
     'id': 8,
+    'tags': 'oop, pytest',
     'title': "Day Eight",
     'creation_date': datetime.strptime('10/25/2017 9:25 PM', FMT),
     'body': """Really sped through things today :D Good understanding of using super, and interesting that you can access the class through a class method. I was curious if it is possible to access other super methods besides the first one in MRO. Tried to use a fixture, but it did not act how I thought. I was thinking that you should use it for repeated set-up, like imports, declarations and such, but it doesn't do that. You should only use a fixture for the repeated creation of an object or to return some value."""
     },
     {
     'id': 9,
+    'tags': 'data structures, python',
     'title': "Day Nine",
     'creation_date': datetime.strptime('10/26/2017 9:44 PM', FMT),
     'body': """Those property decorators are great! We used them today to create back and front properties for our queue in order to make it easier to understand. We were getting super confused by the naming of our variables, and so this allowed us to make it much clearer. It is great that you can in practice restrict access to your properties by using this decorator.\n\nOne thing that I like about Python is that you don't have to worry about asynchronicity, at least by default. It doesn't look to be as bad as JavaScript, but then again, I never got into promises."""
     },
     {
     'id': 10,
+    'tags': 'sockets, networking',
     'title': "Day Ten",
     'creation_date': datetime.strptime('10/27/2017 10:59 PM', FMT),
     'body': """So much os. Basically worked on step 3 of the server all day today, and were nearly done! Main issue was just that we had to research how to do everything. This wasn't a bad thing, just time consuming.\n\nNext up, asynchronicity."""
     },
     {
     'id': 11,
+    'tags': 'pyramid, cookiecutter',
     'title': "Day Eleven",
     'creation_date': datetime.strptime('10/30/2017 6:55 PM', FMT),
     'body': """Started learning about Pyramid today, and it doesn't seem too difficult. As long as you attach all the pieces together, it is pretty simple to put together a static site. Curious as to how difficult it is to implement a dynamically filled website.\n\nCookiecutter is great for getting started! Since it builds out the entire repository and the file system, it makes it much easier to build what you want."""
     },
     {
     'id': 12,
+    'tags': 'jinja, data structures',
     'title': "Day Twelve",
     'creation_date': datetime.strptime('10/31/2017 9:35 PM', FMT),
     'body': """Jinja is great! Much of the functionality is an improved version of Handlebars, which is my only point of reference for templating. The fact that you can access the request object inside of the template is fantastic. That should make it much easier to dynamically populate various things, like links etc.\n\nFinally got to a new data structure, the binary heap. I have never made a heap before but, since we are using a list to store the values instead of nodes, it is much easier to operate on than the binary tree that I learned about before. Yay, no recursion."""
@@ -98,18 +110,21 @@ definitions is super awesome! Especially the * for any number of arguments \
     'creation_date': datetime.strptime('11/01/2017 10:16 PM', FMT),
     'title': "Day Thrirteen",
     'body': "SQLAlchemy, all of the Postgres with none of the SQL! \n\nIt is very interesting to interact with a database simply by interacting normally with objects. Definitely need to remember to add and commit changes made in order to actually change the database. This should make it much easier to make complicated queries to the database. Although I think that the reason why it was especially difficult in Node was that everything was asynchronous, which is not the case in Python. <p>I am curious how to implement other types of requests through Pyramid. Besides get requests through anchor tag links, we haven't had much interaction with the front-end side of the web site. I wonder if we just have routes that execute the different requests, like when using Page.js...",
-    'id': 13
+    'id': 13,
+    'tags': 'sqlalchemy, postgres'
     },
     {
     'creation_date': datetime.strptime('11/02/2017 9:56 PM', FMT),
     'title': "Day Fourteen",
     'body': "Let's see. Today we discussed what a graph is. Basically an interconnected web of points that is defined by its points and connections. Pretty interesting, but I think that traversing them is going to be a mess.\n\nWe also went over how to test interactions with the database. Everything made logical sense. You need to work in an isolated testing database in order to not contaminate your actual database. Every request needs to have a database session so that you can actually interact with the database in a test. Finally, you need to be careful of the order you do your operations in so that they do not conflict with each other.\n\nAt the same time, you could make use of this fact to carry out a series of CRUD operations efficiently. Test that you can POST a new model, GET that model, PUT new information into it, and then DELETE it.",
-    'id': 14
+    'id': 14,
+    'tags': 'data structures, testing, sqlalchemy'
     },
     {
     'creation_date': datetime.strptime('11/03/2017 10:19 PM', FMT),
     'title': "Day Fifteen",
     'body': "So much code review!\n\nIt was nice to see people pick apart our rather unnecessarily complicated priority queue. It helps to take a step back and realize which parts are actually necessary. I also noticed that while we did have excellent coverage for our unit tests, we did not really test that the functions still worked properly when used with each other. Like inserting, peeking, then popping and peeking again. I think that we kinda took for granted that the methods worked together if they all worked in isolated tests.\n\nThe never ending quest for more tests! :D",
-    'id': 15
+    'id': 15,
+    'tags': 'code review, testing, data structures'
     }
 ]
@@ -0,0 +1,137 @@
+"""Coalesce editor autosaves in memory and store them in batches.
+
+The editor saves every few seconds while someone types. Each save only
+replaces the pending copy of that draft in this process, so the last save
+wins, and every ``journal.drafts.flush_interval`` seconds the pending drafts
+are written together in one statement. However often the editor saves, a
+draft costs at most one write per interval. Pending drafts are written when
+the process exits, and dropped when the draft is published. Deleting an
+entry drops everyone's drafts of it, since SQLite may give its id to the
+next new entry.
+"""
+from datetime import datetime
+import threading
+
+from .flushing import PeriodicFlush, close_at_exit
+from .models.draft import (
+    Draft,
+    delete_draft,
+    delete_entry_drafts,
+    draft_key,
+    load_draft,
+    save_drafts,
+)
+
+
+class DraftBuffer(PeriodicFlush):
+    """Hold the latest copy of each draft until it is flushed."""
+
+    name = 'draft-buffer'
+
+    def __init__(self, session_factory, interval=5.0):
+        super(DraftBuffer, self).__init__(interval)
+        self.session_factory = session_factory
+        self.pending = {}
+        self.saves = 0
+        # held while a batch is written, so a draft being published can't be
+        # written again after it is deleted
+        self._flushing = threading.Lock()
+
+    def save(self, username, key, title, body, tags, version=None):
+        """Keep a draft to be written, replacing any pending copy of it."""
+        draft = {
+            'username': username, 'key': key, 'title': title, 'body': body,
+            'tags': tags, 'version': version, 'saved_at': datetime.utcnow()
+        }
+        with self._lock:
+            self.pending[username, key] = draft
+            self.saves += 1
+        self._start()
+        return draft
+
+    def get(self, session, username, key):
+        """Get a draft as a dict, pending or stored, or None."""
+        with self._lock:
+            draft = self.pending.get((username, key))
+        if draft is not None:
+            return Draft(**draft).to_dict()
+        draft = load_draft(session, username, key)
+        return draft.to_dict() if draft is not None else None
+
+    def discard(self, session, username, key):
+        """Forget a draft, pending and stored, once it is published."""
+        with self._flushing:
+            with self._lock:
+                self.pending.pop((username, key), None)
+            delete_draft(session, username, key)
+
+    def discard_entries(self, session, keys):
+        """Forget every user's drafts of deleted entries, by draft key."""
+        keys = set(keys)
+        with self._flushing:
+            with self._lock:
+                for name in [name for name in self.pending
+                             if name[1] in keys]:
+                    del self.pending[name]
+            delete_entry_drafts(session, keys)
+
+    def flush(self):
+        """Write every pending draft, returning how many there were."""
+        with self._flushing:
+            return self._flush()
+
+    def _flush(self):
+        with self._lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return 0
+        try:
+            session = self.session_factory()
+            try:
+                save_drafts(session, list(pending.values()))
+                session.commit()
+            finally:
+                session.close()
+        except Exception:
+            with self._lock:
+                for name, draft in pending.items():
+                    self.pending.setdefault(name, draft)
+            raise
+        self.flushes += 1
+        return len(pending)
+
+
+def get_draft(request, entry_id=None):
+    """Get the logged in user's draft for an entry, or a new one."""
+    buffer = request.registry.get('draft_buffer')
+    if buffer is None or request.authenticated_userid is None:
+        return None
+    return buffer.get(request.dbsession, request.authenticated_userid,
+                      draft_key(entry_id))
+
+
+def discard_draft(request, entry_id=None):
+    """Drop the logged in user's draft once it has been published."""
+    buffer = request.registry.get('draft_buffer')
+    if buffer is not None and request.authenticated_userid is not None:
+        buffer.discard(request.dbsession, request.authenticated_userid,
+                       draft_key(entry_id))
+
+
+def discard_entry_drafts(request, entry_ids):
+    """Drop everyone's drafts of entries once they are deleted."""
+    buffer = request.registry.get('draft_buffer')
+    if buffer is not None and entry_ids:
+        buffer.discard_entries(request.dbsession,
+                               [draft_key(entry_id) for entry_id in entry_ids])
+
+
+def includeme(config):
+    """Buffer draft autosaves. Needs pyramid_learning_journal.models."""
+    settings = config.get_settings()
+    buffer = DraftBuffer(
+        config.registry['dbsession_factory'],
+        interval=float(settings.get('journal.drafts.flush_interval', 5))
+    )
+    config.registry['draft_buffer'] = buffer
+    close_at_exit(buffer)
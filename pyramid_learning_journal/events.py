@@ -0,0 +1,362 @@
+"""Events emitted after journal entries are committed to the database.
+
+Views call ``notify_after_commit`` when they change an entry. Subscribers are
+registered with ``config.add_entry_subscriber`` and run either inline, right
+after the commit, or on background worker threads so slow work stays out of
+the request. They never hear about changes that were rolled back.
+
+Delivery to background subscribers is at-least-once. The event is written to
+an outbox table (see ``models.outbox``) in the same transaction as the
+change, and the workers of any process deliver it from there, so it
+survives the process that made it. An event a subscriber keeps failing on
+stays in the outbox after ``max_attempts``. Subscribers may see an event
+more than once and should be idempotent.
+"""
+import atexit
+import logging
+import threading
+import time
+import weakref
+
+import transaction
+
+from .models.outbox import (
+    claim_events,
+    finish_event,
+    pending_events,
+    retry_event,
+    store_event,
+)
+
+log = logging.getLogger(__name__)
+
+# every pipeline still in use, closed once when the interpreter exits
+_pipelines = weakref.WeakSet()
+
+
+class EntryEvent(object):
+    """Base for events about a single journal entry."""
+
+    def __init__(self, entry_id, journal_id=None):
+        """Create an event for the entry with the given id."""
+        self.entry_id = entry_id
+        self.entry_ids = [entry_id]
+        self.journal_ids = [journal_id] if journal_id is not None else []
+        self.registry = None
+
+    @classmethod
+    def restore(cls, entry_ids, journal_ids):
+        """Make the event again from its stored ids."""
+        return cls(entry_ids[0], journal_ids[0] if journal_ids else None)
+
+    def __repr__(self):
+        """Show the event type and the entry it is about."""
+        return '<{} entry_id={}>'.format(type(self).__name__, self.entry_id)
+
+
+class EntryCreated(EntryEvent):
+    """A new entry was added to the journal."""
+
+
+class EntryUpdated(EntryEvent):
+    """An existing entry was changed."""
+
+
+class EntryDeleted(EntryEvent):
+    """An entry was removed from the journal."""
+
+
+class EntriesChanged(EntryEvent):
+    """Many entries were created, updated or deleted in one transaction."""
+
+    def __init__(self, entry_ids, journal_ids=()):
+        """Create one event for all of the changed entries."""
+        super(EntriesChanged, self).__init__(None)
+        self.entry_ids = list(entry_ids)
+        self.journal_ids = list(journal_ids)
+
+    @classmethod
+    def restore(cls, entry_ids, journal_ids):
+        """Make the event again from its stored ids."""
+        return cls(entry_ids, journal_ids)
+
+    def __repr__(self):
+        """Show how many entries changed."""
+        return '<EntriesChanged entry_ids={}>'.format(self.entry_ids)
+
+
+def _event_class(kind):
+    """Get the entry event class with this name."""
+    types = [EntryEvent]
+    while types:
+        cls = types.pop()
+        if cls.__name__ == kind:
+            return cls
+        types.extend(cls.__subclasses__())
+    raise LookupError('Unknown entry event {}'.format(kind))
+
+
+class EventPipeline(object):
+    """Deliver entry events to subscribers after the transaction commits.
+
+    Inline subscribers are called by ``publish``, and a subscriber that raises
+    there is retried up to ``max_attempts`` times. Events for the others go
+    through the outbox in ``session_factory``'s database and are delivered by
+    ``workers`` threads, which claim up to ``batch_size`` events at a time for
+    ``lease`` seconds. The workers look for events every ``poll_interval``
+    seconds, and at once after a commit in this process. A failed delivery is
+    tried again ``retry_delay`` seconds later, then twice that, and so on.
+    With ``workers=0``, or no session factory, every subscriber is inline.
+    """
+
+    def __init__(self, session_factory=None, workers=2, batch_size=100,
+                 max_attempts=3, retry_delay=1.0, poll_interval=1.0,
+                 lease=60.0):
+        """Create a pipeline with no subscribers."""
+        self.session_factory = session_factory
+        self.workers = workers if session_factory is not None else 0
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.registry = None
+        self.subscribers = []
+        self.counts = {
+            'published': 0,
+            'stored': 0,
+            'delivered': 0,
+            'retried': 0,
+            'failed': 0,
+        }
+        self.max_queue_depth = 0
+        self._lock = threading.Lock()
+        self._threads = []
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        # batches being delivered, so drain can wait for the workers' too
+        self._active = 0
+        self._idle = threading.Condition(self._lock)
+
+    def subscribe(self, callback, event_type=EntryEvent, inline=False):
+        """Call callback with every event that is an event_type."""
+        self.subscribers.append((event_type, callback, inline))
+
+    def queued(self, event):
+        """Tell whether any subscriber gets the event through the outbox."""
+        return self.workers > 0 and any(
+            isinstance(event, event_type) and not inline
+            for event_type, _, inline in self.subscribers)
+
+    def store(self, session, event):
+        """Add the event to the outbox, in the session's transaction."""
+        store_event(session, type(event).__name__, event.entry_ids,
+                    event.journal_ids)
+        self._count('stored')
+
+    def publish(self, event, stored=False):
+        """Send an event to every interested subscriber.
+
+        Inline subscribers are called now. For the others the event is put in
+        the outbox, unless it was ``stored`` with the change already, and the
+        workers are woken up.
+        """
+        self._count('published')
+        for event_type, callback, inline in self.subscribers:
+            if isinstance(event, event_type) and (inline or not self.workers):
+                self.deliver(callback, event)
+        if self.queued(event):
+            if not stored:
+                session = self.session_factory()
+                try:
+                    self.store(session, event)
+                    session.commit()
+                finally:
+                    session.close()
+            self._start()
+            self._wake.set()
+
+    def deliver(self, callback, event):
+        """Call one subscriber, retrying it if it fails."""
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                callback(event)
+            except Exception:
+                if attempt == self.max_attempts:
+                    self._count('failed')
+                    log.exception('Gave up delivering %r to %r after %d '
+                                  'attempts', event, callback, attempt)
+                    return False
+                self._count('retried')
+                time.sleep(self.retry_delay * attempt)
+            else:
+                self._count('delivered')
+                return True
+
+    def stats(self):
+        """Get the delivery counts and the number of events in the outbox."""
+        depth = self._depth()
+        with self._lock:
+            self.max_queue_depth = max(self.max_queue_depth, depth)
+            stats = dict(self.counts)
+            stats['max_queue_depth'] = self.max_queue_depth
+        stats['queue_depth'] = depth
+        return stats
+
+    def drain(self):
+        """Block until every event due in the outbox has been delivered."""
+        if not self.workers:
+            return
+        while self._deliver_batch():
+            pass
+        with self._idle:
+            self._idle.wait_for(lambda: not self._active)
+
+    def close(self):
+        """Deliver the events that are due and stop the workers."""
+        self.drain()
+        self._stopping.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self._stopping.clear()
+        _pipelines.discard(self)
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def _depth(self):
+        if not self.workers:
+            return 0
+        session = self.session_factory()
+        try:
+            return pending_events(session, self.max_attempts)
+        finally:
+            session.close()
+
+    def _start(self):
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:  # pragma: no cover
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(
+                    target=self._work, name='entry-events-{}'.format(i))
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while not self._stopping.is_set():
+            try:
+                delivered = self._deliver_batch()
+            except Exception:
+                log.exception('Could not read the entry event outbox')
+                delivered = 0
+            if not delivered:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+    def _deliver_batch(self):
+        """Claim due events and deliver them, returning how many there were."""
+        with self._idle:
+            self._active += 1
+        try:
+            session = self.session_factory()
+            try:
+                events = claim_events(session, self.lease, self.batch_size,
+                                      self.max_attempts)
+                session.commit()
+                if events:
+                    depth = pending_events(session, self.max_attempts)
+                    with self._lock:
+                        self.max_queue_depth = max(self.max_queue_depth, depth)
+                for stored in events:
+                    self._deliver_stored(session, stored)
+                    session.commit()
+                return len(events)
+            finally:
+                session.close()
+        finally:
+            with self._idle:
+                self._active -= 1
+                self._idle.notify_all()
+
+    def _deliver_stored(self, session, stored):
+        try:
+            event = _event_class(stored.kind).restore(*stored.ids())
+            event.registry = self.registry
+            for event_type, callback, inline in self.subscribers:
+                if isinstance(event, event_type) and not inline:
+                    callback(event)
+                    self._count('delivered')
+        except Exception:
+            attempts = stored.attempts + 1
+            if attempts >= self.max_attempts:
+                self._count('failed')
+                log.exception('Gave up delivering %s event %d after %d '
+                              'attempts', stored.kind, stored.id, attempts)
+            else:
+                self._count('retried')
+                log.warning('Delivering %s event %d failed, will retry',
+                            stored.kind, stored.id, exc_info=True)
+            retry_event(session, stored.id,
+                        self.retry_delay * 2 ** (attempts - 1))
+        else:
+            finish_event(session, stored.id)
+
+
+@atexit.register
+def _close_pipelines():
+    for pipeline in list(_pipelines):
+        pipeline.close()
+
+
+def _publish_if_committed(status, pipeline, event, stored):
+    if status:
+        pipeline.publish(event, stored)
+
+
+def notify_after_commit(request, event):
+    """Publish the event once the request's transaction has committed.
+
+    The event goes into the outbox now, so it is committed with the change.
+    """
+    pipeline = request.registry.get('entry_events')
+    if pipeline is None:
+        return
+    event.registry = request.registry
+    stored = pipeline.queued(event)
+    if stored:
+        pipeline.store(request.dbsession, event)
+    manager = getattr(request, 'tm', transaction.manager)
+    manager.get().addAfterCommitHook(
+        _publish_if_committed, args=(pipeline, event, stored))
+
+
+def add_entry_subscriber(config, callback, event_type=EntryEvent,
+                         inline=False):
+    """Configurator directive to subscribe to entry events."""
+    callback = config.maybe_dotted(callback)
+    event_type = config.maybe_dotted(event_type)
+    config.registry['entry_events'].subscribe(callback, event_type, inline)
+
+
+def includeme(config):
+    """Set up the entry events. Needs pyramid_learning_journal.models."""
+    settings = config.get_settings()
+    pipeline = EventPipeline(
+        config.registry.get('dbsession_factory'),
+        workers=int(settings.get('journal.events.workers', 2)),
+        batch_size=int(settings.get('journal.events.batch_size', 100)),
+        max_attempts=int(settings.get('journal.events.max_attempts', 3)),
+        retry_delay=float(settings.get('journal.events.retry_delay', 1)),
+        poll_interval=float(settings.get('journal.events.poll_interval', 1))
+    )
+    pipeline.registry = config.registry
+    config.registry['entry_events'] = pipeline
+    config.add_directive('add_entry_subscriber', add_entry_subscriber)
+    _pipelines.add(pipeline)
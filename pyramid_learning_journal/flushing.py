@@ -0,0 +1,73 @@
+"""A base for work held in memory and written to the database in batches."""
+from abc import ABC, abstractmethod
+import atexit
+import logging
+import threading
+import weakref
+
+log = logging.getLogger(__name__)
+
+# what close_at_exit was given; one handler closes them all, however many
+# apps a process makes, and an app that is thrown away drops out of it
+_closing = weakref.WeakSet()
+
+
+def close_at_exit(closable):
+    """Call closable.close() when the process exits."""
+    _closing.add(closable)
+
+
+@atexit.register
+def _close_all():
+    for closable in list(_closing):
+        closable.close()
+
+
+class PeriodicFlush(ABC):
+    """Call ``flush()`` every ``interval`` seconds on a background thread.
+
+    The thread is started by the first ``_start()``, so a process that never
+    collects anything (like the parent of forked workers) never runs one.
+    With no interval nothing is flushed until ``flush()`` or ``close()``.
+    """
+
+    name = 'periodic-flush'
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.flushes = 0
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    @abstractmethod
+    def flush(self):
+        """Write what has been collected."""
+
+    def close(self):
+        """Stop the background thread and write what is left."""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        try:
+            self.flush()
+        except Exception:
+            log.exception('%s could not write what was left', self.name)
+
+    def _start(self):
+        if self._thread is not None or not self.interval:
+            return
+        with self._lock:
+            if self._thread is not None:  # pragma: no cover
+                return
+            self._thread = threading.Thread(target=self._work, name=self.name)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _work(self):
+        while not self._stopping.wait(self.interval):
+            try:
+                self.flush()
+            except Exception:
+                log.exception('%s failed to flush, will try again', self.name)
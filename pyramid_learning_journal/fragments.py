@@ -0,0 +1,105 @@
+"""Cache rendered pieces of Jinja2 templates with ``{% cache %}``.
+
+::
+
+    {% cache 'card', entry.id, entry.version, entry.body %}
+        ...
+    {% endcache %}
+
+The body is rendered the first time a key is seen and its markup is reused
+after that, so the key has to name everything the body depends on. The parts
+of the key are hashed together, so whole values can be part of it. Only the
+``journal.fragments.max_entries`` most recently used fragments are kept, in
+this process.
+"""
+from collections import OrderedDict
+from hashlib import sha1
+from jinja2 import nodes
+from jinja2.ext import Extension
+from pyramid_jinja2 import EXTRAS_CONFIG_PHASE
+import threading
+
+
+class FragmentCache(object):
+    """A bounded LRU of rendered markup, with hit counts."""
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self.counts = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self._fragments = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_render(self, key, render):
+        """Get the markup for key, rendering and keeping it if missing."""
+        with self._lock:
+            markup = self._fragments.get(key)
+            if markup is not None:
+                self._fragments.move_to_end(key)
+                self.counts['hits'] += 1
+                return markup
+            self.counts['misses'] += 1
+        markup = render()
+        with self._lock:
+            self._fragments[key] = markup
+            self._fragments.move_to_end(key)
+            while len(self._fragments) > self.max_entries:
+                self._fragments.popitem(last=False)
+                self.counts['evictions'] += 1
+        return markup
+
+    def clear(self):
+        """Forget every fragment."""
+        with self._lock:
+            self._fragments.clear()
+
+    def stats(self):
+        """Get the counts, the number of fragments and the hit rate."""
+        with self._lock:
+            stats = dict(self.counts)
+            stats['fragments'] = len(self._fragments)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+
+class FragmentCacheExtension(Extension):
+    """Add the ``{% cache key, ... %}...{% endcache %}`` tag."""
+
+    tags = set(['cache'])
+
+    def __init__(self, environment):
+        super(FragmentCacheExtension, self).__init__(environment)
+        environment.extend(fragment_cache=FragmentCache())
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            key.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method('_render', [nodes.List(key)]), [], [], body
+        ).set_lineno(lineno)
+
+    def _render(self, key, caller):
+        digest = sha1()
+        for part in key:
+            digest.update(str(part).encode('utf-8'))
+            digest.update(b'\0')
+        key = '{}:{}'.format(key[0], digest.hexdigest())
+        return self.environment.fragment_cache.get_or_render(key, caller)
+
+
+def includeme(config):
+    """Add the cache tag to the .jinja2 renderer. Needs pyramid_jinja2."""
+    settings = config.get_settings()
+    cache = FragmentCache(
+        int(settings.get('journal.fragments.max_entries', 1000)))
+    config.registry['fragment_cache'] = cache
+
+    def register():
+        environment = config.get_jinja2_environment()
+        environment.add_extension(FragmentCacheExtension)
+        environment.fragment_cache = cache
+
+    config.action(None, register, order=EXTRAS_CONFIG_PHASE)
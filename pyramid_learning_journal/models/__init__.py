@@ -1,11 +1,23 @@
 from sqlalchemy import engine_from_config
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm import configure_mappers
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy.pool import StaticPool
+from pyramid_retry import mark_error_retryable
 import zope.sqlalchemy
 
 # import or define all models here to ensure they are attached to the
 # Base.metadata prior to any initialization routines
+from .journal import Journal, User  # flake8: noqa
 from .mymodel import Entry  # flake8: noqa
+from .revision import EntryRevision  # flake8: noqa
+from .tag import Tag  # flake8: noqa
+from .archive import MonthlyCount  # flake8: noqa
+from .related import EntryVector, RelatedEntry, TfidfModel  # flake8: noqa
+from .viewcount import EntryViewCount, MostRead  # flake8: noqa
+from .draft import Draft  # flake8: noqa
+from .attachment import Attachment  # flake8: noqa
+from .outbox import OutboxEvent  # flake8: noqa
 
 # run configure_mappers after defining all of the models to ensure
 # all relationships can be setup
@@ -13,6 +25,14 @@ configure_mappers()
 
 
 def get_engine(settings, prefix='sqlalchemy.'):
+    if settings.get(prefix + 'url') in ('sqlite://', 'sqlite:///:memory:'):
+        # every connection to an in-memory SQLite database is a new, empty
+        # database, so all sessions have to share the one connection
+        return engine_from_config(
+            settings, prefix,
+            poolclass=StaticPool,
+            connect_args={'check_same_thread': False}
+        )
     return engine_from_config(settings, prefix)
 
 
@@ -64,6 +84,11 @@ def includeme(config):
 
     # use pyramid_retry to retry a request when transient exceptions occur
     config.include('pyramid_retry')
+    config.include('pyramid_learning_journal.retry')
+
+    # an entry changed between loading and flushing is loaded again on the
+    # next attempt, where the edit view sees the new version
+    mark_error_retryable(StaleDataError)
 
     session_factory = get_session_factory(get_engine(settings))
     config.registry['dbsession_factory'] = session_factory
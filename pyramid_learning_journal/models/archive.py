@@ -0,0 +1,99 @@
+"""Entry counts per month, kept up to date as entries come and go."""
+from sqlalchemy import (
+    Column,
+    Integer,
+    bindparam,
+    extract,
+    func,
+    text,
+)
+from sqlalchemy.orm import subqueryload
+
+from .baking import bakery
+from .meta import Base
+from .mymodel import Entry
+from datetime import datetime
+
+# one statement for both Postgres and SQLite (3.24 and up), so when the first
+# two entries of a month are written at once the second adds to the row the
+# first inserted instead of inserting it again
+COUNT_ENTRY = text(
+    'INSERT INTO monthly_counts (year, month, entry_count) '
+    'VALUES (:year, :month, :change) '
+    'ON CONFLICT (year, month) DO UPDATE '
+    'SET entry_count = monthly_counts.entry_count + excluded.entry_count'
+)
+
+
+class MonthlyCount(Base):
+    """Create a table with the number of entries written in each month."""
+
+    __tablename__ = 'monthly_counts'
+    year = Column(Integer, primary_key=True)
+    month = Column(Integer, primary_key=True)
+    entry_count = Column(Integer, nullable=False, default=0)
+
+
+def count_entry(session, creation_date, change=1):
+    """Add change to the count for the month of creation_date."""
+    key = {'year': creation_date.year, 'month': creation_date.month}
+    # the ORM update also marks the session as changed for pyramid_tm
+    updated = session.query(MonthlyCount).filter_by(**key).update(
+        {MonthlyCount.entry_count: MonthlyCount.entry_count + change},
+        synchronize_session=False
+    )
+    if not updated:
+        session.execute(COUNT_ENTRY, dict(key, change=change))
+
+
+def rebuild_monthly_counts(session):
+    """Recount every month from the entries table."""
+    session.query(MonthlyCount).delete(synchronize_session=False)
+    year = extract('year', Entry.creation_date)
+    month = extract('month', Entry.creation_date)
+    rows = session.query(year, month, func.count(Entry.id)).group_by(
+        year, month
+    ).all()
+    session.add_all([
+        MonthlyCount(year=int(y), month=int(m), entry_count=count)
+        for y, m, count in rows
+    ])
+
+
+def archive_months(session):
+    """Get every month with entries and its count, newest first."""
+    months = session.query(
+        MonthlyCount.year, MonthlyCount.month, MonthlyCount.entry_count
+    ).filter(
+        MonthlyCount.entry_count > 0
+    ).order_by(MonthlyCount.year.desc(), MonthlyCount.month.desc())
+    return [{
+        'year': year,
+        'month': month,
+        'name': datetime(year, month, 1).strftime('%B %Y'),
+        'count': count
+    } for year, month, count in months]
+
+
+def month_range(year, month):
+    """Get the first moment of the month and of the month after it.
+
+    Raises ValueError for a month datetime can't hold the end of.
+    """
+    start = datetime(year, month, 1)
+    if month == 12:
+        return start, datetime(year + 1, 1, 1)
+    return start, datetime(year, month + 1, 1)
+
+
+_between = bakery(lambda session: session.query(Entry).filter(
+    Entry.creation_date >= bindparam('start'),
+    Entry.creation_date < bindparam('end')
+).options(
+    subqueryload(Entry.tags)
+).order_by(Entry.creation_date.desc()))
+
+
+def entries_between(session, start, end):
+    """Get the entries written from start up to end, newest first."""
+    return _between(session).params(start=start, end=end).all()
@@ -0,0 +1,67 @@
+"""Files attached to journal entries.
+
+A row only describes an upload. The bytes are stored once per distinct
+content, under their sha256, by ``pyramid_learning_journal.attachments``, so
+the same image attached to many entries is one file on disk.
+"""
+from sqlalchemy import (
+    Column,
+    DateTime,
+    ForeignKey,
+    Integer,
+    String,
+    Unicode,
+    UniqueConstraint,
+)
+from sqlalchemy.orm import backref, relationship
+
+from .meta import Base
+from datetime import datetime
+from pytz import utc
+
+
+class Attachment(Base):
+    """Create a table of the files attached to each entry."""
+
+    __tablename__ = 'attachments'
+    id = Column(Integer, primary_key=True)
+    entry_id = Column(
+        Integer, ForeignKey('entries.id', ondelete='CASCADE'), nullable=False)
+    sha256 = Column(String(64), nullable=False, index=True)
+    filename = Column(Unicode(255), nullable=False)
+    content_type = Column(Unicode(255), nullable=False)
+    size = Column(Integer, nullable=False)
+    creation_date = Column(DateTime)
+
+    entry = relationship('Entry', backref=backref(
+        'attachments',
+        cascade='all, delete-orphan',
+        lazy='dynamic',
+        order_by='Attachment.id'
+    ))
+
+    __table_args__ = (
+        UniqueConstraint('entry_id', 'sha256', 'filename'),
+    )
+
+    def __init__(self, *args, **kwargs):
+        """Initialize a new attachment dated now."""
+        super(Attachment, self).__init__(*args, **kwargs)
+        self.creation_date = datetime.now(utc)
+
+    def to_dict(self):
+        """Take the attachment's attributes as a dict."""
+        return {
+            'id': self.id,
+            'sha256': self.sha256,
+            'filename': self.filename,
+            'content_type': self.content_type,
+            'size': self.size,
+        }
+
+
+def find_attachment(session, sha256, filename):
+    """Get an attachment with this content and name, or None."""
+    return session.query(Attachment).filter(
+        Attachment.sha256 == sha256, Attachment.filename == filename
+    ).first()
@@ -0,0 +1,66 @@
+"""One shared cache of baked queries and their compiled statements.
+
+Building a ``Query`` and compiling its SQL costs more Python time than
+running the query on a small indexed table. A baked query is built once, the
+first time it runs, and kept here keyed by the code of the lambdas that make
+it; its statement is compiled once per dialect and kept here too. Values
+change from call to call only through ``bindparam``, so every later call
+skips straight to executing the cached statement.
+
+The cache counts how often each kind of lookup is a hit, so
+``query_cache_stats()`` shows whether the hot paths really are reused.
+"""
+from sqlalchemy.engine.interfaces import Dialect
+from sqlalchemy.ext.baked import BakedQuery, Bakery
+from sqlalchemy.util import LRUCache
+import threading
+
+BAKERY_SIZE = 200
+
+
+class CountingLRUCache(LRUCache):
+    """An LRUCache counting hits and misses of queries and statements.
+
+    Baked queries are keyed by a tuple of code objects and compiled
+    statements by a tuple starting with the dialect they were compiled for.
+    """
+
+    def __init__(self, capacity=BAKERY_SIZE):
+        super(CountingLRUCache, self).__init__(capacity)
+        self.counts = {
+            'queries': {'hits': 0, 'misses': 0},
+            'statements': {'hits': 0, 'misses': 0},
+        }
+        self._count_lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Look up a key, counting whether it was there."""
+        value = super(CountingLRUCache, self).get(key, default)
+        kind = 'statements' if isinstance(key[0], Dialect) else 'queries'
+        with self._count_lock:
+            self.counts[kind]['misses' if value is default else 'hits'] += 1
+        return value
+
+    def stats(self):
+        """Get the counts and hit rate of each kind, and the cache size."""
+        with self._count_lock:
+            stats = {kind: dict(counts) for kind, counts in self.counts.items()}
+        for counts in stats.values():
+            lookups = counts['hits'] + counts['misses']
+            counts['hit_rate'] = counts['hits'] / lookups if lookups else 0.0
+        stats['size'] = len(self)
+        return stats
+
+    def reset_counts(self):
+        """Start counting again from zero."""
+        with self._count_lock:
+            for counts in self.counts.values():
+                counts.update(hits=0, misses=0)
+
+
+bakery = Bakery(BakedQuery, CountingLRUCache())
+
+
+def query_cache_stats():
+    """Get the hit rates of the baked query and compiled statement cache."""
+    return bakery.cache.stats()
@@ -0,0 +1,262 @@
+"""Create, update and delete many entries at once with bulk statements.
+
+Every operation is checked first against one query of the entries it names.
+The ones that pass are then applied with a handful of executemany statements
+per kind of change, rather than a flush per entry, and the tags, monthly
+counts and revisions are brought up to date once for the whole batch.
+"""
+from sqlalchemy import and_, bindparam
+from sqlalchemy.orm.exc import StaleDataError
+
+from .journal import DEFAULT_JOURNAL
+from .mymodel import Entry
+from ..rendering import render_markdown, renderer_key
+from .archive import count_entry
+from .revision import EntryRevision, record_revisions
+from .tag import entry_tags, get_tag_ids, parse_tags, recount_tags
+from collections import Counter
+from datetime import datetime
+from pytz import utc
+
+OPERATIONS = ('create', 'update', 'delete')
+
+
+class BatchError(ValueError):
+    """One operation in a batch can not be applied."""
+
+
+def _text(operation, field, required):
+    value = operation.get(field)
+    if value is None and not required:
+        return None
+    if not isinstance(value, str):
+        raise BatchError('{} must be a string'.format(field))
+    return value
+
+
+def _tags(operation):
+    tags = operation.get('tags')
+    if tags is None:
+        return None
+    if isinstance(tags, list) and all(isinstance(tag, str) for tag in tags):
+        tags = ','.join(tags)
+    if not isinstance(tags, str):
+        raise BatchError('tags must be a string or a list of strings')
+    return parse_tags(tags)
+
+
+def _entry_id(operation):
+    entry_id = operation.get('id')
+    if not isinstance(entry_id, int) or isinstance(entry_id, bool):
+        raise BatchError('id must be an integer')
+    return entry_id
+
+
+def _current_entries(session, operations, journal_id=DEFAULT_JOURNAL):
+    """Load the journal's entries named by update and delete operations."""
+    ids = set()
+    for operation in operations:
+        if isinstance(operation, dict) and operation.get('op') != 'create':
+            try:
+                ids.add(_entry_id(operation))
+            except BatchError:
+                pass
+    if not ids:
+        return {}
+    query = session.query(
+        Entry.id, Entry.title, Entry.body, Entry.version, Entry.creation_date
+    ).filter(Entry.id.in_(list(ids)), Entry.journal_id == journal_id)
+    # lock only for the length of this transaction, so nothing changes
+    # between the version check and the bulk update
+    return {row.id: row for row in query.with_for_update()}
+
+
+def _check(operation, current, seen):
+    """Check one operation, returning what it will change."""
+    if not isinstance(operation, dict):
+        raise BatchError('operation must be an object')
+    op = operation.get('op')
+    if op not in OPERATIONS:
+        raise BatchError('op must be one of {}'.format(', '.join(OPERATIONS)))
+    if op == 'create':
+        return {
+            'title': _text(operation, 'title', True),
+            'body': _text(operation, 'body', True),
+            'tags': _tags(operation),
+        }
+
+    entry_id = _entry_id(operation)
+    entry = current.get(entry_id)
+    if entry is None:
+        raise BatchError('no entry with id {}'.format(entry_id))
+    if entry_id in seen:
+        raise BatchError('entry {} is already changed in this batch'.format(
+            entry_id))
+    change = {'id': entry_id, 'entry': entry}
+    if op == 'update':
+        change.update({
+            'title': _text(operation, 'title', False),
+            'body': _text(operation, 'body', False),
+            'tags': _tags(operation),
+        })
+    return change
+
+
+def _insert_entries(session, rows):
+    """Insert entry rows, returning their new ids in order."""
+    table = Entry.__table__
+    if not rows:
+        return []
+    if session.get_bind().dialect.name == 'postgresql':
+        result = session.execute(table.insert().values(rows).returning(table.c.id))
+        return [entry_id for entry_id, in result]
+    return [
+        session.execute(table.insert(), row).inserted_primary_key[0]
+        for row in rows
+    ]
+
+
+def _update_entries(session, rows):
+    """Update title and body of entries still at the version that was read."""
+    if not rows:
+        return
+    table = Entry.__table__
+    result = session.execute(table.update().where(and_(
+        table.c.id == bindparam('_id'),
+        table.c.version == bindparam('_version')
+    )).values(
+        title=bindparam('_title'),
+        body=bindparam('_body'),
+        html=bindparam('_html'),
+        html_key=renderer_key(),
+        version=table.c.version + 1
+    ), rows)
+    if (session.get_bind().dialect.supports_sane_multi_rowcount and
+            result.rowcount != len(rows)):
+        raise StaleDataError('entries changed while the batch was applied')
+
+
+def _delete_entries(session, entry_ids):
+    """Delete entries along with their revisions."""
+    if not entry_ids:
+        return
+    session.execute(EntryRevision.__table__.delete().where(
+        EntryRevision.entry_id.in_(entry_ids)))
+    session.execute(Entry.__table__.delete().where(Entry.id.in_(entry_ids)))
+
+
+def _replace_tags(session, tags_by_entry):
+    """Give each entry exactly its list of tag names, then recount them."""
+    if not tags_by_entry:
+        return
+    current = {}
+    for entry_id, tag_id in session.query(
+            entry_tags.c.entry_id, entry_tags.c.tag_id).filter(
+            entry_tags.c.entry_id.in_(list(tags_by_entry))):
+        current.setdefault(entry_id, set()).add(tag_id)
+    names = set(name for names in tags_by_entry.values() for name in names)
+    tag_ids = get_tag_ids(session, sorted(names))
+
+    removed, added = [], []
+    for entry_id, names in tags_by_entry.items():
+        wanted = set(tag_ids[name] for name in names)
+        had = current.get(entry_id, set())
+        removed.extend({'_entry_id': entry_id, '_tag_id': tag_id}
+                       for tag_id in had - wanted)
+        added.extend({'entry_id': entry_id, 'tag_id': tag_id}
+                     for tag_id in wanted - had)
+    if removed:
+        session.execute(entry_tags.delete().where(and_(
+            entry_tags.c.entry_id == bindparam('_entry_id'),
+            entry_tags.c.tag_id == bindparam('_tag_id')
+        )), removed)
+    if added:
+        session.execute(entry_tags.insert(), added)
+    recount_tags(session, set(row['_tag_id'] for row in removed) |
+                 set(row['tag_id'] for row in added))
+
+
+def apply_batch(session, operations, journal_id=DEFAULT_JOURNAL):
+    """Apply a list of operations to one journal, returning per-item results.
+
+    Operations that fail their checks are reported and skipped; the rest are
+    applied. Entries of other journals are treated as missing. Also returns
+    the ids of every entry that was changed.
+    """
+    current = _current_entries(session, operations, journal_id)
+    results = []
+    creates, updates, deletes = [], [], []
+    seen = set()
+    for index, operation in enumerate(operations):
+        result = {'index': index}
+        results.append(result)
+        try:
+            change = _check(operation, current, seen)
+        except BatchError as error:
+            result.update({'status': 'error', 'error': str(error)})
+            continue
+        result['op'] = operation['op']
+        version = operation.get('version')
+        if 'entry' in change and version is not None and (
+                version != change['entry'].version):
+            result.update({
+                'status': 'conflict',
+                'id': change['id'],
+                'version': change['entry'].version
+            })
+            continue
+        seen.add(change.get('id'))
+        change['result'] = result
+        {'create': creates, 'update': updates,
+         'delete': deletes}[operation['op']].append(change)
+
+    now = datetime.now(utc)
+    months = Counter()
+    tags_by_entry = {}
+
+    ids = _insert_entries(session, [{
+        'journal_id': journal_id,
+        'title': change['title'], 'body': change['body'],
+        'html': render_markdown(change['body']), 'html_key': renderer_key(),
+        'creation_date': now, 'version': 1
+    } for change in creates])
+    for entry_id, change in zip(ids, creates):
+        change['result'].update(
+            {'status': 'created', 'id': entry_id, 'version': 1})
+        months[now.year, now.month] += 1
+        if change['tags']:
+            tags_by_entry[entry_id] = change['tags']
+
+    rows, revisions = [], []
+    for change in updates:
+        entry = change['entry']
+        title = entry.title if change['title'] is None else change['title']
+        body = entry.body if change['body'] is None else change['body']
+        if change['tags'] is not None:
+            tags_by_entry[entry.id] = change['tags']
+        version = entry.version
+        if (title, body) != (entry.title, entry.body):
+            rows.append({'_id': entry.id, '_version': entry.version,
+                         '_title': title, '_body': body,
+                         '_html': render_markdown(body)})
+            revisions.append((entry.id, entry.title, entry.body, title, body))
+            version += 1
+        change['result'].update(
+            {'status': 'updated', 'id': entry.id, 'version': version})
+    _update_entries(session, rows)
+    record_revisions(session, revisions)
+
+    for change in deletes:
+        entry = change['entry']
+        tags_by_entry[entry.id] = []
+        months[entry.creation_date.year, entry.creation_date.month] -= 1
+        change['result'].update({'status': 'deleted', 'id': entry.id})
+
+    _replace_tags(session, tags_by_entry)
+    _delete_entries(session, [change['id'] for change in deletes])
+    for (year, month), change in months.items():
+        if change:
+            count_entry(session, datetime(year, month, 1), change)
+
+    changed = ids + [change['id'] for change in updates + deletes]
+    return results, changed
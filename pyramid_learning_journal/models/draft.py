@@ -0,0 +1,90 @@
+"""Unsaved work in the entry editor, kept until it is published.
+
+There is one draft per user for a new entry (``key`` is ``'new'``) and one
+per entry being edited (``key`` is its id). Drafts are written in batches,
+and a batch never replaces a draft saved later than its own copy, so the
+last save wins even when saves went to different processes.
+
+A draft of an edit keeps the version of the entry it was started from, so
+publishing it after someone else's edit goes to the merge page instead of
+overwriting their work.
+"""
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Integer,
+    Unicode,
+    UnicodeText,
+    bindparam,
+    text,
+)
+
+from .meta import Base
+
+NEW = 'new'
+
+# one statement for both Postgres and SQLite (3.24 and up)
+SAVE_DRAFTS = text(
+    'INSERT INTO drafts '
+    '(username, key, title, body, tags, version, saved_at) '
+    'VALUES (:username, :key, :title, :body, :tags, :version, :saved_at) '
+    'ON CONFLICT (username, key) DO UPDATE SET '
+    'title = excluded.title, body = excluded.body, tags = excluded.tags, '
+    'version = excluded.version, saved_at = excluded.saved_at '
+    'WHERE drafts.saved_at < excluded.saved_at'
+).bindparams(bindparam('saved_at', type_=DateTime()))
+
+
+class Draft(Base):
+    """Create a table of the drafts being written."""
+
+    __tablename__ = 'drafts'
+    username = Column(Unicode(255), primary_key=True)
+    key = Column(Unicode(32), primary_key=True)
+    title = Column(Unicode, nullable=False, default='')
+    body = Column(UnicodeText, nullable=False, default='')
+    tags = Column(Unicode, nullable=False, default='')
+    # the version of the entry being edited when the draft was started
+    version = Column(Integer)
+    saved_at = Column(DateTime, nullable=False)
+
+    def to_dict(self):
+        """Get the fields of the draft as a dictionary."""
+        return {
+            'key': self.key,
+            'title': self.title,
+            'body': self.body,
+            'tags': self.tags,
+            'version': self.version,
+            'saved_at': self.saved_at.isoformat(),
+        }
+
+
+def draft_key(entry_id=None):
+    """Get the key of the draft for an entry, or for a new one."""
+    return NEW if entry_id is None else str(entry_id)
+
+
+def save_drafts(session, drafts):
+    """Write a list of draft dicts, keeping any that were saved later."""
+    if drafts:
+        session.execute(SAVE_DRAFTS, drafts)
+
+
+def load_draft(session, username, key):
+    """Get a stored draft, or None."""
+    return session.query(Draft).get((username, key))
+
+
+def delete_draft(session, username, key):
+    """Forget a stored draft."""
+    session.query(Draft).filter(
+        Draft.username == username, Draft.key == key
+    ).delete(synchronize_session=False)
+
+
+def delete_entry_drafts(session, keys):
+    """Forget every user's drafts of some entries, by draft key."""
+    session.query(Draft).filter(
+        Draft.key.in_(list(keys))
+    ).delete(synchronize_session=False)
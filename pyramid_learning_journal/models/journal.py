@@ -0,0 +1,145 @@
+"""Authors and their journals, so one site can host a journal per person.
+
+Every entry belongs to one journal, and ``entries`` has an index on
+``(journal_id, creation_date)``, so a journal's page is a range scan of its
+own entries however many other journals there are. The journal with id
+``DEFAULT_JOURNAL`` is made along with the table and holds the entries of the
+original single journal site; it has no owner row and belongs to the
+``AUTH_USERNAME`` account configured in the environment.
+"""
+from sqlalchemy import (
+    Column,
+    ForeignKey,
+    Integer,
+    Unicode,
+    bindparam,
+    event,
+)
+from sqlalchemy.orm import relationship
+from passlib.apps import custom_app_context as pwd_context
+
+from .baking import bakery
+from .meta import Base
+import os
+import re
+
+DEFAULT_JOURNAL = 1
+DEFAULT_SLUG = 'main'
+DEFAULT_TITLE = 'Learning Journal'
+SLUG = re.compile(r'^[a-z0-9][a-z0-9-]{0,63}$')
+
+
+class User(Base):
+    """Create a table for the authors who can log in."""
+
+    __tablename__ = 'users'
+    id = Column(Integer, primary_key=True)
+    username = Column(Unicode(255), nullable=False, unique=True)
+    password = Column(Unicode(255), nullable=False)
+
+    def set_password(self, password):
+        """Store a hash of the password."""
+        self.password = pwd_context.hash(password)
+
+    def check_password(self, password):
+        """Tell whether the password is this user's."""
+        return pwd_context.verify(password, self.password)
+
+
+class Journal(Base):
+    """Create a table for the journals, each written by one author."""
+
+    __tablename__ = 'journals'
+    id = Column(Integer, primary_key=True)
+    slug = Column(Unicode(64), nullable=False, unique=True)
+    title = Column(Unicode(255), nullable=False)
+    owner_id = Column(Integer, ForeignKey('users.id'))
+
+    owner = relationship('User', backref='journals')
+
+
+@event.listens_for(Journal.__table__, 'after_create')
+def add_default_journal(target, connection, **kw):
+    """Make the journal the entries of a single journal site belong to."""
+    connection.execute(target.insert(), {
+        'id': DEFAULT_JOURNAL, 'slug': DEFAULT_SLUG, 'title': DEFAULT_TITLE})
+    if connection.dialect.name == 'postgresql':
+        # the id was given, so the sequence has to be moved past it
+        connection.execute(
+            "SELECT setval(pg_get_serial_sequence('journals', 'id'), "
+            "(SELECT max(id) FROM journals))")
+
+
+def owner_name(username):
+    """Get who owns a journal, given its owner's username or None."""
+    return username or os.environ.get('AUTH_USERNAME', '')
+
+
+_by_slug = bakery(lambda session: session.query(
+    Journal.id, Journal.slug, Journal.title, User.username
+).outerjoin(User, User.id == Journal.owner_id).filter(
+    Journal.slug == bindparam('slug')))
+
+_by_id = bakery(lambda session: session.query(
+    Journal.id, Journal.slug, Journal.title, User.username
+).outerjoin(User, User.id == Journal.owner_id).filter(
+    Journal.id == bindparam('id')))
+
+_by_owner = bakery(lambda session: session.query(
+    Journal.id, Journal.slug, Journal.title, User.username
+).join(User, User.id == Journal.owner_id).filter(
+    User.username == bindparam('username')
+).order_by(Journal.id).limit(1))
+
+
+def journal_dict(row):
+    """Turn a row of id, slug, title and owner's username into a dict."""
+    if row is None:
+        return None
+    journal_id, slug, title, username = row
+    return {'id': journal_id, 'slug': slug, 'title': title,
+            'owner': owner_name(username)}
+
+
+def find_journal(session, slug=None, journal_id=None):
+    """Get a journal as a dict by its slug or its id, or None."""
+    if slug is not None:
+        return journal_dict(_by_slug(session).params(slug=slug).first())
+    return journal_dict(_by_id(session).params(id=journal_id).first())
+
+
+def owned_journal(session, username):
+    """Get the first journal a user in the users table owns, or None."""
+    return journal_dict(_by_owner(session).params(username=username).first())
+
+
+def find_user(session, username):
+    """Get the user with this username, or None."""
+    return session.query(User).filter(User.username == username).first()
+
+
+def add_journal(session, slug, title, username, password=None):
+    """Make a journal owned by a user, making the user too if needed.
+
+    Raises ValueError when the slug is taken or not a valid slug, when the
+    username is the account in the environment, or when a new user is given
+    no password.
+    """
+    if not SLUG.match(slug):
+        raise ValueError('slug must be lowercase letters, digits and dashes')
+    if session.query(Journal.id).filter(Journal.slug == slug).first():
+        raise ValueError('there is already a journal at {}'.format(slug))
+    if username == os.environ.get('AUTH_USERNAME'):
+        raise ValueError('{} is the account in the environment'.format(
+            username))
+    user = find_user(session, username)
+    if user is None:
+        if not password:
+            raise ValueError('a new user needs a password')
+        user = User(username=username)
+        user.set_password(password)
+        session.add(user)
+    journal = Journal(slug=slug, title=title or slug, owner=user)
+    session.add(journal)
+    session.flush()
+    return journal
@@ -1,13 +1,25 @@
 from sqlalchemy import (
     Column,
     DateTime,
+    ForeignKey,
+    Index,
     Integer,
     Unicode,
+    UnicodeText,
+    and_,
+    bindparam,
+    event,
+    inspect,
+    or_,
+    select,
 )
+from sqlalchemy.orm import subqueryload
 
+from .baking import bakery
+from .journal import DEFAULT_JOURNAL, Journal, User, journal_dict
 from .meta import Base
 from datetime import datetime
-from markdown import markdown
+from ..rendering import render_markdown, renderer_key
 from pytz import timezone as tz
 from pytz import utc
 import sys
@@ -18,12 +30,29 @@ class Entry(Base):
 
     __tablename__ = 'entries'
     id = Column(Integer, primary_key=True)
+    journal_id = Column(Integer, ForeignKey('journals.id'), nullable=False,
+                        default=DEFAULT_JOURNAL)
     title = Column(Unicode)
     body = Column(Unicode)
-    creation_date = Column(DateTime)
+    creation_date = Column(DateTime, index=True)
+    version = Column(Integer, nullable=False)
+    html = Column(UnicodeText)
+    # sha1 hex of the key of the renderer that made the html
+    html_key = Column(Unicode(40))
+
+    # every UPDATE checks and bumps the version, so an edit made from a stale
+    # copy of the entry fails instead of overwriting the newer one
+    __mapper_args__ = {'version_id_col': version}
+
+    # a journal's entries in order are one range of this index
+    __table_args__ = (
+        Index('ix_entries_journal_id_creation_date',
+              'journal_id', 'creation_date'),
+    )
 
     def __init__(self, creation_date=None, *args, **kwargs):
         """Initialize a new journal entry with current date."""
+        kwargs.setdefault('journal_id', DEFAULT_JOURNAL)
         super(Entry, self).__init__(*args, **kwargs)
         if creation_date:
             self.creation_date = tz('US/Pacific').localize(creation_date)
@@ -39,13 +68,133 @@ class Entry(Base):
 
         return {
             'id': self.id,
+            'journal_id': self.journal_id,
             'title': self.title,
             'body': self.body,
+            'tags': [tag.name for tag in self.tags],
+            'version': self.version,
             'creation_date': local_creation_date.strftime('%A, %B %d, %Y, %I:%M %p')
         }
 
     def to_html_dict(self):
         """Take all model attributes and render them as a dict with html."""
         attr = self.to_dict()
-        attr['body'] = markdown(attr['body'])
+        if self.html is not None and self.html_key == renderer_key():
+            attr['body'] = self.html
+        else:
+            attr['body'] = render_markdown(attr['body'])
         return attr
+
+
+@event.listens_for(Entry, 'before_insert')
+@event.listens_for(Entry, 'before_update')
+def render_html(mapper, connection, target):
+    """Store the html of an entry whenever its body is written."""
+    if target.html is None or inspect(target).attrs.body.history.has_changes():
+        target.html = render_markdown(target.body)
+        target.html_key = renderer_key()
+
+
+# the hot read paths, baked so they are built and compiled once
+_entry = bakery(lambda session: session.query(Entry))
+
+_newest = bakery(lambda session: session.query(Entry).options(
+    subqueryload(Entry.tags)
+).order_by(Entry.creation_date.desc(), Entry.id.desc()))
+
+_first_batch = _newest + (lambda query: query.limit(bindparam('size')))
+
+_next_batch = _newest + (lambda query: query.filter(or_(
+    Entry.creation_date < bindparam('date'),
+    and_(Entry.creation_date == bindparam('date'),
+         Entry.id < bindparam('id'))
+)).limit(bindparam('size')))
+
+
+def _of_entry(column, name='id'):
+    return select([column]).where(Entry.id == bindparam(name)).as_scalar()
+
+
+# the entries just before and after one in its journal; the first two
+# conditions keep each a range scan of the (journal_id, creation_date) index
+_older = bakery(lambda session: session.query(Entry.id, Entry.title).filter(
+    Entry.journal_id == _of_entry(Entry.journal_id),
+    Entry.creation_date <= _of_entry(Entry.creation_date),
+    or_(Entry.creation_date < _of_entry(Entry.creation_date),
+        Entry.id < bindparam('id'))
+).order_by(Entry.creation_date.desc(), Entry.id.desc()).limit(1))
+
+_newer = bakery(lambda session: session.query(Entry.id, Entry.title).filter(
+    Entry.journal_id == _of_entry(Entry.journal_id),
+    Entry.creation_date >= _of_entry(Entry.creation_date),
+    or_(Entry.creation_date > _of_entry(Entry.creation_date),
+        Entry.id > bindparam('id'))
+).order_by(Entry.creation_date, Entry.id).limit(1))
+
+# one page of a journal, newest first, starting after the entry before
+_journal_entries = bakery(lambda session: session.query(Entry).options(
+    subqueryload(Entry.tags)
+).filter(
+    Entry.journal_id == bindparam('journal_id')
+).order_by(Entry.creation_date.desc(), Entry.id.desc()))
+
+
+def _page_of(query):
+    return query.limit(bindparam('size'))
+
+
+_journal_page = _journal_entries + _page_of
+
+_journal_next_page = _journal_entries + (lambda query: query.filter(
+    _of_entry(Entry.journal_id, 'before') == bindparam('journal_id'),
+    Entry.creation_date <= _of_entry(Entry.creation_date, 'before'),
+    or_(Entry.creation_date < _of_entry(Entry.creation_date, 'before'),
+        Entry.id < bindparam('before'))
+)) + _page_of
+
+_journal_of_entry = bakery(lambda session: session.query(
+    Journal.id, Journal.slug, Journal.title, User.username
+).join(Entry, Entry.journal_id == Journal.id).outerjoin(
+    User, User.id == Journal.owner_id
+).filter(Entry.id == bindparam('id')))
+
+
+def load_entry(session, entry_id):
+    """Get an entry by id, or None."""
+    return _entry(session).get(entry_id)
+
+
+def newest_entries(session):
+    """Get every entry with its tags, newest first."""
+    return _newest(session).all()
+
+
+def entry_batch(session, size, after=None):
+    """Get the next size entries, newest first, that come after an entry."""
+    if after is None:
+        return _first_batch(session).params(size=size).all()
+    return _next_batch(session).params(
+        size=size, date=after.creation_date, id=after.id).all()
+
+
+def entry_neighbors(session, entry_id):
+    """Get the id and title of the entries written before and after one."""
+    neighbors = {}
+    for name, query in (('older', _older), ('newer', _newer)):
+        row = query(session).params(id=entry_id).first()
+        neighbors[name] = {'id': row[0], 'title': row[1]} if row else None
+    return neighbors
+
+
+def journal_entries(session, journal_id, size, before=None):
+    """Get size entries of a journal, newest first, after its entry before."""
+    if before is None:
+        return _journal_page(session).params(
+            journal_id=journal_id, size=size).all()
+    return _journal_next_page(session).params(
+        journal_id=journal_id, size=size, before=before).all()
+
+
+def entry_journal(session, entry_id):
+    """Get the journal an entry belongs to as a dict, or None."""
+    return journal_dict(_journal_of_entry(session).params(id=entry_id).first())
@@ -0,0 +1,104 @@
+"""Entry events waiting for the background subscribers, kept in the database.
+
+An event is written in the same transaction as the change it is about, so
+it is stored if and only if the change is committed, and survives the
+process that made it. Workers claim due events by moving ``available_at``
+into the future, which doubles as a lease: if a worker dies while
+delivering, the event comes due again and another worker delivers it. An
+event is deleted once delivered, and one that has failed ``max_attempts``
+times is kept, with its attempts, for someone to look at.
+"""
+from datetime import datetime, timedelta
+import json
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Index,
+    Integer,
+    Unicode,
+    UnicodeText,
+    and_,
+)
+
+from .meta import Base
+
+
+class OutboxEvent(Base):
+    """Create a table of the entry events not delivered yet."""
+
+    __tablename__ = 'event_outbox'
+    id = Column(Integer, primary_key=True)
+    kind = Column(Unicode(32), nullable=False)
+    entry_ids = Column(UnicodeText, nullable=False)
+    journal_ids = Column(UnicodeText, nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    # when the event may next be claimed
+    available_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index('ix_event_outbox_available_at', 'available_at'),
+    )
+
+    def ids(self):
+        """Get the entry ids and journal ids of the event as lists."""
+        return json.loads(self.entry_ids), json.loads(self.journal_ids)
+
+
+def store_event(session, kind, entry_ids, journal_ids):
+    """Add an event to the outbox, in the session's transaction."""
+    session.add(OutboxEvent(
+        kind=kind,
+        entry_ids=json.dumps(list(entry_ids)),
+        journal_ids=json.dumps(list(journal_ids)),
+        attempts=0,
+        available_at=datetime.utcnow()
+    ))
+
+
+def claim_events(session, lease, limit, max_attempts):
+    """Claim up to limit due events for lease seconds, oldest first.
+
+    An event another worker claimed in the meantime is skipped, since its
+    ``available_at`` is no longer due.
+    """
+    now = datetime.utcnow()
+    table = OutboxEvent.__table__
+    due = [event_id for event_id, in session.query(OutboxEvent.id).filter(
+        OutboxEvent.available_at <= now,
+        OutboxEvent.attempts < max_attempts
+    ).order_by(OutboxEvent.id).limit(limit)]
+    until = now + timedelta(seconds=lease)
+    claimed = [event_id for event_id in due if session.execute(
+        table.update().where(and_(
+            table.c.id == event_id, table.c.available_at <= now
+        )).values(available_at=until)
+    ).rowcount]
+    if not claimed:
+        return []
+    return session.query(OutboxEvent).filter(
+        OutboxEvent.id.in_(claimed)
+    ).order_by(OutboxEvent.id).all()
+
+
+def finish_event(session, event_id):
+    """Drop a delivered event."""
+    session.query(OutboxEvent).filter(
+        OutboxEvent.id == event_id
+    ).delete(synchronize_session=False)
+
+
+def retry_event(session, event_id, delay):
+    """Count a failed delivery and make the event due again after delay."""
+    table = OutboxEvent.__table__
+    session.execute(table.update().where(table.c.id == event_id).values(
+        attempts=table.c.attempts + 1,
+        available_at=datetime.utcnow() + timedelta(seconds=delay)
+    ))
+
+
+def pending_events(session, max_attempts):
+    """Count the events still to be delivered."""
+    return session.query(OutboxEvent).filter(
+        OutboxEvent.attempts < max_attempts
+    ).count()
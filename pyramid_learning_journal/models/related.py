@@ -0,0 +1,537 @@
+"""Related entries, found with TF-IDF vectors of the entry bodies.
+
+Each entry's vector is stored sparse, as the columns and float32 weights of
+its nonzero terms, and its top few most similar entries are stored in
+``related_entries``, so showing them costs one indexed lookup. The
+vocabulary and IDF weights only change on a full rebuild.
+
+In between, ``update_related`` keeps everything up to date a write at a
+time. ``term_postings`` is an inverted index of the entries using each term,
+so a changed entry is only scored against the entries it shares a term
+with. Each vector also keeps the score a newcomer has to beat to get into
+its entry's list, so the lists a write might change are found with an
+indexed range scan, and the number of vectors is counted as they come and
+go. A write never reads every vector or every list.
+"""
+from sqlalchemy import (
+    Column,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    LargeBinary,
+    MetaData,
+    Table,
+    UnicodeText,
+    bindparam,
+    inspect,
+)
+
+from .baking import bakery
+from .meta import Base
+from .mymodel import Entry
+from collections import Counter
+import json
+import numpy as np
+import re
+
+TOP_K = 5
+MAX_TERMS = 4096
+ROWS_PER_BLOCK = 512
+
+STOP_WORDS = frozenset("""
+a about after all also an and any are as at be because been but by can could
+did do does doing don't for from get got had has have how i i'm if in into is
+it it's its just like more much my not of on one or our out so some than that
+the their them then there these they this to too up us very was we were what
+when which while who will with would you your
+""".split())
+
+
+class TfidfModel(Base):
+    """Create a table holding the vocabulary and IDF weights in use."""
+
+    __tablename__ = 'tfidf_models'
+    id = Column(Integer, primary_key=True)
+    vocabulary = Column(UnicodeText, nullable=False)
+    idf = Column(LargeBinary, nullable=False)
+    # the entries the vocabulary was picked from, and those with a vector now
+    entry_count = Column(Integer, nullable=False)
+    vector_count = Column(Integer, nullable=False, default=0)
+
+    def terms(self):
+        """Get a dict of each term to its column in the vectors."""
+        return {term: i for i, term in enumerate(json.loads(self.vocabulary))}
+
+    def weights(self):
+        """Get the IDF weights as a float32 array."""
+        return np.frombuffer(self.idf, dtype=np.float32)
+
+
+class EntryVector(Base):
+    """Create a table for the nonzero TF-IDF weights of each entry."""
+
+    __tablename__ = 'entry_sparse_vectors'
+    # no foreign key: the vector of a deleted entry is still needed to take
+    # it out of the postings, and update_related drops it after that
+    entry_id = Column(Integer, primary_key=True)
+    # int32 columns in the vocabulary, and the float32 weight of each
+    columns = Column(LargeBinary, nullable=False)
+    weights = Column(LargeBinary, nullable=False)
+    # the score a new neighbor has to beat: the worst one in a full list
+    threshold = Column(Float, nullable=False, default=0)
+
+    __table_args__ = (
+        Index('ix_entry_sparse_vectors_threshold', 'threshold'),
+    )
+
+    @classmethod
+    def from_vector(cls, entry_id, vector):
+        """Get the row of a dense vector as a dict for a bulk insert."""
+        columns = np.flatnonzero(vector).astype(np.int32)
+        return {'entry_id': int(entry_id), 'columns': columns.tobytes(),
+                'weights': vector[columns].tobytes(), 'threshold': 0.0}
+
+    def sparse(self):
+        """Get the columns and weights of the vector as arrays."""
+        return (np.frombuffer(self.columns, dtype=np.int32),
+                np.frombuffer(self.weights, dtype=np.float32))
+
+
+class TermPostings(Base):
+    """Create a table of the entries using each term, and their weights."""
+
+    __tablename__ = 'term_postings'
+    term = Column(Integer, primary_key=True)
+    # int32 entry ids in order, and the float32 weight of the term in each
+    entry_ids = Column(LargeBinary, nullable=False)
+    weights = Column(LargeBinary, nullable=False)
+
+
+class RelatedEntry(Base):
+    """Create a table for the most similar entries to each entry."""
+
+    __tablename__ = 'related_entries'
+    entry_id = Column(Integer, ForeignKey('entries.id', ondelete='CASCADE'),
+                      primary_key=True)
+    rank = Column(Integer, primary_key=True)
+    # no foreign key, so the lists naming a deleted entry can still be found;
+    # related_entries joins the entry, so they never show it
+    related_id = Column(Integer, nullable=False)
+    score = Column(Float, nullable=False)
+
+    __table_args__ = (
+        Index('ix_related_entries_related_id', 'related_id'),
+    )
+
+
+RELATED_TABLES = [
+    TfidfModel.__table__,
+    EntryVector.__table__,
+    TermPostings.__table__,
+    RelatedEntry.__table__,
+]
+
+# tables the related entries were kept in before, no longer used
+LEGACY_TABLES = ('entry_vectors',)
+
+
+def tokenize(text):
+    """Split text into lowercase words, leaving out common ones."""
+    words = re.findall(r"[a-z][a-z0-9_']+", (text or '').lower())
+    return [word for word in words if word not in STOP_WORDS]
+
+
+def build_model(bodies, max_terms=MAX_TERMS):
+    """Pick a vocabulary from the bodies and weigh each term by its IDF."""
+    document_frequency = Counter()
+    for body in bodies:
+        document_frequency.update(set(tokenize(body)))
+    common = sorted(
+        document_frequency.items(), key=lambda item: (-item[1], item[0])
+    )[:max_terms]
+    vocabulary = sorted(term for term, _ in common)
+    count = len(bodies)
+    idf = np.array([
+        np.log((1.0 + count) / (1.0 + document_frequency[term])) + 1.0
+        for term in vocabulary
+    ], dtype=np.float32)
+    return TfidfModel(
+        id=1,
+        vocabulary=json.dumps(vocabulary),
+        idf=idf.tobytes(),
+        entry_count=count
+    )
+
+
+def vectorize(text, terms, idf):
+    """Turn text into a unit length TF-IDF vector of float32s."""
+    vector = np.zeros(len(idf), dtype=np.float32)
+    for word, count in Counter(tokenize(text)).items():
+        column = terms.get(word)
+        if column is not None:
+            vector[column] = count
+    vector *= idf
+    norm = np.linalg.norm(vector)
+    if norm:
+        vector /= norm
+    return vector
+
+
+def _top_k(scores, own_id, ids, k):
+    """Get the (id, score) pairs of the k best scores, best first."""
+    scores = scores.copy()
+    scores[ids == own_id] = -1
+    count = min(k, max(len(scores) - 1, 0))
+    if not count:
+        return []
+    best = np.argpartition(-scores, count - 1)[:count]
+    best = best[np.argsort(-scores[best], kind='mergesort')]
+    return [(int(ids[i]), float(scores[i])) for i in best if scores[i] > 0]
+
+
+class SparseRows(object):
+    """Sparse vectors, one row per entry id, in compressed row form."""
+
+    def __init__(self, ids, lengths, columns, weights, width):
+        self.ids = ids
+        self.columns = columns
+        self.weights = weights
+        self.width = width
+        self.starts = np.concatenate(([0], np.cumsum(lengths))).astype(int)
+        # the row of each weight
+        self.rows = np.repeat(np.arange(len(ids)), lengths)
+
+    @classmethod
+    def from_blobs(cls, ids, columns, weights, width):
+        """Make the rows from the stored column and weight blobs of each."""
+        return cls(
+            np.array(ids, dtype=np.int64),
+            [len(blob) // 4 for blob in columns],
+            np.frombuffer(b''.join(columns), dtype=np.int32),
+            np.frombuffer(b''.join(weights), dtype=np.float32),
+            width
+        )
+
+    def block(self, start, stop):
+        """Get rows start to stop as a dense float32 matrix."""
+        stop = min(stop, len(self.ids))
+        lo, hi = self.starts[start], self.starts[stop]
+        block = np.zeros((stop - start, self.width), dtype=np.float32)
+        block[self.rows[lo:hi] - start, self.columns[lo:hi]] = (
+            self.weights[lo:hi])
+        return block
+
+
+def _block_neighbors(matrix, start, k):
+    """Get the top k (id, score) pairs of each row in a block of rows.
+
+    The other rows are compared a block at a time too, keeping the best
+    so far, so only two dense blocks are ever held rather than every vector.
+    """
+    rows = matrix.block(start, start + ROWS_PER_BLOCK)
+    count = len(matrix.ids)
+    best_scores = np.zeros((len(rows), 0), dtype=np.float32)
+    best_ids = np.zeros((len(rows), 0), dtype=np.int64)
+    each = np.arange(len(rows))[:, None]
+    for other in range(0, count, ROWS_PER_BLOCK):
+        scores = rows.dot(matrix.block(other, other + ROWS_PER_BLOCK).T)
+        ids = matrix.ids[other:other + ROWS_PER_BLOCK]
+        # an entry is never its own neighbor
+        same = np.arange(max(start, other),
+                         min(start + len(rows), other + len(ids)))
+        scores[same - start, same - other] = -1
+        best_scores = np.hstack([best_scores, scores])
+        best_ids = np.hstack([best_ids, np.broadcast_to(ids, scores.shape)])
+        if best_scores.shape[1] > k:
+            keep = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+            best_scores = best_scores[each, keep]
+            best_ids = best_ids[each, keep]
+    order = np.argsort(-best_scores, axis=1, kind='mergesort')
+    best_scores, best_ids = best_scores[each, order], best_ids[each, order]
+    return {
+        int(matrix.ids[start + row]): [
+            (int(related_id), float(score))
+            for related_id, score in zip(best_ids[row], best_scores[row])
+            if score > 0
+        ] for row in range(len(rows))
+    }
+
+
+def _store_neighbors(session, rows):
+    """Replace the related entries of each entry id in rows."""
+    if not rows:
+        return
+    session.query(RelatedEntry).filter(
+        RelatedEntry.entry_id.in_(list(rows))
+    ).delete(synchronize_session=False)
+    session.bulk_insert_mappings(RelatedEntry, [
+        {'entry_id': entry_id, 'rank': rank, 'related_id': related_id,
+         'score': score}
+        for entry_id, neighbors in rows.items()
+        for rank, (related_id, score) in enumerate(neighbors)
+    ])
+
+
+def _threshold(neighbors, k):
+    """Get the score a new neighbor has to beat to get into a list."""
+    return neighbors[-1][1] if len(neighbors) >= k else 0.0
+
+
+def _postings_rows(matrix):
+    """Turn sparse rows around into the postings of each term."""
+    order = np.argsort(matrix.columns, kind='mergesort')
+    columns = matrix.columns[order]
+    entry_ids = matrix.ids[matrix.rows][order].astype(np.int32)
+    weights = matrix.weights[order]
+    terms, starts = np.unique(columns, return_index=True)
+    stops = np.append(starts[1:], len(columns))
+    return [{'term': int(term), 'entry_ids': entry_ids[start:stop].tobytes(),
+             'weights': weights[start:stop].tobytes()}
+            for term, start, stop in zip(terms, starts, stops)]
+
+
+def rebuild_related(session, k=TOP_K, max_terms=MAX_TERMS):
+    """Rebuild the vocabulary, every vector and every list of neighbors."""
+    entries = session.query(Entry.id, Entry.body).order_by(Entry.id).all()
+    model = build_model([body for _, body in entries], max_terms)
+    model.vector_count = len(entries)
+    terms, idf = model.terms(), model.weights()
+
+    session.query(RelatedEntry).delete(synchronize_session=False)
+    session.query(TermPostings).delete(synchronize_session=False)
+    session.query(EntryVector).delete(synchronize_session=False)
+    session.merge(model)
+
+    rows = [EntryVector.from_vector(entry_id, vectorize(body, terms, idf))
+            for entry_id, body in entries]
+    matrix = SparseRows.from_blobs([row['entry_id'] for row in rows],
+                                   [row['columns'] for row in rows],
+                                   [row['weights'] for row in rows], len(idf))
+    session.bulk_insert_mappings(TermPostings, _postings_rows(matrix))
+
+    for start in range(0, len(rows), ROWS_PER_BLOCK):
+        neighbors = _block_neighbors(matrix, start, k)
+        _store_neighbors(session, neighbors)
+        for row in rows[start:start + ROWS_PER_BLOCK]:
+            row['threshold'] = _threshold(neighbors[row['entry_id']], k)
+    session.bulk_insert_mappings(EntryVector, rows)
+    session.flush()
+    return len(rows)
+
+
+class Postings(object):
+    """The postings of some terms, changed in memory and written back."""
+
+    def __init__(self, session):
+        self.session = session
+        self.terms = {}
+        self.changed = set()
+
+    def load(self, terms, lock=False):
+        """Read the postings of the terms not read yet."""
+        terms = sorted(set(int(term) for term in terms) - set(self.terms))
+        if not terms:
+            return
+        query = self.session.query(
+            TermPostings.term, TermPostings.entry_ids, TermPostings.weights
+        ).filter(TermPostings.term.in_(terms)).order_by(TermPostings.term)
+        if lock:
+            query = query.with_for_update()
+        for term in terms:
+            self.terms[term] = (np.zeros(0, dtype=np.int32),
+                                np.zeros(0, dtype=np.float32))
+        for term, entry_ids, weights in query:
+            self.terms[term] = (np.frombuffer(entry_ids, dtype=np.int32),
+                                np.frombuffer(weights, dtype=np.float32))
+
+    def replace(self, entry_ids, vectors):
+        """Take entries out of the loaded postings and put in new vectors."""
+        entry_ids = np.array(sorted(entry_ids), dtype=np.int32)
+        added = {}
+        for entry_id, (columns, weights) in vectors.items():
+            for column, weight in zip(columns, weights):
+                added.setdefault(int(column), []).append((entry_id, weight))
+        for term, (ids, weights) in list(self.terms.items()):
+            keep = ~np.isin(ids, entry_ids)
+            new = sorted(added.get(term, []))
+            if keep.all() and not new:
+                continue
+            ids = np.append(ids[keep], [entry_id for entry_id, _ in new])
+            weights = np.append(weights[keep], [weight for _, weight in new])
+            order = np.argsort(ids, kind='mergesort')
+            self.terms[term] = (ids[order].astype(np.int32),
+                                weights[order].astype(np.float32))
+            self.changed.add(term)
+
+    def scores(self, columns, weights):
+        """Get the entries sharing a term with a vector, and their scores."""
+        self.load(columns)
+        parts = [self.terms[int(column)] for column in columns]
+        if not parts:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        ids = np.concatenate([ids for ids, _ in parts])
+        products = np.concatenate([
+            posted * weight for (_, posted), weight in zip(parts, weights)])
+        ids, row = np.unique(ids, return_inverse=True)
+        return ids, np.bincount(row, weights=products, minlength=len(ids))
+
+    def write(self):
+        """Write back the postings that were changed."""
+        changed = sorted(self.changed)
+        self.session.query(TermPostings).filter(
+            TermPostings.term.in_(changed)
+        ).delete(synchronize_session=False)
+        self.session.bulk_insert_mappings(TermPostings, [
+            {'term': term, 'entry_ids': self.terms[term][0].tobytes(),
+             'weights': self.terms[term][1].tobytes()}
+            for term in changed if len(self.terms[term][0])
+        ])
+
+
+def _listing(session, entry_ids):
+    """Get the ids of the entries that list any of these as related."""
+    return {entry_id for entry_id, in session.query(
+        RelatedEntry.entry_id
+    ).filter(RelatedEntry.related_id.in_(list(entry_ids))).distinct()}
+
+
+def _thresholds_below(session, score, entry_ids):
+    """Get the thresholds below a score, of the lists of other entries."""
+    return dict(session.query(
+        EntryVector.entry_id, EntryVector.threshold
+    ).filter(
+        EntryVector.threshold < score,
+        ~EntryVector.entry_id.in_(list(entry_ids))
+    ))
+
+
+def _current_lists(session, entry_ids):
+    """Get the stored (id, score) pairs of each entry id, best first."""
+    lists = {entry_id: [] for entry_id in entry_ids}
+    for entry_id, related_id, score in session.query(
+            RelatedEntry.entry_id, RelatedEntry.related_id, RelatedEntry.score
+    ).filter(RelatedEntry.entry_id.in_(list(entry_ids))).order_by(
+            RelatedEntry.entry_id, RelatedEntry.rank):
+        lists[entry_id].append((related_id, score))
+    return lists
+
+
+def update_related(session, entry_ids, k=TOP_K):
+    """Bring the index up to date after these entries were written.
+
+    The changed entries get new vectors and lists, worked out from the
+    entries they share a term with. Lists that named a changed entry are
+    worked out again the same way, and a changed entry is added to the full
+    lists whose threshold it beats. The whole index is rebuilt if there is
+    none yet, or if the journal has doubled in size since the vocabulary
+    was picked. Concurrent updates wait for each other on the model row.
+    """
+    model = session.query(TfidfModel).filter(
+        TfidfModel.id == 1).with_for_update().first()
+    if model is None or model.vector_count > 2 * max(model.entry_count, 1):
+        return rebuild_related(session, k)
+    terms, idf = model.terms(), model.weights()
+
+    entry_ids = set(entry_ids)
+    old = {vector.entry_id: vector.sparse() for vector in session.query(
+        EntryVector).filter(EntryVector.entry_id.in_(list(entry_ids)))}
+    vectors = {}
+    for entry_id, body in session.query(Entry.id, Entry.body).filter(
+            Entry.id.in_(list(entry_ids))):
+        vector = vectorize(body, terms, idf)
+        columns = np.flatnonzero(vector).astype(np.int32)
+        vectors[entry_id] = (columns, vector[columns])
+    removed = entry_ids - set(vectors)
+    relisted = _listing(session, entry_ids) - entry_ids
+
+    postings = Postings(session)
+    postings.load([column for columns, _ in
+                   list(old.values()) + list(vectors.values())
+                   for column in columns], lock=True)
+    postings.replace(entry_ids, vectors)
+    postings.write()
+    model.vector_count += len(vectors) - len(old)
+
+    lists, candidates = {}, {}
+    for entry_id, vector in vectors.items():
+        ids, scores = candidates[entry_id] = postings.scores(*vector)
+        lists[entry_id] = _top_k(scores, entry_id, ids, k)
+    for vector in session.query(EntryVector).filter(
+            EntryVector.entry_id.in_(list(relisted))):
+        ids, scores = postings.scores(*vector.sparse())
+        lists[vector.entry_id] = _top_k(scores, vector.entry_id, ids, k)
+
+    best = max([lists[entry_id][0][1] for entry_id in vectors
+                if lists[entry_id]] + [0])
+    if best > 0:
+        thresholds = _thresholds_below(session, best, entry_ids | relisted)
+        added = {}
+        for entry_id, (ids, scores) in candidates.items():
+            for other, score in zip(ids, scores):
+                threshold = thresholds.get(int(other))
+                if threshold is not None and score > threshold:
+                    added.setdefault(int(other), []).append(
+                        (entry_id, float(score)))
+        for other, neighbors in _current_lists(session, added).items():
+            lists[other] = sorted(neighbors + added[other],
+                                  key=lambda pair: -pair[1])[:k]
+
+    session.query(RelatedEntry).filter(
+        RelatedEntry.entry_id.in_(list(removed))
+    ).delete(synchronize_session=False)
+    _store_neighbors(session, lists)
+    session.query(EntryVector).filter(
+        EntryVector.entry_id.in_(list(entry_ids))
+    ).delete(synchronize_session=False)
+    session.bulk_insert_mappings(EntryVector, [
+        {'entry_id': entry_id, 'columns': columns.tobytes(),
+         'weights': weights.tobytes(),
+         'threshold': _threshold(lists[entry_id], k)}
+        for entry_id, (columns, weights) in vectors.items()
+    ])
+    session.bulk_update_mappings(EntryVector, [
+        {'entry_id': entry_id, 'threshold': _threshold(neighbors, k)}
+        for entry_id, neighbors in lists.items() if entry_id not in vectors
+    ])
+    session.flush()
+    return len(lists)
+
+
+def upgrade_related_tables(engine):
+    """Make the related entry tables match the models, dropping old ones.
+
+    A table whose columns or foreign keys differ from its model is dropped
+    and created again. They only hold what ``rebuild_related`` works out
+    from the entries, so run it after this.
+    """
+    existing = inspect(engine)
+    names = set(existing.get_table_names())
+    legacy = MetaData()
+    for name in LEGACY_TABLES:
+        if name in names:
+            Table(name, legacy).drop(engine)
+    outdated = [table for table in RELATED_TABLES if table.name in names and (
+        {column['name'] for column in existing.get_columns(table.name)} !=
+        set(table.columns.keys()) or
+        {tuple(key['constrained_columns'])
+         for key in existing.get_foreign_keys(table.name)} !=
+        {tuple(key.parent.name for key in constraint.elements)
+         for constraint in table.foreign_key_constraints}
+    )]
+    Base.metadata.drop_all(engine, tables=outdated)
+    Base.metadata.create_all(engine, tables=RELATED_TABLES)
+    return [table.name for table in outdated]
+
+
+_related = bakery(lambda session: session.query(Entry.id, Entry.title).join(
+    RelatedEntry, RelatedEntry.related_id == Entry.id
+).filter(
+    RelatedEntry.entry_id == bindparam('entry_id')
+).order_by(RelatedEntry.rank))
+
+
+def related_entries(session, entry_id):
+    """Get the id and title of the entries most like this one."""
+    rows = _related(session).params(entry_id=entry_id)
+    return [{'id': related_id, 'title': title} for related_id, title in rows]
@@ -0,0 +1,189 @@
+"""Revision history for journal entries, stored as compressed line deltas."""
+from sqlalchemy import (
+    Boolean,
+    Column,
+    DateTime,
+    ForeignKey,
+    Integer,
+    LargeBinary,
+    Unicode,
+    UniqueConstraint,
+    func,
+)
+from sqlalchemy.orm import backref, relationship
+
+from .meta import Base
+from datetime import datetime
+from difflib import SequenceMatcher
+from pytz import utc
+import json
+import zlib
+
+# Every SNAPSHOT_EVERY revisions the whole body is stored instead of a delta,
+# so rebuilding any revision never applies more than SNAPSHOT_EVERY - 1 deltas.
+SNAPSHOT_EVERY = 10
+
+
+def encode_delta(old, new):
+    """Describe how to turn the old text into the new text, line by line.
+
+    The delta is a list where ``[start, end]`` copies those lines from the
+    old text and a string is inserted as is.
+    """
+    old_lines = old.splitlines(True)
+    new_lines = new.splitlines(True)
+    delta = []
+    matcher = SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            delta.append([i1, i2])
+        elif j2 > j1:
+            delta.append(''.join(new_lines[j1:j2]))
+    return delta
+
+
+def apply_delta(old, delta):
+    """Rebuild the new text from the old text and a delta."""
+    old_lines = old.splitlines(True)
+    parts = []
+    for op in delta:
+        if isinstance(op, list):
+            parts.extend(old_lines[op[0]:op[1]])
+        else:
+            parts.append(op)
+    return ''.join(parts)
+
+
+def _pack(value):
+    return zlib.compress(json.dumps(value).encode('utf-8'))
+
+
+def _unpack(data):
+    return json.loads(zlib.decompress(data).decode('utf-8'))
+
+
+class EntryRevision(Base):
+    """Create a table for past versions of journal entries."""
+
+    __tablename__ = 'entry_revisions'
+    id = Column(Integer, primary_key=True)
+    entry_id = Column(Integer, ForeignKey('entries.id'), nullable=False)
+    number = Column(Integer, nullable=False)
+    title = Column(Unicode)
+    is_snapshot = Column(Boolean(name='is_snapshot'), nullable=False, default=False)
+    data = Column(LargeBinary, nullable=False)
+    creation_date = Column(DateTime)
+
+    entry = relationship('Entry', backref=backref(
+        'revisions',
+        cascade='all, delete-orphan',
+        lazy='dynamic',
+        order_by='EntryRevision.number'
+    ))
+
+    __table_args__ = (
+        UniqueConstraint('entry_id', 'number'),
+    )
+
+    def __init__(self, *args, **kwargs):
+        """Initialize a new revision dated now."""
+        super(EntryRevision, self).__init__(*args, **kwargs)
+        self.creation_date = datetime.now(utc)
+
+    def to_dict(self):
+        """Take the revision's attributes, without the body, as a dict."""
+        return {
+            'number': self.number,
+            'title': self.title,
+            'size': len(self.data),
+            'is_snapshot': self.is_snapshot,
+            'creation_date': self.creation_date.strftime('%B %d, %Y, %I:%M %p')
+        }
+
+
+def _revision_data(number, body, previous_body):
+    if previous_body is None or number % SNAPSHOT_EVERY == 1:
+        return True, _pack(body)
+    return False, _pack(encode_delta(previous_body, body))
+
+
+def _new_revision(entry, number, title, body, previous_body):
+    revision = EntryRevision(entry=entry, number=number, title=title)
+    revision.is_snapshot, revision.data = _revision_data(
+        number, body, previous_body)
+    return revision
+
+
+def record_revision(session, entry, previous_title, previous_body):
+    """Add a revision for the entry's current title and body.
+
+    Entries that have never been edited have no revisions, so the first edit
+    also stores the version it replaced.
+    """
+    latest = session.query(EntryRevision.number).filter(
+        EntryRevision.entry_id == entry.id
+    ).order_by(EntryRevision.number.desc()).limit(1).scalar()
+    if latest is None:
+        session.add(_new_revision(
+            entry, 1, previous_title, previous_body or '', None))
+        latest = 1
+    revision = _new_revision(
+        entry, latest + 1, entry.title, entry.body or '', previous_body or '')
+    session.add(revision)
+    return revision
+
+
+def record_revisions(session, changes):
+    """Add revisions for many edited entries with one bulk insert.
+
+    Each change is an (entry_id, previous_title, previous_body, title, body)
+    tuple, and works like a call to record_revision.
+    """
+    if not changes:
+        return
+    latest = dict(session.query(
+        EntryRevision.entry_id, func.max(EntryRevision.number)
+    ).filter(
+        EntryRevision.entry_id.in_([change[0] for change in changes])
+    ).group_by(EntryRevision.entry_id))
+    now = datetime.now(utc)
+    rows = []
+    for entry_id, previous_title, previous_body, title, body in changes:
+        number = latest.get(entry_id)
+        if number is None:
+            number = 1
+            rows.append((entry_id, number, previous_title,
+                         previous_body or '', None))
+        number += 1
+        latest[entry_id] = number
+        rows.append((entry_id, number, title, body or '', previous_body or ''))
+
+    mappings = []
+    for entry_id, number, title, body, previous_body in rows:
+        is_snapshot, data = _revision_data(number, body, previous_body)
+        mappings.append({
+            'entry_id': entry_id, 'number': number, 'title': title,
+            'is_snapshot': is_snapshot, 'data': data, 'creation_date': now
+        })
+    session.bulk_insert_mappings(EntryRevision, mappings)
+
+
+def get_revision(session, entry_id, number):
+    """Get the title and body of one revision of an entry.
+
+    Starts from the closest snapshot, so at most SNAPSHOT_EVERY - 1 deltas
+    are applied. Returns None if there is no such revision.
+    """
+    snapshot = number - (number - 1) % SNAPSHOT_EVERY
+    revisions = session.query(EntryRevision).filter(
+        EntryRevision.entry_id == entry_id,
+        EntryRevision.number.between(snapshot, number)
+    ).order_by(EntryRevision.number).all()
+    if not revisions or revisions[-1].number != number:
+        return None
+
+    body = None
+    for revision in revisions:
+        value = _unpack(revision.data)
+        body = value if revision.is_snapshot else apply_delta(body, value)
+    return {'title': revisions[-1].title, 'body': body}
@@ -0,0 +1,164 @@
+"""Tags for journal entries, with a running count of entries per tag."""
+from sqlalchemy import (
+    Column,
+    ForeignKey,
+    Index,
+    Integer,
+    Table,
+    Unicode,
+    bindparam,
+    func,
+    select,
+    text,
+)
+from sqlalchemy.orm import backref, relationship, subqueryload
+
+from .baking import bakery
+from .meta import Base
+from .mymodel import Entry
+import re
+
+MAX_TAG_LENGTH = 64
+
+# one statement for both Postgres and SQLite (3.24 and up); a tag another
+# request added in the meantime is left as it is instead of clashing on name
+ADD_TAG = text(
+    'INSERT INTO tags (name, entry_count) VALUES (:name, 0) '
+    'ON CONFLICT (name) DO NOTHING'
+)
+
+entry_tags = Table(
+    'entry_tags', Base.metadata,
+    Column('entry_id', Integer, ForeignKey('entries.id'), primary_key=True),
+    Column('tag_id', Integer, ForeignKey('tags.id'), primary_key=True),
+    Index('ix_entry_tags_tag_id_entry_id', 'tag_id', 'entry_id')
+)
+
+
+class Tag(Base):
+    """Create a table for the tags on journal entries."""
+
+    __tablename__ = 'tags'
+    id = Column(Integer, primary_key=True)
+    name = Column(Unicode(MAX_TAG_LENGTH), nullable=False, unique=True)
+    entry_count = Column(Integer, nullable=False, default=0)
+
+    entries = relationship('Entry', secondary=entry_tags, backref=backref(
+        'tags', order_by='Tag.name'
+    ))
+
+
+def parse_tags(text):
+    """Turn comma separated text into a list of unique tag names.
+
+    A slash is read as a space, and names of only dots are dropped, since
+    neither could be put in the one path segment of a tag's url.
+    """
+    names = []
+    for name in (text or '').split(','):
+        name = re.sub(r'[\s/]+', ' ', name).strip().lower()[:MAX_TAG_LENGTH]
+        if name.strip('.') and name not in names:
+            names.append(name)
+    return names
+
+
+def add_tags(session, names):
+    """Add the tags with these names that no one has added yet."""
+    session.execute(ADD_TAG, [{'name': name} for name in names])
+
+
+def set_tags(session, entry, names):
+    """Give the entry exactly these tags, keeping the tag counts current.
+
+    Counts are changed with ``entry_count + 1`` style updates in the same
+    transaction as the entry, so they never drift from the entry_tags rows.
+    """
+    current = {tag.name: tag for tag in entry.tags}
+    names = list(names)
+
+    for name, tag in current.items():
+        if name not in names:
+            entry.tags.remove(tag)
+            tag.entry_count = Tag.entry_count - 1
+
+    new_names = [name for name in names if name not in current]
+    if not new_names:
+        return
+    existing = {
+        tag.name: tag for tag in
+        session.query(Tag).filter(Tag.name.in_(new_names))
+    }
+    missing = [name for name in new_names if name not in existing]
+    if missing:
+        add_tags(session, missing)
+        existing.update(
+            (tag.name, tag) for tag in
+            session.query(Tag).filter(Tag.name.in_(missing))
+        )
+    for name in new_names:
+        tag = existing[name]
+        tag.entry_count = Tag.entry_count + 1
+        entry.tags.append(tag)
+
+
+def get_tag_ids(session, names):
+    """Get the id of each tag name, adding the tags that are missing."""
+    names = list(names)
+    ids = dict(session.query(Tag.name, Tag.id).filter(Tag.name.in_(names)))
+    missing = [name for name in names if name not in ids]
+    if missing:
+        add_tags(session, missing)
+        ids.update(session.query(Tag.name, Tag.id).filter(
+            Tag.name.in_(missing)))
+    return ids
+
+
+def recount_tags(session, tag_ids=None):
+    """Count the entries of these tags, or of every tag, from entry_tags."""
+    query = session.query(Tag)
+    if tag_ids is not None:
+        query = query.filter(Tag.id.in_(list(tag_ids)))
+    query.update({Tag.entry_count: select(
+        [func.count()]
+    ).where(entry_tags.c.tag_id == Tag.id).as_scalar()},
+        synchronize_session=False)
+
+
+def tag_cloud(session, levels=5):
+    """Get the tags in use with a size level from 1 to levels for each."""
+    tags = session.query(Tag.name, Tag.entry_count).filter(
+        Tag.entry_count > 0
+    ).order_by(Tag.name).all()
+    if not tags:
+        return []
+    most = max(count for name, count in tags)
+    return [{
+        'name': name,
+        'count': count,
+        'level': 1 + (count * (levels - 1)) // most if most > 1 else 1
+    } for name, count in tags]
+
+
+_tag_by_name = bakery(lambda session: session.query(Tag).filter(
+    Tag.name == bindparam('name')))
+
+_tagged = bakery(lambda session: session.query(Entry).join(
+    entry_tags, entry_tags.c.entry_id == Entry.id
+).filter(
+    entry_tags.c.tag_id == bindparam('tag_id')
+).options(
+    subqueryload(Entry.tags)
+).order_by(
+    Entry.creation_date.desc(), Entry.id.desc()
+).limit(bindparam('limit')).offset(bindparam('offset')))
+
+
+def find_tag(session, name):
+    """Get the tag with this name, or None."""
+    return _tag_by_name(session).params(name=name).first()
+
+
+def tagged_entries(session, tag_id, limit, offset=0):
+    """Get limit entries with a tag, newest first, skipping offset."""
+    return _tagged(session).params(
+        tag_id=tag_id, limit=limit, offset=offset).all()
@@ -0,0 +1,97 @@
+"""How often each entry is read, and the most read entries.
+
+Counts are kept apart from ``entries`` so adding to them never touches, or
+bumps the version of, the entry itself. ``most_read`` is a copy of the top
+few counts, refreshed whenever counts are written, so the most read page
+doesn't sort every count on each request. The refresh reads the first rows
+of an index in that order, so it doesn't sort every count either.
+"""
+from sqlalchemy import (
+    Column,
+    ForeignKey,
+    Index,
+    Integer,
+    text,
+)
+
+from .meta import Base
+from .mymodel import Entry
+
+MOST_READ = 10
+
+# one statement for both Postgres and SQLite (3.24 and up); entries deleted
+# since they were read are skipped by the SELECT
+ADD_VIEWS = text(
+    'INSERT INTO entry_views (entry_id, views) '
+    'SELECT id, :views FROM entries WHERE id = :entry_id '
+    'ON CONFLICT (entry_id) DO UPDATE '
+    'SET views = entry_views.views + excluded.views'
+)
+
+# workers refresh most_read at the same time, so ranks are written over in
+# place rather than deleted and inserted again, which would clash on rank
+SET_RANK = text(
+    'INSERT INTO most_read (rank, entry_id, views) '
+    'VALUES (:rank, :entry_id, :views) '
+    'ON CONFLICT (rank) DO UPDATE '
+    'SET entry_id = excluded.entry_id, views = excluded.views'
+)
+
+
+class EntryViewCount(Base):
+    """Create a table with the number of times each entry was read."""
+
+    __tablename__ = 'entry_views'
+    entry_id = Column(
+        Integer, ForeignKey('entries.id', ondelete='CASCADE'),
+        primary_key=True)
+    views = Column(Integer, nullable=False, default=0)
+
+    # in the order refresh_most_read reads them
+    __table_args__ = (
+        Index('ix_entry_views_views_entry_id', views.desc(), entry_id),
+    )
+
+
+class MostRead(Base):
+    """Create a table with the most read entries, in order."""
+
+    __tablename__ = 'most_read'
+    rank = Column(Integer, primary_key=True)
+    entry_id = Column(Integer, nullable=False)
+    views = Column(Integer, nullable=False)
+
+
+def add_views(session, counts):
+    """Add a dict of entry id to new views to the stored counts."""
+    if not counts:
+        return
+    session.execute(ADD_VIEWS, [
+        {'entry_id': entry_id, 'views': views}
+        for entry_id, views in sorted(counts.items())
+    ])
+
+
+def refresh_most_read(session, size=MOST_READ):
+    """Copy the top size counts into most_read."""
+    top = session.query(
+        EntryViewCount.entry_id, EntryViewCount.views
+    ).order_by(
+        EntryViewCount.views.desc(), EntryViewCount.entry_id
+    ).limit(size).all()
+    if top:
+        session.execute(SET_RANK, [
+            {'rank': rank, 'entry_id': entry_id, 'views': views}
+            for rank, (entry_id, views) in enumerate(top, 1)
+        ])
+    session.query(MostRead).filter(
+        MostRead.rank > len(top)).delete(synchronize_session=False)
+
+
+def most_read(session):
+    """Get the most read entries that still exist, most read first."""
+    rows = session.query(
+        MostRead.entry_id, Entry.title, MostRead.views
+    ).join(Entry, Entry.id == MostRead.entry_id).order_by(MostRead.rank)
+    return [{'id': entry_id, 'title': title, 'views': views}
+            for entry_id, title, views in rows]
@@ -0,0 +1,256 @@
+"""Serve the app from several forked waitress processes on one socket.
+
+The app is loaded once in the parent before any worker is forked, so the
+workers share its memory copy-on-write. The parent binds the listening
+socket and every worker accepts from it, or with ``reuse_port`` each worker
+binds its own socket with ``SO_REUSEPORT`` and the kernel spreads the
+connections. Each worker runs ``threads`` waitress threads.
+
+A worker exits after about ``max_requests`` requests and the parent starts
+a new one in its place. On SIGTERM or SIGINT the parent asks every worker
+to stop; each one stops accepting, finishes the requests it has (for up to
+``graceful_timeout`` seconds) and exits, and any still running after that
+are killed.
+"""
+import errno
+import logging
+import os
+import random
+import signal
+import socket
+import threading
+import time
+
+from waitress.server import create_server
+from waitress import wasyncore
+
+log = logging.getLogger(__name__)
+
+
+def find_registry(app):
+    """Get the Pyramid registry of an app, looking through middleware."""
+    while app is not None and getattr(app, 'registry', None) is None:
+        app = getattr(app, 'app', None) or getattr(app, 'application', None)
+    return getattr(app, 'registry', None)
+
+
+def dispose_engine(app):
+    """Drop the database connections of an app, so a fork doesn't share them.
+
+    Called in the parent before forking and in each worker after, so no
+    worker ever uses a connection that another process opened.
+    """
+    registry = find_registry(app)
+    factory = registry.get('dbsession_factory') if registry else None
+    engine = factory.kw.get('bind') if factory is not None else None
+    if engine is not None:
+        engine.dispose()
+
+
+def close_background(app):
+    """Write the view counts and drafts and deliver the entry events.
+
+    A worker leaves with os._exit, which skips the atexit handlers that
+    would do this otherwise.
+    """
+    registry = find_registry(app) or {}
+    for name in ('view_counter', 'draft_buffer', 'entry_events'):
+        if registry.get(name) is not None:
+            registry[name].close()
+
+
+def listen(host, port, reuse_port=False, backlog=1024):
+    """Create a listening TCP socket."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+
+class CountRequests(object):
+    """WSGI middleware calling done() once max_requests have started."""
+
+    def __init__(self, app, max_requests, done):
+        self.app = app
+        self.max_requests = max_requests
+        self.done = done
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        with self._lock:
+            self.count += 1
+            if self.max_requests and self.count == self.max_requests:
+                self.done()
+        return self.app(environ, start_response)
+
+
+class Worker(object):
+    """One process serving the app with a pool of waitress threads."""
+
+    IDLE = 0.5
+
+    def __init__(self, app, sock, threads=4, max_requests=0,
+                 graceful_timeout=30, after_fork=dispose_engine):
+        self.app = app
+        self.sock = sock
+        self.threads = threads
+        self.max_requests = max_requests
+        self.graceful_timeout = graceful_timeout
+        self.after_fork = after_fork
+        self.stopping = threading.Event()
+
+    def stop(self, *args):
+        """Stop accepting and exit once the current requests are done."""
+        self.stopping.set()
+
+    def run(self):
+        """Serve until stopped, then drain the open connections."""
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        random.seed()
+        if self.after_fork is not None:
+            self.after_fork(self.app)
+        app = CountRequests(self.app, self.max_requests, self.stop)
+        server = create_server(
+            app, sockets=[self.sock], threads=self.threads, map={})
+        parent = os.getppid()
+        while not self.stopping.is_set():
+            wasyncore.loop(timeout=0.5, map=server._map, count=1)
+            if os.getppid() != parent:
+                # the arbiter died without stopping us
+                self.stop()
+        self.drain(server)
+
+    def drain(self, server):
+        """Finish the requests in progress and close every connection."""
+        server.del_channel()
+        server.socket.close()
+        deadline = time.time() + self.graceful_timeout
+        while server.active_channels and time.time() < deadline:
+            # a connection just accepted may not have been read from yet, so
+            # only those idle for a moment are closed
+            idle = time.time() - self.IDLE
+            for channel in list(server.active_channels.values()):
+                if (not channel.requests and not channel.total_outbufs_len and
+                        channel.last_activity < idle):
+                    channel.will_close = True
+            wasyncore.loop(timeout=0.05, map=server._map, count=1)
+        server.task_dispatcher.shutdown(timeout=1)
+        wasyncore.close_all(server._map)
+        close_background(self.app)
+
+
+class Arbiter(object):
+    """Keep a number of workers running and stop them on a signal."""
+
+    def __init__(self, app, host='0.0.0.0', port=6543, workers=2, threads=4,
+                 max_requests=0, max_requests_jitter=0, graceful_timeout=30,
+                 reuse_port=False, after_fork=dispose_engine):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.threads = threads
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.graceful_timeout = graceful_timeout
+        self.reuse_port = reuse_port
+        self.after_fork = after_fork
+        self.children = {}
+        self.stopping = False
+        self.sock = None
+
+    def stop(self, *args):
+        """Stop every worker and then the arbiter."""
+        self.stopping = True
+
+    def spawn(self):
+        """Fork one worker."""
+        if self.after_fork is not None:
+            self.after_fork(self.app)
+        max_requests = self.max_requests
+        if max_requests and self.max_requests_jitter:
+            max_requests += random.randint(0, self.max_requests_jitter)
+        pid = os.fork()
+        if pid:
+            self.children[pid] = time.time()
+            return pid
+        status = 0
+        try:
+            sock = self.sock
+            if self.reuse_port:
+                sock = listen(self.host, self.port, reuse_port=True)
+            Worker(self.app, sock, self.threads, max_requests,
+                   self.graceful_timeout, self.after_fork).run()
+        except BaseException:
+            log.exception('Worker %d failed', os.getpid())
+            status = 1
+        finally:
+            os._exit(status)
+
+    def reap(self):
+        """Forget the workers that have exited."""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as error:
+                if error.errno == errno.ECHILD:
+                    return
+                raise
+            if not pid:
+                return
+            if self.children.pop(pid, None) is not None and status:
+                log.warning('Worker %d exited with status %d', pid, status)
+
+    def kill_all(self, sig):
+        """Send a signal to every worker."""
+        for pid in list(self.children):
+            try:
+                os.kill(pid, sig)
+            except OSError as error:
+                if error.errno != errno.ESRCH:
+                    raise
+                self.children.pop(pid, None)
+
+    def run(self):
+        """Start the workers and replace any that exit until stopped."""
+        if not self.reuse_port:
+            # with SO_REUSEPORT the parent must not listen too, or the
+            # kernel would hand it connections that nobody accepts
+            self.sock = listen(self.host, self.port)
+            self.port = self.sock.getsockname()[1]
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        log.info('Serving on %s:%d with %d workers of %d threads',
+                 self.host, self.port, self.workers, self.threads)
+        try:
+            while not self.stopping:
+                self.reap()
+                while len(self.children) < self.workers and not self.stopping:
+                    self.spawn()
+                time.sleep(0.1)
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        """Ask the workers to drain, killing those that take too long."""
+        self.kill_all(signal.SIGTERM)
+        deadline = time.time() + self.graceful_timeout + 1
+        while self.children and time.time() < deadline:
+            self.reap()
+            time.sleep(0.05)
+        self.kill_all(signal.SIGKILL)
+        while self.children:
+            self.reap()
+            time.sleep(0.01)
+        if self.sock is not None:
+            self.sock.close()
+
+
+def serve(app, **kw):
+    """Serve an app from forked workers until SIGTERM or SIGINT."""
+    Arbiter(app, **kw).run()
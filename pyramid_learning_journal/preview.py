@@ -0,0 +1,121 @@
+"""Render markdown for the editor's live preview, cached and on a budget.
+
+The editor sends the whole body on every pause in typing, and most of those
+are text it has sent before. Rendered html is kept in an LRU keyed by a hash
+of the text and the renderer, so unchanged text is never rendered twice.
+Renders run on a small pool of threads; one that takes longer than
+``journal.preview.time_budget`` seconds is answered with an error, and its
+html is still cached when it finishes.
+
+Requests for the same text while it is rendering wait for that render
+instead of starting another, and once it is over budget they are refused
+until it finishes. At most ``journal.preview.max_pending`` renders are
+running or queued at once; text beyond that is refused straight away, so
+slow text can't pile up behind the threads.
+"""
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from functools import partial
+from hashlib import sha256
+import threading
+
+from .cache import SingleFlight
+from .flushing import close_at_exit
+from .fragments import FragmentCache
+from .rendering import render_markdown, renderer_key
+
+
+class PreviewTimeout(Exception):
+    """The text took longer to render than the budget allows."""
+
+
+class PreviewBusy(Exception):
+    """The text is still rendering, or too many renders are waiting."""
+
+
+class Previewer(object):
+    """Render markdown through a cache and a pool of threads."""
+
+    def __init__(self, max_entries=256, time_budget=1.0, workers=2,
+                 max_pending=8):
+        self.cache = FragmentCache(max_entries)
+        self.time_budget = time_budget
+        self.max_pending = max_pending
+        self.flight = SingleFlight(time_budget)
+        self.timeouts = 0
+        self.refused = 0
+        self._running = {}
+        self._late = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    def key(self, text):
+        """Get the cache key of some text with the renderer in use."""
+        digest = sha256(renderer_key().encode('utf-8') + b'\0')
+        digest.update(text.encode('utf-8'))
+        return digest.hexdigest()
+
+    def render(self, text):
+        """Get the html of some text, or raise PreviewTimeout or PreviewBusy."""
+        key = self.key(text)
+        return self.cache.get_or_render(key, lambda: self.flight.run(
+            key, lambda: self._render(key, text)))
+
+    def _render(self, key, text):
+        with self._lock:
+            if key in self._running or len(self._running) >= self.max_pending:
+                self.refused += 1
+                raise PreviewBusy(key)
+            future = self._running[key] = self._executor.submit(
+                render_markdown, text)
+        future.add_done_callback(partial(self._finish, key))
+        try:
+            return future.result(self.time_budget)
+        except TimeoutError:
+            with self._lock:
+                # unless it finished just now, its html is kept when it does
+                if key in self._running:
+                    self.timeouts += 1
+                    self._late.add(key)
+                    raise PreviewTimeout(key)
+            return future.result()
+
+    def _finish(self, key, future):
+        with self._lock:
+            late = key in self._late
+            self._late.discard(key)
+            if not late:
+                del self._running[key]
+        if not late:
+            return
+        # a late render still counts as running until its html is kept
+        if future.exception() is None:
+            html = future.result()
+            self.cache.get_or_render(key, lambda: html)
+        with self._lock:
+            del self._running[key]
+
+    def stats(self):
+        """Get the cache counts, and the renders over budget or refused."""
+        stats = self.cache.stats()
+        with self._lock:
+            stats['timeouts'] = self.timeouts
+            stats['refused'] = self.refused
+            stats['pending'] = len(self._running)
+        return stats
+
+    def close(self):
+        """Stop the render threads."""
+        self._executor.shutdown(wait=False)
+
+
+def includeme(config):
+    """Set up the markdown preview."""
+    settings = config.get_settings()
+    previewer = Previewer(
+        max_entries=int(settings.get('journal.preview.max_entries', 256)),
+        time_budget=float(settings.get('journal.preview.time_budget', 1.0)),
+        workers=int(settings.get('journal.preview.workers', 2)),
+        max_pending=int(settings.get('journal.preview.max_pending', 8))
+    )
+    config.registry['previewer'] = previewer
+    close_at_exit(previewer)
@@ -0,0 +1,136 @@
+"""Markdown rendering for entry bodies, with swappable backends.
+
+``markdown.markdown()`` builds a new ``Markdown`` instance, with all of its
+processors and extensions, for every call. The renderers here keep one
+instance per thread instead and ``reset()`` it after each use. Which backend
+is used is set with ``journal.markdown.backend``, either one of the names in
+``BACKENDS`` or the dotted name of a class taking a list of extensions and
+having a ``render(text)`` method. ``journal.markdown.extensions`` is handed to
+the backend as is.
+"""
+from hashlib import sha1
+from markdown import Markdown
+from pyramid.exceptions import ConfigurationError
+import threading
+
+try:
+    import mistune
+except ImportError:  # pragma: no cover
+    mistune = None
+
+
+class MarkdownRenderer(object):
+    """Render with Python-Markdown, reusing one instance per thread."""
+
+    name = 'markdown'
+
+    def __init__(self, extensions=()):
+        """Create a renderer using these Python-Markdown extensions."""
+        self.extensions = list(extensions)
+        self._local = threading.local()
+
+    @property
+    def key(self):
+        """Name the backend and extensions, to tell whose html is stored."""
+        return '{}:{}'.format(self.name, ','.join(self.extensions))
+
+    def _instance(self):
+        instance = getattr(self._local, 'instance', None)
+        if instance is None:
+            instance = Markdown(extensions=self.extensions)
+            self._local.instance = instance
+        return instance
+
+    def render(self, text):
+        """Turn markdown text into html."""
+        instance = self._instance()
+        try:
+            return instance.convert(text or '')
+        finally:
+            instance.reset()
+
+
+class MistuneRenderer(MarkdownRenderer):
+    """Render with mistune, if it is installed. Extensions are its plugins."""
+
+    name = 'mistune'
+
+    def __init__(self, extensions=()):
+        """Create a renderer using these mistune plugins."""
+        if mistune is None:
+            raise ImportError('the mistune backend needs mistune installed')
+        super(MistuneRenderer, self).__init__(extensions)
+
+    def _instance(self):
+        instance = getattr(self._local, 'instance', None)
+        if instance is None:
+            if hasattr(mistune, 'create_markdown'):
+                instance = mistune.create_markdown(plugins=self.extensions)
+            else:  # pragma: no cover
+                instance = mistune.Markdown()
+            self._local.instance = instance
+        return instance
+
+    def render(self, text):
+        """Turn markdown text into html."""
+        return self._instance()(text or '')
+
+
+BACKENDS = {
+    'markdown': MarkdownRenderer,
+    'mistune': MistuneRenderer,
+}
+
+_renderer = MarkdownRenderer()
+
+
+def get_renderer():
+    """Get the renderer used for entry bodies."""
+    return _renderer
+
+
+def set_renderer(renderer):
+    """Use this renderer for entry bodies from now on."""
+    global _renderer
+    _renderer = renderer
+
+
+def renderer_key(renderer=None):
+    """Get the key html is stored under for a renderer, or the one in use.
+
+    It is the sha1 of the renderer's key, so it is the same length however
+    many extensions the renderer names.
+    """
+    renderer = renderer or _renderer
+    key = getattr(renderer, 'key', type(renderer).__name__)
+    return sha1(key.encode('utf-8')).hexdigest()
+
+
+def render_markdown(text):
+    """Turn markdown text into html with the configured renderer."""
+    return _renderer.render(text)
+
+
+def make_renderer(backend='markdown', extensions=(), maybe_dotted=None):
+    """Create a renderer from a backend name and a list of extensions."""
+    factory = BACKENDS.get(backend)
+    if factory is None and maybe_dotted is not None:
+        factory = maybe_dotted(backend)
+    if factory is None:
+        raise ConfigurationError('Unknown markdown backend {}'.format(backend))
+    try:
+        return factory(extensions)
+    except ImportError as error:
+        raise ConfigurationError(str(error))
+
+
+def includeme(config):
+    """Set up the markdown renderer from the settings."""
+    settings = config.get_settings()
+    renderer = make_renderer(
+        settings.get('journal.markdown.backend', 'markdown'),
+        settings.get('journal.markdown.extensions', '').split(),
+        config.maybe_dotted
+    )
+    set_renderer(renderer)
+    config.registry['markdown_renderer'] = renderer
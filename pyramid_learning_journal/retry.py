@@ -0,0 +1,114 @@
+"""Back off between request retries, and count them per route.
+
+``pyramid_retry`` tries a request again as soon as it hits a retryable
+error, such as a serialization failure or deadlock in Postgres. Retrying
+right away tends to collide with the same concurrent edit again, so before
+each retry this waits a random time of up to ``base * 2 ** attempt`` seconds,
+capped at ``max`` ("full jitter"). Every retry is logged with the exception
+class that caused it, and requests that ran out of attempts are counted.
+"""
+from pyramid_retry import IBeforeRetry, IRetryableError, is_last_attempt
+from collections import Counter
+import logging
+import random
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+def _route_name(request):
+    route = getattr(request, 'matched_route', None)
+    return route.name if route is not None else None
+
+
+class RetryMonitor(object):
+    """Wait before retries and keep count of them.
+
+    Counts are kept per route name, and per exception class, for both
+    ``retried`` (another attempt was made) and ``exhausted`` (the last
+    attempt failed with a retryable error too).
+    """
+
+    def __init__(self, base=0.05, cap=1.0, sleep=time.sleep, rng=None):
+        self.base = base
+        self.cap = cap
+        self.sleep = sleep
+        self.rng = rng or random.Random()
+        self.retried = Counter()
+        self.exhausted = Counter()
+        self.errors = Counter()
+        self._lock = threading.Lock()
+
+    def delay(self, attempt):
+        """Get a random wait before the retry that follows attempt."""
+        return self.rng.uniform(0, min(self.cap, self.base * 2 ** attempt))
+
+    def before_retry(self, event):
+        """Count, log and back off before pyramid_retry tries again."""
+        request = event.request
+        route = _route_name(request)
+        error = type(event.exception).__name__
+        attempt = request.environ.get('retry.attempt', 0)
+        delay = self.delay(attempt)
+        with self._lock:
+            self.retried[route] += 1
+            self.errors[error] += 1
+        log.warning('Retrying %s on route %s after attempt %d in %.3fs',
+                    error, route, attempt + 1, delay)
+        self.sleep(delay)
+
+    def exhaust(self, request, exception):
+        """Count and log a request that failed on its last attempt."""
+        route = _route_name(request)
+        error = type(exception).__name__
+        with self._lock:
+            self.exhausted[route] += 1
+            self.errors[error] += 1
+        log.error('Gave up on route %s after %s attempts, last with %s',
+                  route, request.environ.get('retry.attempts'), error)
+
+    def stats(self):
+        """Get a copy of the counts."""
+        with self._lock:
+            return {
+                'retried': dict(self.retried),
+                'exhausted': dict(self.exhausted),
+                'errors': dict(self.errors),
+            }
+
+
+def _out_of_attempts(request, exception):
+    if exception is None or not IRetryableError.providedBy(exception):
+        return False
+    return is_last_attempt(request) and 'retry.attempts' in request.environ
+
+
+def retry_monitor_tween_factory(handler, registry):
+    """Count requests that still fail once pyramid_retry is out of attempts."""
+    monitor = registry['retry_monitor']
+
+    def retry_monitor_tween(request):
+        try:
+            response = handler(request)
+        except Exception as exception:
+            if _out_of_attempts(request, exception):
+                monitor.exhaust(request, exception)
+            raise
+        exception = getattr(request, 'exception', None)
+        if _out_of_attempts(request, exception):
+            monitor.exhaust(request, exception)
+        return response
+    return retry_monitor_tween
+
+
+def includeme(config):
+    """Back off between retries and count them, for ``pyramid_retry``."""
+    settings = config.get_settings()
+    monitor = RetryMonitor(
+        base=float(settings.get('journal.retry.backoff_base', 0.05)),
+        cap=float(settings.get('journal.retry.backoff_max', 1.0))
+    )
+    config.registry['retry_monitor'] = monitor
+    config.add_subscriber(monitor.before_retry, IBeforeRetry)
+    config.add_tween('pyramid_learning_journal.retry.retry_monitor_tween_factory')
@@ -1,9 +1,38 @@
+from pyramid_learning_journal.security import (
+    default_journal_factory,
+    entry_factory,
+    journal_factory,
+)
+
+
 def includeme(config):
     config.add_static_view('static', 'static', cache_max_age=3600)
     config.add_route('home', '/')
     config.add_route('detail', '/journal/{id:\d+}')
-    config.add_route('create', '/journal/new-entry')
-    config.add_route('edit', '/journal/{id:\d+}/edit-entry')
-    config.add_route('delete', '/journal/{id:\d+}/delete-entry')
+    config.add_route('create', '/journal/new-entry',
+                     factory=default_journal_factory)
+    config.add_route('drafts', '/journal/drafts')
+    config.add_route('preview', '/journal/preview')
+    config.add_route('attachments', '/journal/{id:\d+}/attachments',
+                     factory=entry_factory)
+    config.add_route('attachment', '/attachments/{sha256:[0-9a-f]{64}}/{filename}')
+    config.add_route('edit', '/journal/{id:\d+}/edit-entry',
+                     factory=entry_factory)
+    config.add_route('delete', '/journal/{id:\d+}/delete-entry',
+                     factory=entry_factory)
+    config.add_route('history', '/journal/{id:\d+}/history',
+                     factory=entry_factory)
+    config.add_route('revision', '/journal/{id:\d+}/history/{rev:\d+}',
+                     factory=entry_factory)
+    config.add_route('restore', '/journal/{id:\d+}/history/{rev:\d+}/restore',
+                     factory=entry_factory)
+    config.add_route('journal', '/journals/{slug}', factory=journal_factory)
+    config.add_route('journal_create', '/journals/{slug}/new-entry',
+                     factory=journal_factory)
+    config.add_route('tag', '/tag/{name}')
+    config.add_route('most_read', '/most-read')
+    config.add_route('archive', '/archive/{year:\d{4}}/{month:\d{1,2}}')
+    config.add_route('api_batch', '/api/entries/batch',
+                     factory=default_journal_factory)
     config.add_route('login', '/login')
     config.add_route('logout', '/logout')
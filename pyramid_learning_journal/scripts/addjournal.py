@@ -0,0 +1,58 @@
+"""Add a journal for an author, adding the author if they are new."""
+import getpass
+import os
+import sys
+import transaction
+
+from pyramid.paster import (
+    get_appsettings,
+    setup_logging,
+)
+
+from pyramid.scripts.common import parse_vars
+
+from ..models import (
+    get_engine,
+    get_session_factory,
+    get_tm_session,
+)
+from ..models.journal import add_journal, find_user
+
+
+def usage(argv):
+    cmd = os.path.basename(argv[0])
+    print('usage: %s <config_uri> slug=name username=name [title=text] '
+          '[var=value]\n'
+          '(example: "%s development.ini slug=ada username=ada '
+          'title=\"Ada\'s journal\"")' % (cmd, cmd))
+    sys.exit(1)
+
+
+def main(argv=sys.argv):
+    if len(argv) < 2:
+        usage(argv)
+    config_uri = argv[1]
+    options = parse_vars(argv[2:])
+    slug = options.pop('slug', None)
+    username = options.pop('username', None)
+    title = options.pop('title', None)
+    if not slug or not username:
+        usage(argv)
+    setup_logging(config_uri)
+    settings = get_appsettings(config_uri, options=options)
+    settings["sqlalchemy.url"] = os.environ["DATABASE_URL"]
+
+    engine = get_engine(settings)
+    session_factory = get_session_factory(engine)
+
+    with transaction.manager:
+        dbsession = get_tm_session(session_factory, transaction.manager)
+        password = None
+        if find_user(dbsession, username) is None:
+            password = getpass.getpass('Password for {}: '.format(username))
+        try:
+            add_journal(dbsession, slug, title, username, password)
+        except ValueError as error:
+            print(error)
+            sys.exit(1)
+    print('Added the journal {} for {}.'.format(slug, username))
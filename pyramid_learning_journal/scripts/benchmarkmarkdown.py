@@ -0,0 +1,65 @@
+"""Time how long each markdown backend takes to render an entry."""
+import os
+import sys
+import time
+
+from markdown import markdown
+from pyramid.exceptions import ConfigurationError
+from pyramid.path import DottedNameResolver
+from pyramid.scripts.common import parse_vars
+
+from ..data.corpus import generate_entries
+from ..rendering import BACKENDS, make_renderer
+
+
+def usage(argv):
+    cmd = os.path.basename(argv[0])
+    print('usage: %s [entries=N] [seed=N] [repeat=N] '
+          '[backends=markdown,mistune] [extensions=name,name]\n'
+          '(example: "%s entries=500 repeat=5")' % (cmd, cmd))
+    sys.exit(1)
+
+
+def time_render(render, bodies, repeat=3):
+    """Get the best time over repeat runs to render every body once."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for body in bodies:
+            render(body)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def format_row(name, seconds, count):
+    """Format the per entry cost of one backend."""
+    return '{:<24} {:>10.1f} us {:>10.0f}'.format(
+        name, seconds / count * 1e6, count / seconds)
+
+
+def main(argv=sys.argv):
+    options = parse_vars(argv[1:])
+    if 'help' in options:
+        usage(argv)
+    count = int(options.get('entries', 200))
+    seed = int(options.get('seed', 0))
+    repeat = int(options.get('repeat', 3))
+    backends = options.get('backends', ','.join(sorted(BACKENDS))).split(',')
+    extensions = [name for name in options.get('extensions', '').split(',')
+                  if name]
+    bodies = [entry['body'] for entry in generate_entries(count, seed=seed)]
+
+    print('{:<24} {:>13} {:>10}'.format('backend', 'per entry', 'entries/s'))
+    seconds = time_render(
+        lambda text: markdown(text, extensions=extensions), bodies, repeat)
+    print(format_row('markdown() each call', seconds, count))
+    for backend in backends:
+        try:
+            renderer = make_renderer(
+                backend, extensions, DottedNameResolver().maybe_resolve)
+        except ConfigurationError as error:
+            print('{:<24} {}'.format(backend, error))
+            continue
+        seconds = time_render(renderer.render, bodies, repeat)
+        print(format_row(backend, seconds, count))
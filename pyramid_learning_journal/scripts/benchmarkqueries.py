@@ -0,0 +1,139 @@
+"""Time the Python cost of the hot read queries, built each call or baked.
+
+The corpus goes in an in-memory SQLite database, so each query spends next
+to nothing in the database and what is left is the time taken to build,
+compile and run the query and load its rows. Every call starts from an
+empty session, like a request does.
+"""
+import os
+import sys
+import time
+
+from pyramid.scripts.common import parse_vars
+from sqlalchemy.orm import subqueryload
+
+from ..data.corpus import generate_entries, load_entries
+from ..models import (
+    Entry,
+    RelatedEntry,
+    Tag,
+    get_engine,
+    get_session_factory,
+)
+from ..models.archive import entries_between, month_range
+from ..models.baking import query_cache_stats
+from ..models.meta import Base
+from ..models.mymodel import entry_batch, load_entry
+from ..models.related import related_entries
+from ..models.tag import entry_tags, find_tag, tagged_entries
+
+PAGE_SIZE = 10
+
+
+def usage(argv):
+    cmd = os.path.basename(argv[0])
+    print('usage: %s [entries=N] [seed=N] [calls=N] [repeat=N]\n'
+          '(example: "%s entries=500 calls=2000")' % (cmd, cmd))
+    sys.exit(1)
+
+
+def built_paths(entry_id, tag, start, end):
+    """The hot paths as they were, building a new Query every call."""
+    return {
+        'detail': lambda session: session.query(Entry).get(entry_id),
+        'list page': lambda session: session.query(Entry).options(
+            subqueryload(Entry.tags)
+        ).order_by(
+            Entry.creation_date.desc(), Entry.id.desc()
+        ).limit(PAGE_SIZE).all(),
+        'tag lookup': lambda session: session.query(Tag).filter(
+            Tag.name == tag.name).first(),
+        'tag page': lambda session: session.query(Entry).join(
+            entry_tags, entry_tags.c.entry_id == Entry.id
+        ).filter(
+            entry_tags.c.tag_id == tag.id
+        ).options(
+            subqueryload(Entry.tags)
+        ).order_by(
+            Entry.creation_date.desc(), Entry.id.desc()
+        ).limit(PAGE_SIZE + 1).offset(0).all(),
+        'archive month': lambda session: session.query(Entry).filter(
+            Entry.creation_date >= start, Entry.creation_date < end
+        ).options(
+            subqueryload(Entry.tags)
+        ).order_by(Entry.creation_date.desc()).all(),
+        'related': lambda session: session.query(Entry.id, Entry.title).join(
+            RelatedEntry, RelatedEntry.related_id == Entry.id
+        ).filter(
+            RelatedEntry.entry_id == entry_id
+        ).order_by(RelatedEntry.rank).all(),
+    }
+
+
+def baked_paths(entry_id, tag, start, end):
+    """The same hot paths through the baked queries the views use."""
+    return {
+        'detail': lambda session: load_entry(session, entry_id),
+        'list page': lambda session: entry_batch(session, PAGE_SIZE),
+        'tag lookup': lambda session: find_tag(session, tag.name),
+        'tag page': lambda session: tagged_entries(
+            session, tag.id, PAGE_SIZE + 1),
+        'archive month': lambda session: entries_between(session, start, end),
+        'related': lambda session: related_entries(session, entry_id),
+    }
+
+
+def time_path(path, session, calls, repeat=3):
+    """Get the best time over repeat runs of calls calls of a path."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(calls):
+            path(session)
+            session.expunge_all()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def format_row(name, built, baked, calls):
+    """Format the per call cost of one path, both ways."""
+    return '{:<16} {:>10.1f} us {:>10.1f} us {:>8.1f}x'.format(
+        name, built / calls * 1e6, baked / calls * 1e6, built / baked)
+
+
+def main(argv=sys.argv):
+    options = parse_vars(argv[1:])
+    if 'help' in options:
+        usage(argv)
+    count = int(options.get('entries', 200))
+    seed = int(options.get('seed', 0))
+    calls = int(options.get('calls', 1000))
+    repeat = int(options.get('repeat', 3))
+
+    engine = get_engine({'sqlalchemy.url': 'sqlite://'})
+    Base.metadata.create_all(engine)
+    session = get_session_factory(engine)()
+    load_entries(session, generate_entries(count, seed=seed))
+    session.commit()
+    entry = session.query(Entry).order_by(Entry.id).first()
+    tag = session.query(Tag).order_by(Tag.entry_count.desc()).first()
+    start, end = month_range(entry.creation_date.year,
+                             entry.creation_date.month)
+    session.expunge_all()
+
+    built = built_paths(entry.id, tag, start, end)
+    baked = baked_paths(entry.id, tag, start, end)
+    print('{:<16} {:>13} {:>13} {:>9}'.format(
+        'path', 'built', 'baked', 'speedup'))
+    for name in built:
+        built_seconds = time_path(built[name], session, calls, repeat)
+        baked_seconds = time_path(baked[name], session, calls, repeat)
+        print(format_row(name, built_seconds, baked_seconds, calls))
+
+    stats = query_cache_stats()
+    print('baked queries reused {:.1%}, compiled statements reused {:.1%}, '
+          '{} cached'.format(stats['queries']['hit_rate'],
+                             stats['statements']['hit_rate'], stats['size']))
+    session.close()
+    engine.dispose()
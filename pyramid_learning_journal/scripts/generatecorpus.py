@@ -0,0 +1,58 @@
+import io
+import os
+import sys
+import transaction
+
+from pyramid.paster import (
+    get_appsettings,
+    setup_logging,
+)
+
+from pyramid.scripts.common import parse_vars
+
+from ..models.meta import Base
+from ..models import (
+    get_engine,
+    get_session_factory,
+    get_tm_session,
+)
+from ..data.corpus import BATCH_SIZE, generate_entries, load_entries, write_jsonl
+
+
+def usage(argv):
+    cmd = os.path.basename(argv[0])
+    print('usage: %s <config_uri> [entries=N] [seed=N] [jsonl=path] '
+          '[batch_size=N] [var=value]\n'
+          '(example: "%s development.ini entries=10000 seed=1")' % (cmd, cmd))
+    sys.exit(1)
+
+
+def main(argv=sys.argv):
+    if len(argv) < 2:
+        usage(argv)
+    config_uri = argv[1]
+    options = parse_vars(argv[2:])
+    count = int(options.pop('entries', 1000))
+    seed = int(options.pop('seed', 0))
+    batch_size = int(options.pop('batch_size', BATCH_SIZE))
+    jsonl = options.pop('jsonl', None)
+    entries = generate_entries(count, seed=seed)
+
+    if jsonl:
+        with io.open(jsonl, 'w', encoding='utf-8') as output:
+            written = write_jsonl(entries, output)
+        print('Wrote %d entries to %s.' % (written, jsonl))
+        return
+
+    setup_logging(config_uri)
+    settings = get_appsettings(config_uri, options=options)
+    settings["sqlalchemy.url"] = os.environ["DATABASE_URL"]
+
+    engine = get_engine(settings)
+    Base.metadata.create_all(engine)
+    session_factory = get_session_factory(engine)
+
+    with transaction.manager:
+        dbsession = get_tm_session(session_factory, transaction.manager)
+        loaded = load_entries(dbsession, entries, batch_size)
+    print('Loaded %d entries with seed %d.' % (loaded, seed))
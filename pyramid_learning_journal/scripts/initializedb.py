@@ -17,6 +17,9 @@ from ..models import (
     get_tm_session,
 )
 from ..models import Entry
+from ..models.tag import parse_tags, set_tags
+from ..models.archive import rebuild_monthly_counts
+from ..models.related import rebuild_related, upgrade_related_tables
 from ..data.entry_history import ENTRIES
 
 
@@ -39,19 +42,21 @@ def main(argv=sys.argv):
     engine = get_engine(settings)
     Base.metadata.drop_all(engine)
     Base.metadata.create_all(engine)
+    upgrade_related_tables(engine)
 
     session_factory = get_session_factory(engine)
 
     with transaction.manager:
         dbsession = get_tm_session(session_factory, transaction.manager)
 
-        all_entries = []
         for entry in ENTRIES:
-            all_entries.append(
-                Entry(
-                    title=entry['title'],
-                    body=entry['body'],
-                    creation_date=entry['creation_date']
-                )
+            new_entry = Entry(
+                title=entry['title'],
+                body=entry['body'],
+                creation_date=entry['creation_date']
             )
-        dbsession.add_all(all_entries)
+            dbsession.add(new_entry)
+            set_tags(dbsession, new_entry, parse_tags(entry.get('tags')))
+        dbsession.flush()
+        rebuild_monthly_counts(dbsession)
+        rebuild_related(dbsession)
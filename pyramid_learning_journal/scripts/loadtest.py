@@ -0,0 +1,340 @@
+"""Serve the journal on a local port and measure it under concurrent load.
+
+Everything runs offline: the app is served by waitress from a throwaway
+SQLite database filled with a synthetic corpus, and each client thread keeps
+one HTTP connection open and picks its next request from a weighted mix.
+"""
+import logging
+import math
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import transaction
+
+from http.client import HTTPConnection
+from http.cookies import SimpleCookie
+from passlib.apps import custom_app_context as pwd_context
+from pyramid.paster import get_appsettings, setup_logging
+from pyramid.scripting import prepare
+from pyramid.scripts.common import parse_vars
+from urllib.parse import urlencode
+from waitress import wasyncore
+from waitress.server import create_server
+
+from .. import main as make_app
+from ..models.baking import query_cache_stats
+from ..models.meta import Base
+from ..models import (
+    Entry,
+    get_engine,
+    get_session_factory,
+    get_tm_session,
+)
+from ..data.corpus import generate_entries, load_entries
+
+DEFAULT_MIX = 'home:60,detail:30,login:5,create:5'
+DEFAULT_THREADS = '1,2,4,8,16'
+CSRF_TOKEN = re.compile(r'name="csrf_token" value="([^"]+)"')
+OK_STATUSES = (200, 302)
+
+
+def usage(argv):
+    cmd = os.path.basename(argv[0])
+    print('usage: %s <config_uri> [threads=1,2,4] [duration=seconds] '
+          '[mix=home:60,detail:30,login:5,create:5] [entries=N] [seed=N] '
+          '[server_threads=N] [var=value]\n'
+          '(example: "%s production.ini threads=1,4,16 duration=10")'
+          % (cmd, cmd))
+    sys.exit(1)
+
+
+def parse_mix(text):
+    """Turn 'home:60,detail:30' into a list of (action, weight) pairs."""
+    mix = []
+    for part in text.split(','):
+        name, _, weight = part.strip().partition(':')
+        if name:
+            mix.append((name, float(weight or 1)))
+    return mix
+
+
+def percentile(values, fraction):
+    """Get the nearest rank percentile of sorted values."""
+    if not values:
+        return 0.0
+    rank = int(math.ceil(fraction * len(values))) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+def summarize(samples, elapsed):
+    """Get throughput, latency percentiles and error rate from samples.
+
+    Each sample is an (action, seconds, ok) tuple.
+    """
+    latencies = sorted(seconds for _, seconds, _ in samples)
+    errors = sum(1 for _, _, ok in samples if not ok)
+    count = len(samples)
+    return {
+        'requests': count,
+        'throughput': count / elapsed if elapsed else 0.0,
+        'p50': percentile(latencies, 0.50),
+        'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99),
+        'error_rate': errors / float(count) if count else 0.0,
+    }
+
+
+class Client(object):
+    """One user of the journal, with its own connection and cookies."""
+
+    def __init__(self, host, port, entry_ids=(), credentials=None, rng=None):
+        """Connect to the server as an anonymous user."""
+        self.host = host
+        self.port = port
+        self.entry_ids = list(entry_ids)
+        self.credentials = credentials
+        self.rng = rng or random.Random()
+        self.connection = None
+        self.cookies = {}
+        self.csrf_token = None
+
+    def request(self, method, path, fields=None, cookies=None):
+        """Send one request and read the whole response."""
+        if self.connection is None:
+            self.connection = HTTPConnection(self.host, self.port, timeout=30)
+        cookies = self.cookies if cookies is None else cookies
+        headers = {}
+        body = None
+        if cookies:
+            headers['Cookie'] = '; '.join(
+                '{}={}'.format(name, value) for name, value in cookies.items())
+        if fields is not None:
+            body = urlencode(fields)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        try:
+            self.connection.request(method, path, body, headers)
+            response = self.connection.getresponse()
+            content = response.read().decode('utf-8', 'replace')
+        except Exception:
+            self.connection.close()
+            self.connection = None
+            raise
+        for header in response.msg.get_all('Set-Cookie') or []:
+            for name, morsel in SimpleCookie(header).items():
+                cookies[name] = morsel.value
+        return response.status, content
+
+    def _log_in(self, cookies):
+        """Log in with a cookie jar, returning the final status."""
+        status, content = self.request('GET', '/login', cookies=cookies)
+        token = CSRF_TOKEN.search(content)
+        if status != 200 or not token:
+            return status
+        username, password = self.credentials
+        status, _ = self.request('POST', '/login', {
+            'csrf_token': token.group(1),
+            'username': username,
+            'password': password,
+        }, cookies=cookies)
+        return status
+
+    def home(self):
+        """Read the list of entries."""
+        return self.request('GET', '/')[0]
+
+    def detail(self):
+        """Read one entry."""
+        if not self.entry_ids:
+            return self.home()
+        entry_id = self.rng.choice(self.entry_ids)
+        return self.request('GET', '/journal/{}'.format(entry_id))[0]
+
+    def login(self):
+        """Log in from scratch, as a new visitor would."""
+        return self._log_in({})
+
+    def create(self):
+        """Write a new entry, logging this client in the first time."""
+        if self.csrf_token is None:
+            self._log_in(self.cookies)
+            status, content = self.request('GET', '/journal/new-entry')
+            token = CSRF_TOKEN.search(content)
+            if status != 200 or not token:
+                return status
+            self.csrf_token = token.group(1)
+        status, _ = self.request('POST', '/journal/new-entry', {
+            'csrf_token': self.csrf_token,
+            'title': 'Load test',
+            'body': 'Written by the load test at {}.'.format(time.time()),
+            'tags': 'load test',
+        })
+        return status
+
+    def close(self):
+        """Close the connection."""
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+def run_step(make_client, clients, duration, mix, seed=0):
+    """Run clients threads for duration seconds and summarize the results."""
+    names = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+    samples = []
+    lock = threading.Lock()
+    start = threading.Event()
+    deadline = []
+
+    def work(number):
+        rng = random.Random('{}-{}'.format(seed, number))
+        client = make_client(rng)
+        own = []
+        start.wait()
+        while time.time() < deadline[0]:
+            name = rng.choices(names, weights)[0]
+            began = time.time()
+            try:
+                ok = getattr(client, name)() in OK_STATUSES
+            except Exception:
+                ok = False
+            own.append((name, time.time() - began, ok))
+        client.close()
+        with lock:
+            samples.extend(own)
+
+    threads = [
+        threading.Thread(target=work, args=(number,))
+        for number in range(clients)
+    ]
+    for thread in threads:
+        thread.start()
+    began = time.time()
+    deadline.append(began + duration)
+    start.set()
+    for thread in threads:
+        thread.join()
+    return summarize(samples, time.time() - began)
+
+
+def serve(app, threads=4):
+    """Serve a WSGI app on a free local port in a background thread."""
+    server = create_server(app, host='127.0.0.1', port=0, threads=threads)
+    server.stopping = threading.Event()
+
+    def run():
+        while not server.stopping.is_set():
+            wasyncore.loop(timeout=0.05, map=server._map, count=1)
+
+    server.thread = threading.Thread(target=run)
+    server.thread.daemon = True
+    server.thread.start()
+    return server
+
+
+def stop(server):
+    """Stop a server started with serve, once its clients are done."""
+    server.stopping.set()
+    server.thread.join()
+    server.task_dispatcher.shutdown()
+    wasyncore.close_all(server._map)
+
+
+def format_row(threads, result):
+    """Format one line of the saturation table."""
+    return '{:>7} {:>9} {:>9.1f} {:>8.1f} {:>8.1f} {:>8.1f} {:>7.1%}'.format(
+        threads, result['requests'], result['throughput'],
+        result['p50'] * 1000, result['p95'] * 1000, result['p99'] * 1000,
+        result['error_rate'])
+
+
+def _prepare_database(url, entries, seed):
+    """Fill a fresh database with a corpus, returning the entry ids."""
+    engine = get_engine({'sqlalchemy.url': url})
+    Base.metadata.create_all(engine)
+    session_factory = get_session_factory(engine)
+    with transaction.manager:
+        dbsession = get_tm_session(session_factory, transaction.manager)
+        load_entries(dbsession, generate_entries(entries, seed=seed))
+    entry_ids = [entry_id for entry_id, in
+                 session_factory().query(Entry.id).order_by(Entry.id)]
+    engine.dispose()
+    return entry_ids
+
+
+def isolate_cache(settings, directory):
+    """Point the view cache at a file and key prefix of the test's own.
+
+    The synthetic entries reuse the ids of real ones, so a cache shared with
+    real workers must never see them.
+    """
+    settings = dict(settings)
+    settings['journal.cache.path'] = os.path.join(directory, 'cache.sqlite')
+    settings['journal.cache.prefix'] = 'loadtest-{}'.format(
+        os.path.basename(directory))
+    return settings
+
+
+def main(argv=sys.argv):
+    if len(argv) < 2:
+        usage(argv)
+    config_uri = argv[1]
+    options = parse_vars(argv[2:])
+    steps = [int(n) for n in options.pop('threads', DEFAULT_THREADS).split(',')]
+    duration = float(options.pop('duration', 5))
+    mix = parse_mix(options.pop('mix', DEFAULT_MIX))
+    entries = int(options.pop('entries', 500))
+    seed = int(options.pop('seed', 0))
+    server_threads = int(options.pop('server_threads', 4))
+
+    setup_logging(config_uri)
+    # the table already shows requests queueing up, as latency
+    logging.getLogger('waitress.queue').setLevel(logging.ERROR)
+
+    directory = tempfile.mkdtemp(prefix='journal-loadtest-')
+    try:
+        password = 'loadtest'
+        os.environ['DATABASE_URL'] = 'sqlite:///{}'.format(
+            os.path.join(directory, 'journal.sqlite'))
+        os.environ['AUTH_USERNAME'] = 'loadtest'
+        os.environ['AUTH_PASSWORD'] = pwd_context.hash(password)
+        os.environ.setdefault('AUTH_SECRET', 'loadtest')
+        os.environ.setdefault('SESSION_SECRET', 'loadtest')
+        entry_ids = _prepare_database(
+            os.environ['DATABASE_URL'], entries, seed)
+
+        settings = get_appsettings(config_uri, options=options)
+        app = make_app(settings.global_conf,
+                       **isolate_cache(settings, directory))
+        env = prepare(registry=app.registry)
+        env['app'] = app
+        server = serve(env['app'], server_threads)
+        host, port = '127.0.0.1', server.effective_port
+
+        def make_client(rng):
+            return Client(host, port, entry_ids, ('loadtest', password), rng)
+
+        print('Serving {} entries on {}:{} with {} server threads.'.format(
+            len(entry_ids), host, port, server_threads))
+        print('{:>7} {:>9} {:>9} {:>8} {:>8} {:>8} {:>7}'.format(
+            'threads', 'requests', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms',
+            'errors'))
+        for clients in steps:
+            result = run_step(make_client, clients, duration, mix, seed)
+            print(format_row(clients, result))
+        stats = query_cache_stats()
+        print('Baked queries reused {:.1%}, compiled statements {:.1%}.'.format(
+            stats['queries']['hit_rate'], stats['statements']['hit_rate']))
+        stop(server)
+        # let the background work finish before the database goes away
+        env['registry']['view_counter'].close()
+        env['registry']['draft_buffer'].close()
+        env['registry']['entry_events'].close()
+        env['closer']()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,183 @@
+"""Render the stored html of every entry again, across all cores.
+
+Only entries whose html was made by a different renderer (or never made)
+are rendered, and each batch is committed as soon as it is written, so a run
+that is stopped part way picks up where it left off. With ``dry_run=true``
+nothing is written; every entry is rendered and a checksum of the results is
+printed, to compare renderers or check that a run would change nothing.
+Once html has been saved, the cached entries and lists are forgotten.
+"""
+import collections
+import hashlib
+import os
+import sys
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from pyramid.paster import (
+    get_appsettings,
+    setup_logging,
+)
+from pyramid.path import DottedNameResolver
+from pyramid.scripts.common import parse_vars
+from sqlalchemy import and_, bindparam, or_
+
+from ..cache import SITE_LISTS, journal_namespace, make_cache
+from ..models import (
+    Entry,
+    get_engine,
+    get_session_factory,
+)
+from ..rendering import make_renderer, renderer_key
+
+BATCH_SIZE = 200
+
+_renderers = {}
+
+# resolves a dotted backend name the way config.maybe_dotted does
+_maybe_dotted = DottedNameResolver().maybe_resolve
+
+
+def usage(argv):
+    cmd = os.path.basename(argv[0])
+    print('usage: %s <config_uri> [batch_size=N] [workers=N] [dry_run=true] '
+          '[var=value]\n'
+          '(example: "%s production.ini workers=4")' % (cmd, cmd))
+    sys.exit(1)
+
+
+def render_rows(backend, extensions, rows):
+    """Render (id, version, body) rows in a worker process."""
+    key = (backend, tuple(extensions))
+    renderer = _renderers.get(key)
+    if renderer is None:
+        renderer = _renderers[key] = make_renderer(
+            backend, extensions, _maybe_dotted)
+    return [(entry_id, version, renderer.render(body))
+            for entry_id, version, body in rows]
+
+
+def _stale(html_key):
+    return or_(Entry.html_key.is_(None), Entry.html_key != html_key)
+
+
+def read_batches(session, batch_size, html_key=None):
+    """Get batches of (id, version, body) rows in id order.
+
+    With html_key, only rows whose html was made with another key.
+    """
+    last_id = 0
+    while True:
+        query = session.query(Entry.id, Entry.version, Entry.body).filter(
+            Entry.id > last_id)
+        if html_key is not None:
+            query = query.filter(_stale(html_key))
+        rows = query.order_by(Entry.id).limit(batch_size).all()
+        session.rollback()
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        yield [tuple(row) for row in rows]
+
+
+def write_batch(session, html_key, rendered):
+    """Store rendered html, skipping entries edited since they were read."""
+    table = Entry.__table__
+    session.execute(table.update().where(and_(
+        table.c.id == bindparam('_id'),
+        table.c.version == bindparam('_version')
+    )).values(html=bindparam('_html'), html_key=html_key), [
+        {'_id': entry_id, '_version': version, '_html': html}
+        for entry_id, version, html in rendered
+    ])
+    session.commit()
+
+
+def forget_rendered(session, cache):
+    """Forget the cached entries, and the lists of every journal."""
+    cache.invalidate('entry')
+    cache.invalidate(SITE_LISTS)
+    for journal_id, in session.query(Entry.journal_id).distinct():
+        cache.invalidate(journal_namespace(journal_id))
+    session.rollback()
+
+
+def rerender(session_factory, backend='markdown', extensions=(),
+             batch_size=BATCH_SIZE, workers=None, dry_run=False,
+             out=sys.stderr, cache=None):
+    """Render entries in a process pool, returning (count, checksum).
+
+    Results are handled in the order the batches were read, with at most two
+    batches per worker in flight. If any html was saved, the cached copies
+    of it are forgotten from cache.
+    """
+    extensions = list(extensions)
+    html_key = renderer_key(make_renderer(backend, extensions, _maybe_dotted))
+    session = session_factory()
+    stale = None if dry_run else html_key
+    query = session.query(Entry.id)
+    if stale:
+        query = query.filter(_stale(stale))
+    total = query.count()
+    workers = workers or os.cpu_count() or 1
+    checksum = hashlib.sha256()
+    done = 0
+    started = time.time()
+    pending = collections.deque()
+
+    def finish(future):
+        nonlocal done
+        rendered = future.result()
+        if dry_run:
+            for entry_id, _, html in rendered:
+                checksum.update('{}\0{}\0'.format(entry_id, html).encode('utf-8'))
+        else:
+            write_batch(session, html_key, rendered)
+        done += len(rendered)
+        rate = done / max(time.time() - started, 1e-9)
+        out.write('\rRendered {}/{} entries ({:.0f}/s)'.format(
+            done, total, rate))
+        out.flush()
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for rows in read_batches(session, batch_size, stale):
+                pending.append(executor.submit(
+                    render_rows, backend, extensions, rows))
+                if len(pending) >= 2 * workers:
+                    finish(pending.popleft())
+            while pending:
+                finish(pending.popleft())
+        if done and not dry_run and cache is not None:
+            forget_rendered(session, cache)
+    finally:
+        session.close()
+    out.write('\n')
+    return done, checksum.hexdigest()
+
+
+def main(argv=sys.argv):
+    if len(argv) < 2:
+        usage(argv)
+    config_uri = argv[1]
+    options = parse_vars(argv[2:])
+    batch_size = int(options.pop('batch_size', BATCH_SIZE))
+    workers = int(options.pop('workers', 0)) or None
+    dry_run = options.pop('dry_run', 'false').lower() in ('true', 'yes', '1')
+    setup_logging(config_uri)
+    settings = get_appsettings(config_uri, options=options)
+    settings["sqlalchemy.url"] = os.environ["DATABASE_URL"]
+
+    engine = get_engine(settings)
+    session_factory = get_session_factory(engine)
+    count, checksum = rerender(
+        session_factory,
+        settings.get('journal.markdown.backend', 'markdown'),
+        settings.get('journal.markdown.extensions', '').split(),
+        batch_size, workers, dry_run, cache=make_cache(settings)
+    )
+    if dry_run:
+        print('Rendered %d entries without saving, checksum %s.'
+              % (count, checksum))
+    else:
+        print('Rendered and saved %d entries.' % count)
@@ -1,10 +1,24 @@
-"""Configure and hold all pertinent security information for the app."""
+"""Configure and hold all pertinent security information for the app.
+
+Anyone logged in may use the pages that only touch their own work, like
+drafts and the preview. Writing to a journal, or to one of its entries, is
+only allowed to the journal's owner: those routes have a factory that looks
+up the journal and gives it an ACL naming its owner.
+"""
 import os
 from pyramid.authentication import AuthTktAuthenticationPolicy
 from pyramid.authorization import ACLAuthorizationPolicy
+from pyramid.httpexceptions import HTTPNotFound
 from pyramid.security import Authenticated, Allow
 from pyramid.session import SignedCookieSessionFactory
 from passlib.apps import custom_app_context as pwd_context
+from pyramid_learning_journal.models.journal import (
+    DEFAULT_JOURNAL,
+    find_journal,
+    find_user,
+    owned_journal,
+)
+from pyramid_learning_journal.models.mymodel import entry_journal
 
 
 class JournalRoot(object):
@@ -19,11 +33,82 @@ class JournalRoot(object):
     ]
 
 
-def check_credentials(username, password):
-    """Check if the username and password are correct."""
+class JournalContext(object):
+    """One journal, which only its owner may write to."""
+
+    def __init__(self, request, journal):
+        """Create the context of a journal dict."""
+        self.request = request
+        self.journal = journal
+        self.journal_id = journal['id']
+
+    @property
+    def __acl__(self):
+        return [(Allow, self.journal['owner'], 'secret')]
+
+
+def journal_factory(request):
+    """Get the journal named in the url, or raise HTTPNotFound."""
+    journal = find_journal(request.dbsession, slug=request.matchdict['slug'])
+    if journal is None:
+        raise HTTPNotFound
+    return JournalContext(request, journal)
+
+
+def default_journal_factory(request):
+    """Get the journal of a single journal site."""
+    journal = find_journal(request.dbsession, journal_id=DEFAULT_JOURNAL)
+    if journal is None:
+        return JournalRoot(request)
+    return JournalContext(request, journal)
+
+
+def entry_factory(request):
+    """Get the journal of the entry in the url.
+
+    A missing entry gets the root, so its views can answer with a 404.
+    """
+    journal = entry_journal(request.dbsession, int(request.matchdict['id']))
+    if journal is None:
+        return JournalRoot(request)
+    return JournalContext(request, journal)
+
+
+def journal_context(request, journal_id):
+    """Get the context of a journal by id, to check permissions against."""
+    journal = find_journal(request.dbsession, journal_id=journal_id)
+    if journal is None:
+        return JournalRoot(request)
+    return JournalContext(request, journal)
+
+
+def new_entry_url(request):
+    """Get where the logged in user adds an entry to their journal, or None."""
+    username = request.authenticated_userid
+    if not username:
+        return None
+    if username == os.environ.get('AUTH_USERNAME', ''):
+        return request.route_url('create')
+    journal = owned_journal(request.dbsession, username)
+    if journal is None:
+        return None
+    return request.route_url('journal_create', slug=journal['slug'])
+
+
+def check_credentials(username, password, session=None):
+    """Check if the username and password are correct.
+
+    The account in the environment is checked first, then the users table
+    when a database session is given.
+    """
     if username == os.environ.get('AUTH_USERNAME', ''):
         if pwd_context.verify(password, os.environ.get('AUTH_PASSWORD', '')):
             return True
+        return False
+    if session is not None:
+        user = find_user(session, username)
+        if user is not None and user.check_password(password):
+            return True
     return False
 
 
@@ -39,6 +124,7 @@ def includeme(config):
     authz_policy = ACLAuthorizationPolicy()
     config.set_authorization_policy(authz_policy)
     config.set_root_factory(JournalRoot)
+    config.add_request_method(new_entry_url, reify=True)
 
     session_secret = os.environ.get('SESSION_SECRET', '')
     session_factory = SignedCookieSessionFactory(session_secret)
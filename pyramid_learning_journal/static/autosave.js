@@ -0,0 +1,71 @@
+/* Save the editor's form as a draft every few seconds while it changes. */
+(function () {
+    var form = document.querySelector('form[data-autosave]');
+    if (!form || !window.fetch || !window.FormData) {
+        return;
+    }
+    var url = form.getAttribute('data-autosave');
+    var status = form.querySelector('.autosave-status');
+    var fields = ['title', 'body', 'tags'];
+
+    function snapshot() {
+        return fields.map(function (name) {
+            return form.elements[name] ? form.elements[name].value : '';
+        }).join('\u0000');
+    }
+
+    var saved = snapshot();
+    var saving = false;
+    // set once any form on the page is submitted: publishing or deleting
+    // discards the draft, and a save on the way out would bring it back
+    var leaving = false;
+
+    function save() {
+        var current = snapshot();
+        if (saving || current === saved) {
+            return;
+        }
+        saving = true;
+        fetch(url, {
+            method: 'POST',
+            body: new FormData(form),
+            credentials: 'same-origin'
+        }).then(function (response) {
+            if (response.ok) {
+                saved = current;
+                if (status) {
+                    status.textContent = 'Draft saved';
+                }
+            }
+        }).catch(function () {}).then(function () {
+            saving = false;
+        });
+    }
+
+    function saveOnUnload() {
+        if (leaving || snapshot() === saved) {
+            return;
+        }
+        // a plain fetch is usually cancelled as the page unloads
+        if (navigator.sendBeacon) {
+            navigator.sendBeacon(url, new FormData(form));
+        } else {
+            fetch(url, {
+                method: 'POST',
+                body: new FormData(form),
+                credentials: 'same-origin',
+                keepalive: true
+            }).catch(function () {});
+        }
+    }
+
+    document.addEventListener('submit', function () {
+        leaving = true;
+    }, true);
+    setInterval(function () {
+        if (!leaving) {
+            save();
+        }
+    }, parseInt(form.getAttribute('data-autosave-every'), 10) || 5000);
+    window.addEventListener('beforeunload', saveOnUnload);
+})();
@@ -0,0 +1,46 @@
+/* Show the editor's body as it will look, a moment after typing stops. */
+(function () {
+    var form = document.querySelector('form[data-preview]');
+    if (!form || !window.fetch || !window.FormData) {
+        return;
+    }
+    var url = form.getAttribute('data-preview');
+    var body = form.elements.body;
+    var panel = form.querySelector('.preview');
+    if (!body || !panel) {
+        return;
+    }
+    var timer = null;
+    var shown = null;
+
+    function show() {
+        var text = body.value;
+        if (text === shown) {
+            return;
+        }
+        var data = new FormData();
+        data.append('csrf_token', form.elements.csrf_token.value);
+        data.append('body', text);
+        fetch(url, {
+            method: 'POST',
+            body: data,
+            credentials: 'same-origin'
+        }).then(function (response) {
+            return response.ok ? response.json() : null;
+        }).then(function (result) {
+            if (result && body.value === text) {
+                shown = text;
+                panel.innerHTML = result.html;
+                panel.parentNode.parentNode.classList.remove('d-none');
+            }
+        }).catch(function () {});
+    }
+
+    body.addEventListener('input', function () {
+        clearTimeout(timer);
+        timer = setTimeout(show, parseInt(form.getAttribute('data-preview-after'), 10) || 500);
+    });
+    if (body.value) {
+        show();
+    }
+})();
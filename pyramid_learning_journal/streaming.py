@@ -0,0 +1,73 @@
+"""Stream Jinja2 templates to the client as they are rendered."""
+from pyramid.settings import asbool
+from pyramid_jinja2 import IJinja2Environment
+
+
+DEFAULT_BUFFER_SIZE = 8192
+
+
+class ChunkBuffer(object):
+    """Coalesce the small pieces Jinja2 yields into larger chunks.
+
+    Pieces are held until ``size`` bytes have been collected, or until the
+    template calls ``flush()`` to push everything rendered so far.
+    """
+
+    def __init__(self, size=DEFAULT_BUFFER_SIZE, encoding='utf-8'):
+        """Create an empty buffer that yields chunks of about size bytes."""
+        self.size = size
+        self.encoding = encoding
+        self.flush_requested = False
+
+    def flush(self):
+        """Ask for the buffer to be sent after the current piece."""
+        self.flush_requested = True
+        return ''
+
+    def chunks(self, pieces):
+        """Turn an iterable of text pieces into encoded chunks."""
+        buf = []
+        length = 0
+        for piece in pieces:
+            if piece:
+                data = piece.encode(self.encoding)
+                buf.append(data)
+                length += len(data)
+            if buf and (self.flush_requested or length >= self.size):
+                yield b''.join(buf)
+                buf = []
+                length = 0
+            self.flush_requested = False
+        if buf:
+            yield b''.join(buf)
+
+
+def streaming_enabled(request):
+    """Check if the app has opted in to streaming templates."""
+    settings = request.registry.settings or {}
+    return asbool(settings.get('journal.stream_templates', False))
+
+
+def render_to_stream(template_name, value, request, buffer_size=None):
+    """Render a template into a Response that streams its app_iter.
+
+    The template gets a ``flush()`` function in its context, which it can call
+    at points where the client should receive what has been rendered so far.
+    Any lazy iterables in ``value`` are consumed while the response is sent.
+    """
+    settings = request.registry.settings or {}
+    if buffer_size is None:
+        buffer_size = int(settings.get(
+            'journal.stream_buffer_size', DEFAULT_BUFFER_SIZE))
+    env = request.registry.queryUtility(IJinja2Environment, name='.jinja2')
+    template = env.get_template(template_name)
+    buffer = ChunkBuffer(buffer_size)
+
+    context = {'request': request, 'flush': buffer.flush}
+    context.update(value)
+
+    response = request.response
+    response.content_type = 'text/html'
+    response.charset = buffer.encoding
+    response.app_iter = buffer.chunks(template.generate(**context))
+    return response
@@ -0,0 +1,21 @@
+"""Work done in reaction to entries being created, updated or deleted."""
+from pyramid_learning_journal.events import EntryEvent
+from pyramid_learning_journal.models.related import update_related
+
+
+def update_related_entries(event):
+    """Recompute the related entries touched by the changed entries."""
+    session = event.registry['dbsession_factory']()
+    try:
+        update_related(session, event.entry_ids)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def includeme(config):
+    """Subscribe to entry events. Needs pyramid_learning_journal.events."""
+    config.add_entry_subscriber(update_related_entries, EntryEvent)
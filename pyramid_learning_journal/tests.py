@@ -792,8 +792,9 @@ def test_update_get_route_auth_for_valid_id_gets_200_status_code(testapp):
 def test_update_get_route_auth_has_filled_form(testapp):
     """Test that the Update page has a filled form."""
     response = testapp.get("/journal/1/edit-entry")
-    assert len(response.html.find_all('input', attrs={"type": "text"})) == 1
-    assert 'value="Day 0"' in str(response.html.find('input', attrs={"type": "text"}))
+    inputs = response.html.find_all('input', attrs={"type": "text"})
+    assert [i.attrs['name'] for i in inputs] == ['title', 'tags']
+    assert 'value="Day 0"' in str(response.html.find('input', attrs={"name": "title"}))
 
 
 def test_update_get_route_auth_has_an_update_button(testapp):
@@ -955,8 +956,9 @@ def test_create_get_route_auth_gets_200_status_code(testapp):
 def test_create_get_route_auth_has_empty_form(testapp):
     """Test that the Create page has an empty form."""
     response = testapp.get("/journal/new-entry")
-    assert len(response.html.find_all('input', attrs={"type": "text"})) == 1
-    assert 'value' not in response.html.find('input', attrs={"type": "text"})
+    inputs = response.html.find_all('input', attrs={"type": "text"})
+    assert [i.attrs['name'] for i in inputs] == ['title', 'tags']
+    assert all('value' not in i.attrs for i in inputs)
 
 
 def test_create_get_route_auth_has_a_create_button(testapp):
@@ -1063,3 +1065,2821 @@ def test_logout_route_auth_removes_auth_tkt_cookie(testapp):
     """Test that the logout route removes the auth_tkt cookie."""
     testapp.get("/logout")
     assert 'auth_tkt' not in testapp.cookies
+
+
+""" TESTS FOR STREAMING TEMPLATES """
+
+
+def test_chunk_buffer_holds_pieces_until_size_reached():
+    """Test that ChunkBuffer coalesces small pieces into one chunk."""
+    from pyramid_learning_journal.streaming import ChunkBuffer
+    buffer = ChunkBuffer(size=10)
+    chunks = list(buffer.chunks(['abc', 'def', 'ghij', 'k']))
+    assert chunks == [b'abcdefghij', b'k']
+
+
+def test_chunk_buffer_flush_sends_pending_pieces():
+    """Test that calling flush from the template sends the buffer early."""
+    from pyramid_learning_journal.streaming import ChunkBuffer
+    buffer = ChunkBuffer(size=1000)
+
+    def pieces():
+        yield '<head>'
+        yield buffer.flush()
+        yield '<card>'
+
+    assert list(buffer.chunks(pieces())) == [b'<head>', b'<card>']
+
+
+def test_list_view_returns_dict_when_streaming_disabled(dummy_request):
+    """Test that list_view only streams when the app opts in."""
+    from pyramid_learning_journal.views.default import list_view
+    assert isinstance(list_view(dummy_request), dict)
+
+
+def test_home_route_streams_all_entries_when_enabled(testapp, empty_the_db, testapp_session):
+    """Test that the streamed home page has every entry, newest first."""
+    from pyramid_learning_journal.models import Entry
+    testapp_session.add_all([
+        Entry(title='Old', body='old', creation_date=datetime(2017, 10, 1)),
+        Entry(title='New', body='new', creation_date=datetime(2017, 11, 1))
+    ])
+    testapp_session.commit()
+    settings = testapp.app.registry.settings
+    settings['journal.stream_templates'] = 'true'
+    try:
+        response = testapp.get('/')
+    finally:
+        del settings['journal.stream_templates']
+    titles = [h2.text for h2 in response.html.find_all('h2')]
+    assert titles == ['New', 'Old']
+    assert response.html.find('link', {'rel': 'stylesheet'})
+
+
+""" TESTS FOR ENTRY EVENTS """
+
+
+def test_event_pipeline_inline_delivers_matching_events():
+    """Test that subscribers only get the event types they asked for."""
+    from pyramid_learning_journal.events import (
+        EventPipeline, EntryCreated, EntryDeleted)
+    pipeline = EventPipeline(workers=0)
+    seen = []
+    pipeline.subscribe(seen.append, EntryCreated)
+    pipeline.publish(EntryCreated(1))
+    pipeline.publish(EntryDeleted(1))
+    assert [e.entry_id for e in seen] == [1]
+    assert pipeline.stats()['delivered'] == 1
+
+
+def test_event_pipeline_retries_failing_subscriber():
+    """Test that a failing subscriber is called again until it succeeds."""
+    from pyramid_learning_journal.events import EventPipeline, EntryUpdated
+    pipeline = EventPipeline(workers=0, max_attempts=3, retry_delay=0)
+    calls = []
+
+    def flaky(event):
+        calls.append(event)
+        if len(calls) < 2:
+            raise ValueError
+
+    pipeline.subscribe(flaky)
+    pipeline.publish(EntryUpdated(3))
+    stats = pipeline.stats()
+    assert len(calls) == 2
+    assert stats['retried'] == 1
+    assert stats['failed'] == 0
+
+
+def test_event_pipeline_background_workers_deliver_all_events(file_session_factory):
+    """Test that events stored in the outbox reach the worker threads."""
+    from pyramid_learning_journal.events import EventPipeline, EntryCreated
+    from pyramid_learning_journal.models import OutboxEvent
+    pipeline = EventPipeline(file_session_factory, workers=2, batch_size=5)
+    seen = []
+    pipeline.subscribe(lambda e: seen.append(e.entry_id))
+    for i in range(20):
+        pipeline.publish(EntryCreated(i))
+    pipeline.close()
+    assert sorted(seen) == list(range(20))
+    stats = pipeline.stats()
+    assert (stats['stored'], stats['queue_depth']) == (20, 0)
+    assert file_session_factory().query(OutboxEvent).count() == 0
+
+
+def test_event_pipeline_never_delivers_in_the_publishing_thread(
+        file_session_factory):
+    """Test that a slow subscriber never holds up publish."""
+    import threading
+    from pyramid_learning_journal.events import EventPipeline, EntryCreated
+    pipeline = EventPipeline(file_session_factory, workers=1)
+    started, release = threading.Event(), threading.Event()
+    seen = []
+
+    def slow(event):
+        if event.entry_id == 0:
+            started.set()
+            release.wait(5)
+        seen.append(event.entry_id)
+
+    pipeline.subscribe(slow)
+    pipeline.publish(EntryCreated(0))
+    assert started.wait(5)
+    for i in range(1, 4):
+        pipeline.publish(EntryCreated(i))
+    assert seen == []
+    release.set()
+    pipeline.close()
+    assert sorted(seen) == [0, 1, 2, 3]
+
+
+def test_event_pipeline_outbox_outlives_the_process(file_session_factory):
+    """Test that events one pipeline stored are delivered by another."""
+    from pyramid_learning_journal.events import EventPipeline, EntriesChanged
+    from pyramid_learning_journal.models.outbox import store_event
+    session = file_session_factory()
+    store_event(session, 'EntriesChanged', [1, 2], [3])
+    session.commit()
+    pipeline = EventPipeline(file_session_factory, workers=1)
+    seen = []
+    pipeline.subscribe(seen.append, EntriesChanged)
+    pipeline.drain()
+    assert [(e.entry_ids, e.journal_ids) for e in seen] == [([1, 2], [3])]
+    assert pipeline.stats()['queue_depth'] == 0
+
+
+def test_event_pipeline_retries_stored_events_later_then_keeps_them(
+        file_session_factory):
+    """Test that a failing background subscriber is retried, not lost."""
+    from pyramid_learning_journal.events import EventPipeline, EntryUpdated
+    from pyramid_learning_journal.models import OutboxEvent
+    pipeline = EventPipeline(file_session_factory, workers=1, max_attempts=2,
+                             retry_delay=0)
+    calls = []
+
+    def broken(event):
+        calls.append(event)
+        raise ValueError
+
+    pipeline.subscribe(broken)
+    pipeline.publish(EntryUpdated(3))
+    pipeline.close()
+    assert len(calls) == 2
+    stats = pipeline.stats()
+    assert (stats['retried'], stats['failed'], stats['queue_depth']) == (1, 1, 0)
+    stored = file_session_factory().query(OutboxEvent).one()
+    assert (stored.kind, stored.attempts) == ('EntryUpdated', 2)
+
+
+def test_notify_after_commit_stores_the_event_with_the_change(
+        dummy_request, file_session_factory):
+    """Test that the event is written in the request's transaction."""
+    from pyramid_learning_journal.events import (
+        EntryCreated, EventPipeline, notify_after_commit)
+    from pyramid_learning_journal.models import OutboxEvent
+    import transaction
+    pipeline = EventPipeline(file_session_factory, workers=1)
+    pipeline.subscribe(lambda event: None)
+    dummy_request.registry['entry_events'] = pipeline
+    try:
+        transaction.begin()
+        notify_after_commit(dummy_request, EntryCreated(1))
+        assert dummy_request.dbsession.query(OutboxEvent).count() == 1
+        assert pipeline.counts['published'] == 0
+        transaction.commit()
+    finally:
+        del dummy_request.registry['entry_events']
+        pipeline.close()
+    assert (pipeline.counts['published'], pipeline.counts['stored']) == (1, 1)
+
+
+def test_create_view_publishes_event_only_after_commit(dummy_request):
+    """Test that create_view waits for the commit to emit EntryCreated."""
+    from pyramid_learning_journal.events import EventPipeline, EntryCreated
+    from pyramid_learning_journal.views.default import create_view
+    from pyramid_learning_journal.models import Entry
+    import transaction
+    pipeline = EventPipeline(workers=0)
+    seen = []
+    pipeline.subscribe(seen.append, EntryCreated)
+    dummy_request.registry['entry_events'] = pipeline
+    dummy_request.method = 'POST'
+    dummy_request.POST = {'title': 'fun times', 'body': 'all the fun.'}
+    try:
+        transaction.begin()
+        create_view(dummy_request)
+        assert seen == []
+        transaction.commit()
+    finally:
+        del dummy_request.registry['entry_events']
+    entry = dummy_request.dbsession.query(Entry).filter_by(title='fun times').one()
+    assert [e.entry_id for e in seen] == [entry.id]
+
+
+def test_delete_view_event_is_not_published_on_abort(dummy_request, add_entry):
+    """Test that no event is emitted when the transaction is aborted."""
+    from pyramid_learning_journal.events import EventPipeline
+    from pyramid_learning_journal.views.default import delete_journal_entry
+    import transaction
+    pipeline = EventPipeline(workers=0)
+    seen = []
+    pipeline.subscribe(seen.append)
+    dummy_request.registry['entry_events'] = pipeline
+    dummy_request.dbsession.flush()
+    dummy_request.method = 'POST'
+    dummy_request.matchdict['id'] = add_entry.id
+    try:
+        transaction.begin()
+        delete_journal_entry(dummy_request)
+        transaction.abort()
+    finally:
+        del dummy_request.registry['entry_events']
+    assert seen == []
+
+
+""" TESTS FOR REVISION HISTORY """
+
+
+def test_apply_delta_rebuilds_new_text_from_old():
+    """Test that a delta turns the old text back into the new text."""
+    from pyramid_learning_journal.models.revision import encode_delta, apply_delta
+    old = 'one\ntwo\nthree\nfour\n'
+    new = 'one\n2\nthree\nfour\nfive'
+    delta = encode_delta(old, new)
+    assert apply_delta(old, delta) == new
+    assert [0, 1] in delta
+
+
+def test_record_revision_stores_previous_version_on_first_edit(dummy_request, add_entry):
+    """Test that the first edit keeps the original text as revision 1."""
+    from pyramid_learning_journal.models.revision import record_revision, get_revision
+    dummy_request.dbsession.flush()
+    add_entry.body = 'This is an edited test.'
+    record_revision(dummy_request.dbsession, add_entry, 'test entry', 'This is a test.')
+    assert add_entry.revisions.count() == 2
+    original = get_revision(dummy_request.dbsession, add_entry.id, 1)
+    assert original['body'] == 'This is a test.'
+    assert get_revision(dummy_request.dbsession, add_entry.id, 2)['body'] == add_entry.body
+
+
+def test_get_revision_rebuilds_every_revision_across_snapshots(dummy_request, add_entry):
+    """Test that revisions past a snapshot are rebuilt correctly."""
+    from pyramid_learning_journal.models.revision import (
+        record_revision, get_revision, SNAPSHOT_EVERY)
+    dummy_request.dbsession.flush()
+    bodies = [add_entry.body]
+    for i in range(SNAPSHOT_EVERY + 3):
+        previous = add_entry.body
+        add_entry.body = previous + '\nline {}'.format(i)
+        bodies.append(add_entry.body)
+        record_revision(dummy_request.dbsession, add_entry, add_entry.title, previous)
+    snapshots = add_entry.revisions.filter_by(is_snapshot=True).count()
+    assert snapshots == 2
+    for number, body in enumerate(bodies, 1):
+        assert get_revision(dummy_request.dbsession, add_entry.id, number)['body'] == body
+
+
+def test_get_revision_returns_none_for_missing_revision(dummy_request, add_entry):
+    """Test that get_revision gives None for a revision that doesn't exist."""
+    from pyramid_learning_journal.models.revision import get_revision
+    dummy_request.dbsession.flush()
+    assert get_revision(dummy_request.dbsession, add_entry.id, 4) is None
+
+
+def test_update_view_post_records_a_revision(dummy_request, add_entry):
+    """Test that updating an entry keeps the old version in its history."""
+    from pyramid_learning_journal.views.default import update_view
+    dummy_request.dbsession.flush()
+    dummy_request.matchdict['id'] = add_entry.id
+    dummy_request.method = 'POST'
+    dummy_request.POST = {'title': 'new title', 'body': 'new body'}
+    update_view(dummy_request)
+    assert [r.title for r in add_entry.revisions] == ['test entry', 'new title']
+
+
+def test_history_view_lists_revisions_newest_first(dummy_request, add_entry):
+    """Test that the history view lists the revisions of the entry."""
+    from pyramid_learning_journal.models.revision import record_revision
+    from pyramid_learning_journal.views.history import history_view
+    dummy_request.dbsession.flush()
+    add_entry.body = 'changed'
+    record_revision(dummy_request.dbsession, add_entry, 'test entry', 'This is a test.')
+    dummy_request.matchdict['id'] = add_entry.id
+    response = history_view(dummy_request)
+    assert [r['number'] for r in response['revisions']] == [2, 1]
+
+
+def test_history_view_raises_httpnotfound_for_bad_id(dummy_request):
+    """Test that history_view raises HTTPNotFound for a missing entry."""
+    from pyramid_learning_journal.views.history import history_view
+    dummy_request.matchdict['id'] = 99
+    with pytest.raises(HTTPNotFound):
+        history_view(dummy_request)
+
+
+def test_revision_view_has_diff_from_previous_revision(dummy_request, add_entry):
+    """Test that the revision view shows the lines that changed."""
+    from pyramid_learning_journal.models.revision import record_revision
+    from pyramid_learning_journal.views.history import revision_view
+    dummy_request.dbsession.flush()
+    add_entry.body = 'This is a changed test.'
+    record_revision(dummy_request.dbsession, add_entry, 'test entry', 'This is a test.')
+    dummy_request.matchdict.update({'id': add_entry.id, 'rev': 2})
+    response = revision_view(dummy_request)
+    assert '-This is a test.' in response['diff']
+    assert '+This is a changed test.' in response['diff']
+
+
+def test_revision_view_raises_httpnotfound_for_bad_revision(dummy_request, add_entry):
+    """Test that revision_view raises HTTPNotFound for a missing revision."""
+    from pyramid_learning_journal.views.history import revision_view
+    dummy_request.dbsession.flush()
+    dummy_request.matchdict.update({'id': add_entry.id, 'rev': 5})
+    with pytest.raises(HTTPNotFound):
+        revision_view(dummy_request)
+
+
+def test_restore_revision_puts_old_text_back_as_new_revision(dummy_request, add_entry):
+    """Test that restoring a revision makes its text current again."""
+    from pyramid_learning_journal.models.revision import record_revision
+    from pyramid_learning_journal.views.history import restore_revision
+    dummy_request.dbsession.flush()
+    add_entry.title, add_entry.body = 'changed', 'changed body'
+    record_revision(dummy_request.dbsession, add_entry, 'test entry', 'This is a test.')
+    dummy_request.method = 'POST'
+    dummy_request.matchdict.update({'id': add_entry.id, 'rev': 1})
+    response = restore_revision(dummy_request)
+    assert isinstance(response, HTTPFound)
+    assert add_entry.body == 'This is a test.'
+    assert add_entry.revisions.count() == 3
+
+
+def test_restore_revision_get_raises_httpnotfound(dummy_request, add_entry):
+    """Test that restoring a revision needs a POST."""
+    from pyramid_learning_journal.views.history import restore_revision
+    dummy_request.matchdict.update({'id': 1, 'rev': 1})
+    with pytest.raises(HTTPNotFound):
+        restore_revision(dummy_request)
+
+
+def test_history_and_restore_routes_auth_round_trip(logged_in, empty_the_db, csrf_token):
+    """Test editing, viewing the history of and restoring an entry."""
+    logged_in.post('/journal/new-entry', {
+        'csrf_token': csrf_token, 'title': 'first', 'body': 'first body'})
+    logged_in.post('/journal/1/edit-entry', {
+        'csrf_token': csrf_token, 'title': 'second', 'body': 'second body'})
+    history = logged_in.get('/journal/1/history')
+    assert len(history.html.find_all('li', 'revision')) == 2
+    revision = logged_in.get('/journal/1/history/2')
+    assert '+second body' in revision.html.find('ins').text
+    logged_in.post('/journal/1/history/1/restore', {'csrf_token': csrf_token})
+    detail = logged_in.get('/journal/1')
+    assert 'first' in detail.html.find('h2').text
+
+
+""" TESTS FOR TAGS """
+
+
+def test_parse_tags_normalizes_and_removes_duplicates():
+    """Test that parse_tags lowercases, trims and dedupes tag names."""
+    from pyramid_learning_journal.models.tag import parse_tags
+    assert parse_tags(' pytest, SQLAlchemy ,,pytest,  unit   tests') == [
+        'pytest', 'sqlalchemy', 'unit tests']
+    assert parse_tags(None) == []
+
+
+def test_parse_tags_keeps_names_that_fit_in_a_url_segment():
+    """Test that slashes become spaces and names of only dots are dropped."""
+    from pyramid_learning_journal.models.tag import parse_tags
+    assert parse_tags('ci/cd, a / b, .., ., .net') == ['ci cd', 'a b', '.net']
+
+
+def test_set_tags_uses_a_tag_added_since_it_looked(dummy_request):
+    """Test that a tag another request added first is shared, not added again."""
+    from pyramid_learning_journal.models import Entry, Tag
+    from pyramid_learning_journal.models.tag import add_tags, set_tags
+    session = dummy_request.dbsession
+    add_tags(session, ['raced'])
+    add_tags(session, ['raced'])
+    entry = Entry(title='a', body='a')
+    session.add(entry)
+    set_tags(session, entry, ['raced'])
+    session.flush()
+    tag = session.query(Tag).filter_by(name='raced').one()
+    assert tag.entry_count == 1
+    assert tag.entries == [entry]
+
+
+def test_set_tags_keeps_entry_counts_current(dummy_request):
+    """Test that tag counts follow entries being tagged and untagged."""
+    from pyramid_learning_journal.models import Entry, Tag
+    from pyramid_learning_journal.models.tag import set_tags
+    session = dummy_request.dbsession
+    first, second = Entry(title='a', body='a'), Entry(title='b', body='b')
+    session.add_all([first, second])
+    set_tags(session, first, ['pytest', 'sql'])
+    set_tags(session, second, ['pytest'])
+    session.flush()
+    counts = dict(session.query(Tag.name, Tag.entry_count))
+    assert counts == {'pytest': 2, 'sql': 1}
+
+    set_tags(session, first, ['sql', 'jinja'])
+    session.flush()
+    counts = dict(session.query(Tag.name, Tag.entry_count))
+    assert counts == {'pytest': 1, 'sql': 1, 'jinja': 1}
+    assert sorted(t.name for t in first.tags) == ['jinja', 'sql']
+
+
+def test_tag_cloud_only_has_tags_in_use(dummy_request):
+    """Test that the tag cloud skips tags with no entries left."""
+    from pyramid_learning_journal.models import Entry
+    from pyramid_learning_journal.models.tag import set_tags, tag_cloud
+    session = dummy_request.dbsession
+    entry = Entry(title='a', body='a')
+    session.add(entry)
+    set_tags(session, entry, ['old'])
+    session.flush()
+    set_tags(session, entry, ['new'])
+    session.flush()
+    assert [t['name'] for t in tag_cloud(session)] == ['new']
+
+
+def test_create_view_post_adds_tags(dummy_request):
+    """Test that create_view tags the new entry from the form."""
+    from pyramid_learning_journal.views.default import create_view
+    from pyramid_learning_journal.models import Tag
+    dummy_request.method = 'POST'
+    dummy_request.POST = {'title': 't', 'body': 'b', 'tags': 'pytest, tdd'}
+    create_view(dummy_request)
+    tag = dummy_request.dbsession.query(Tag).filter_by(name='pytest').one()
+    assert tag.entry_count == 1
+    assert tag.entries[0].title == 't'
+
+
+def test_delete_journal_entry_post_decrements_tag_counts(dummy_request, add_entry):
+    """Test that deleting an entry takes it out of its tags' counts."""
+    from pyramid_learning_journal.models.tag import set_tags
+    from pyramid_learning_journal.models import Tag
+    from pyramid_learning_journal.views.default import delete_journal_entry
+    set_tags(dummy_request.dbsession, add_entry, ['pytest'])
+    dummy_request.dbsession.flush()
+    dummy_request.method = 'POST'
+    dummy_request.matchdict['id'] = add_entry.id
+    delete_journal_entry(dummy_request)
+    dummy_request.dbsession.flush()
+    tag = dummy_request.dbsession.query(Tag).filter_by(name='pytest').one()
+    assert tag.entry_count == 0
+
+
+def test_tag_view_pages_through_tagged_entries(dummy_request):
+    """Test that the tag view returns one page of entries at a time."""
+    from pyramid_learning_journal.models import Entry
+    from pyramid_learning_journal.models.tag import set_tags
+    from pyramid_learning_journal.views.tags import tag_view, PAGE_SIZE
+    session = dummy_request.dbsession
+    for i in range(PAGE_SIZE + 2):
+        entry = Entry(title='Day {}'.format(i), body='b',
+                      creation_date=datetime(2017, 10, 1 + i))
+        session.add(entry)
+        set_tags(session, entry, ['pytest'])
+    session.add(Entry(title='untagged', body='b'))
+    session.flush()
+    dummy_request.matchdict['name'] = 'PyTest'
+    first = tag_view(dummy_request)
+    assert len(first['entries']) == PAGE_SIZE
+    assert first['entries'][0]['title'] == 'Day {}'.format(PAGE_SIZE + 1)
+    assert first['has_next']
+    dummy_request.params = {'page': '2'}
+    second = tag_view(dummy_request)
+    assert [e['title'] for e in second['entries']] == ['Day 1', 'Day 0']
+    assert not second['has_next']
+
+
+def test_tag_view_raises_httpnotfound_for_unknown_tag(dummy_request):
+    """Test that tag_view raises HTTPNotFound for a tag nobody uses."""
+    from pyramid_learning_journal.views.tags import tag_view
+    dummy_request.matchdict['name'] = 'nope'
+    with pytest.raises(HTTPNotFound):
+        tag_view(dummy_request)
+
+
+def test_tag_route_lists_tagged_entries_and_cloud(logged_in, empty_the_db, csrf_token):
+    """Test that tagged entries show up on the tag page and the cloud."""
+    logged_in.post('/journal/new-entry', {
+        'csrf_token': csrf_token, 'title': 'tagged', 'body': 'b', 'tags': 'pytest'})
+    logged_in.post('/journal/new-entry', {
+        'csrf_token': csrf_token, 'title': 'other', 'body': 'b'})
+    home = logged_in.get('/')
+    assert home.html.find('div', 'tag-cloud').find('a').text == 'pytest'
+    response = logged_in.get('/tag/pytest')
+    assert [h2.text for h2 in response.html.find_all('h2')] == ['tagged']
+
+
+""" TESTS FOR THE MONTHLY ARCHIVE """
+
+
+def test_count_entry_adds_and_removes_from_month(dummy_request):
+    """Test that count_entry keeps a running count for each month."""
+    from pyramid_learning_journal.models.archive import count_entry, archive_months
+    session = dummy_request.dbsession
+    count_entry(session, datetime(2017, 10, 16))
+    count_entry(session, datetime(2017, 10, 20))
+    count_entry(session, datetime(2017, 11, 1))
+    count_entry(session, datetime(2017, 11, 3), -1)
+    months = [m for m in archive_months(session) if m['year'] == 2017]
+    assert [(m['name'], m['count']) for m in months] == [('October 2017', 2)]
+
+
+def test_count_entry_adds_to_a_month_inserted_since_it_looked(dummy_request):
+    """Test that a writer that missed a new month's row adds to it."""
+    from pyramid_learning_journal.models.archive import (
+        COUNT_ENTRY, archive_months, count_entry)
+    session = dummy_request.dbsession
+    count_entry(session, datetime(2016, 3, 1))
+    session.execute(COUNT_ENTRY, {'year': 2016, 'month': 3, 'change': 1})
+    months = [m for m in archive_months(session) if m['year'] == 2016]
+    assert [(m['month'], m['count']) for m in months] == [(3, 2)]
+
+
+def test_rebuild_monthly_counts_matches_entries(dummy_request):
+    """Test that rebuilding the counts groups the entries by month."""
+    from pyramid_learning_journal.models import Entry
+    from pyramid_learning_journal.models.archive import (
+        rebuild_monthly_counts, archive_months)
+    session = dummy_request.dbsession
+    session.add_all([
+        Entry(title='a', body='a', creation_date=datetime(2017, 10, 16)),
+        Entry(title='b', body='b', creation_date=datetime(2017, 11, 2)),
+        Entry(title='c', body='c', creation_date=datetime(2017, 11, 3)),
+    ])
+    session.flush()
+    rebuild_monthly_counts(session)
+    months = [m for m in archive_months(session) if m['year'] == 2017]
+    assert [(m['year'], m['month'], m['count']) for m in months] == [
+        (2017, 11, 2), (2017, 10, 1)]
+
+
+def test_create_and_delete_views_keep_monthly_counts(dummy_request):
+    """Test that creating then deleting an entry leaves its month at 0."""
+    from pyramid_learning_journal.models import Entry
+    from pyramid_learning_journal.models.archive import archive_months
+    from pyramid_learning_journal.views.default import create_view, delete_journal_entry
+    dummy_request.method = 'POST'
+    dummy_request.POST = {'title': 't', 'body': 'b'}
+    before = archive_months(dummy_request.dbsession)
+    create_view(dummy_request)
+    entry = dummy_request.dbsession.query(Entry).filter_by(title='t').one()
+    months = archive_months(dummy_request.dbsession)
+    assert sum(m['count'] for m in months) == sum(m['count'] for m in before) + 1
+    dummy_request.matchdict['id'] = entry.id
+    delete_journal_entry(dummy_request)
+    assert archive_months(dummy_request.dbsession) == before
+
+
+def test_archive_view_only_has_entries_from_the_month(dummy_request):
+    """Test that the archive view returns the month's entries, newest first."""
+    from pyramid_learning_journal.models import Entry
+    from pyramid_learning_journal.views.archive import archive_view
+    dummy_request.dbsession.add_all([
+        Entry(title='Sept', body='a', creation_date=datetime(2017, 9, 30, 23)),
+        Entry(title='Oct 1', body='b', creation_date=datetime(2017, 10, 1)),
+        Entry(title='Oct 31', body='c', creation_date=datetime(2017, 10, 31, 23)),
+        Entry(title='Nov', body='d', creation_date=datetime(2017, 11, 1)),
+    ])
+    dummy_request.matchdict.update({'year': '2017', 'month': '10'})
+    response = archive_view(dummy_request)
+    assert [e['title'] for e in response['entries']] == ['Oct 31', 'Oct 1']
+    assert response['page_title'] == 'October 2017'
+
+
+def test_archive_view_raises_httpnotfound_for_bad_month(dummy_request):
+    """Test that archive_view raises HTTPNotFound for month 13."""
+    from pyramid_learning_journal.views.archive import archive_view
+    dummy_request.matchdict.update({'year': '2017', 'month': '13'})
+    with pytest.raises(HTTPNotFound):
+        archive_view(dummy_request)
+
+
+@pytest.mark.parametrize('year, month', [('0000', '1'), ('9999', '12')])
+def test_archive_view_raises_httpnotfound_out_of_range(dummy_request, year, month):
+    """Test that months datetime can't hold the range of are not found."""
+    from pyramid_learning_journal.views.archive import archive_view
+    dummy_request.matchdict.update({'year': year, 'month': month})
+    with pytest.raises(HTTPNotFound):
+        archive_view(dummy_request)
+
+
+def test_archive_route_is_linked_from_home(logged_in, empty_the_db, csrf_token):
+    """Test that a new entry's month links to its archive page."""
+    logged_in.post('/journal/new-entry', {
+        'csrf_token': csrf_token, 'title': 'archived', 'body': 'b'})
+    home = logged_in.get('/')
+    link = home.html.find('nav', 'archive').find('a')
+    assert link.find_next('span').text == '1'
+    response = logged_in.get(link.attrs['href'])
+    assert [h2.text for h2 in response.html.find_all('h2')] == ['archived']
+
+
+""" TESTS FOR RELATED ENTRIES """
+
+
+@pytest.fixture
+def topic_entries(dummy_request):
+    """Add entries about a few topics to the database."""
+    from pyramid_learning_journal.models import Entry
+    entries = [
+        Entry(title='pytest 1', body='pytest fixtures make testing easy'),
+        Entry(title='pytest 2', body='more pytest fixtures and testing today'),
+        Entry(title='sql 1', body='sqlalchemy queries against postgres'),
+        Entry(title='sql 2', body='postgres indexes speed up sqlalchemy queries'),
+        Entry(title='sockets', body='sockets listen on a port for clients'),
+    ]
+    dummy_request.dbsession.add_all(entries)
+    dummy_request.dbsession.flush()
+    return entries
+
+
+def test_vectorize_makes_unit_length_float32_vectors():
+    """Test that TF-IDF vectors are normalized float32 arrays."""
+    from pyramid_learning_journal.models.related import build_model, vectorize
+    import numpy as np
+    model = build_model(['pytest fixtures', 'sqlalchemy queries', 'pytest'])
+    vector = vectorize('pytest pytest fixtures', model.terms(), model.weights())
+    assert vector.dtype == np.float32
+    assert abs(np.linalg.norm(vector) - 1) < 1e-6
+    assert not vectorize('the and of', model.terms(), model.weights()).any()
+
+
+def test_rebuild_related_pairs_entries_on_the_same_topic(dummy_request, topic_entries):
+    """Test that the most related entry shares the topic."""
+    from pyramid_learning_journal.models.related import rebuild_related, related_entries
+    rebuild_related(dummy_request.dbsession)
+    pytest_1, pytest_2, sql_1, sql_2, sockets = topic_entries
+    assert related_entries(dummy_request.dbsession, pytest_1.id)[0]['id'] == pytest_2.id
+    assert related_entries(dummy_request.dbsession, sql_2.id)[0]['id'] == sql_1.id
+    assert related_entries(dummy_request.dbsession, sockets.id) == []
+
+
+def test_update_related_adds_new_entry_to_neighbors(dummy_request, topic_entries):
+    """Test that a new entry is linked both ways without a rebuild."""
+    from pyramid_learning_journal.models import Entry
+    from pyramid_learning_journal.models.related import (
+        rebuild_related, update_related, related_entries)
+    session = dummy_request.dbsession
+    rebuild_related(session)
+    new = Entry(title='sockets 2', body='clients connect to sockets on a port')
+    session.add(new)
+    session.flush()
+    update_related(session, [new.id])
+    sockets = topic_entries[4]
+    assert related_entries(session, new.id)[0]['id'] == sockets.id
+    assert related_entries(session, sockets.id)[0]['id'] == new.id
+
+
+def test_update_related_removes_deleted_entry(dummy_request, topic_entries):
+    """Test that a deleted entry drops out of its neighbors' lists."""
+    from pyramid_learning_journal.models.related import (
+        rebuild_related, update_related, related_entries)
+    session = dummy_request.dbsession
+    rebuild_related(session)
+    pytest_1, pytest_2 = topic_entries[:2]
+    session.delete(pytest_2)
+    session.flush()
+    update_related(session, [pytest_2.id])
+    assert pytest_2.id not in [e['id'] for e in related_entries(session, pytest_1.id)]
+
+
+def test_entry_vectors_store_only_nonzero_weights(dummy_request, topic_entries):
+    """Test that the stored vectors are sparse and posted under each term."""
+    from pyramid_learning_journal.models.related import (
+        EntryVector, TermPostings, TfidfModel, rebuild_related, vectorize)
+    import numpy as np
+    session = dummy_request.dbsession
+    rebuild_related(session)
+    model = session.query(TfidfModel).get(1)
+    sockets = topic_entries[4]
+    columns, weights = session.query(EntryVector).get(sockets.id).sparse()
+    dense = vectorize(sockets.body, model.terms(), model.weights())
+    assert np.array_equal(columns, np.flatnonzero(dense))
+    assert np.array_equal(weights, dense[columns])
+    postings = session.query(TermPostings).get(int(columns[0]))
+    assert sockets.id in np.frombuffer(postings.entry_ids, dtype=np.int32)
+    assert model.vector_count == session.query(EntryVector).count()
+
+
+def test_update_related_matches_working_everything_out_again(dummy_request):
+    """Test that creates, edits and deletes leave every list exact."""
+    from pyramid_learning_journal.data.corpus import generate_entries
+    from pyramid_learning_journal.models import Entry
+    from pyramid_learning_journal.models.related import (
+        EntryVector, RelatedEntry, TfidfModel, rebuild_related, update_related)
+    import numpy as np
+    session = dummy_request.dbsession
+    generated = list(generate_entries(60, seed=3))
+    entries = [Entry(title=e['title'], body=e['body']) for e in generated[:40]]
+    session.add_all(entries)
+    session.flush()
+    rebuild_related(session)
+    for e in generated[40:]:
+        entry = Entry(title=e['title'], body=e['body'])
+        session.add(entry)
+        session.flush()
+        update_related(session, [entry.id])
+        entries.append(entry)
+    for entry, other in zip(entries[:5], generated[50:55]):
+        entry.body = other['body']
+        session.flush()
+        update_related(session, [entry.id])
+    for entry in entries[10:15]:
+        session.delete(entry)
+        session.flush()
+        update_related(session, [entry.id])
+
+    vectors = session.query(EntryVector).order_by(EntryVector.entry_id).all()
+    model = session.query(TfidfModel).get(1)
+    assert model.vector_count == len(vectors) == session.query(Entry).count()
+    matrix = np.zeros((len(vectors), len(model.weights())))
+    for row, vector in enumerate(vectors):
+        columns, weights = vector.sparse()
+        matrix[row, columns] = weights
+    scores = matrix.dot(matrix.T)
+    np.fill_diagonal(scores, 0)
+    stored = {}
+    for entry_id, score in session.query(
+            RelatedEntry.entry_id, RelatedEntry.score).order_by(
+            RelatedEntry.entry_id, RelatedEntry.rank):
+        stored.setdefault(entry_id, []).append(score)
+    for row, vector in enumerate(vectors):
+        best = sorted(scores[row][scores[row] > 0], reverse=True)[:5]
+        assert np.allclose(stored.get(vector.entry_id, []), best, atol=1e-5)
+        full = len(best) == 5
+        assert vector.threshold == pytest.approx(best[-1] if full else 0)
+
+
+def test_upgrade_related_tables_drops_old_tables(file_session_factory):
+    """Test that the legacy table goes and an old layout is made again."""
+    from pyramid_learning_journal.models.related import upgrade_related_tables
+    from sqlalchemy import inspect
+    engine = file_session_factory.kw['bind']
+    engine.execute('CREATE TABLE entry_vectors (entry_id INTEGER)')
+    engine.execute('DROP TABLE related_entries')
+    engine.execute(
+        'CREATE TABLE related_entries (entry_id INTEGER, rank INTEGER, '
+        'related_id INTEGER REFERENCES entries (id), score FLOAT)')
+    assert upgrade_related_tables(engine) == ['related_entries']
+    assert 'entry_vectors' not in inspect(engine).get_table_names()
+    assert upgrade_related_tables(engine) == []
+
+
+def test_update_related_moves_edited_entry(dummy_request, topic_entries):
+    """Test that an edited entry leaves its old neighbors for new ones."""
+    from pyramid_learning_journal.models.related import (
+        rebuild_related, update_related, related_entries)
+    session = dummy_request.dbsession
+    rebuild_related(session)
+    pytest_1, pytest_2, sql_1, sql_2, sockets = topic_entries
+    pytest_2.body = 'postgres queries from sqlalchemy'
+    session.flush()
+    update_related(session, [pytest_2.id])
+    assert related_entries(session, pytest_2.id)[0]['id'] in (sql_1.id, sql_2.id)
+    assert pytest_2.id not in [e['id'] for e in related_entries(session, pytest_1.id)]
+    assert pytest_2.id in [e['id'] for e in related_entries(session, sql_1.id)]
+
+
+def test_detail_view_has_related_entries(dummy_request, topic_entries):
+    """Test that the detail view includes the precomputed related entries."""
+    from pyramid_learning_journal.models.related import rebuild_related
+    from pyramid_learning_journal.views.default import detail_view
+    rebuild_related(dummy_request.dbsession)
+    dummy_request.matchdict['id'] = topic_entries[0].id
+    response = detail_view(dummy_request)
+    assert response['related'][0]['title'] == 'pytest 2'
+
+
+def test_detail_route_shows_related_after_create(logged_in, empty_the_db, csrf_token):
+    """Test that creating entries fills in the related panel."""
+    for title, body in [('one', 'pytest fixtures'), ('two', 'pytest fixtures again')]:
+        logged_in.post('/journal/new-entry', {
+            'csrf_token': csrf_token, 'title': title, 'body': body})
+    response = logged_in.get('/journal/1')
+    assert response.html.find('nav', 'related').find('a').text == 'two'
+
+
+""" TESTS FOR THE TEST FIXTURES """
+
+
+def test_db_session_commit_stays_inside_test_transaction(db_session, test_entry):
+    """Test that committing only ends a SAVEPOINT, not the test's transaction."""
+    db_session.add(test_entry)
+    db_session.commit()
+    assert db_session.bind.in_transaction()
+    assert db_session.query(type(test_entry)).filter_by(title='test entry').count() == 1
+
+
+def test_worker_database_url_names_a_database_per_worker():
+    """Test that xdist workers each get their own SQLite database file."""
+    from pyramid_learning_journal.conftest import worker_database_url
+    url = worker_database_url('sqlite:////tmp/journal.db', 'gw3')
+    assert url.database == '/tmp/journal_gw3.db'
+    assert worker_database_url('sqlite://', 'gw3').database is None
+
+
+""" TESTS FOR THE SYNTHETIC CORPUS """
+
+
+def test_generate_entries_is_the_same_for_the_same_seed():
+    """Test that a seed always gives the same corpus, and others differ."""
+    from pyramid_learning_journal.data.corpus import generate_entries
+    first = list(generate_entries(50, seed=3))
+    assert first == list(generate_entries(50, seed=3))
+    assert first != list(generate_entries(50, seed=4))
+
+
+def test_generate_entries_have_markdown_and_dates_in_order():
+    """Test that bodies use markdown features and dates move forward."""
+    from pyramid_learning_journal.data.corpus import generate_entries
+    entries = list(generate_entries(200, seed=0))
+    bodies = '\n'.join(entry['body'] for entry in entries)
+    for marker in ['## ', '```', '](http', '\n* ', '`']:
+        assert marker in bodies
+    dates = [entry['creation_date'] for entry in entries]
+    assert dates == sorted(dates)
+    lengths = sorted(len(entry['body']) for entry in entries)
+    assert lengths[-1] > 4 * lengths[len(lengths) // 2]
+
+
+def test_write_jsonl_round_trips_entries():
+    """Test that entries read back from JSONL match what was written."""
+    from pyramid_learning_journal.data.corpus import (
+        generate_entries, read_jsonl, write_jsonl)
+    import io
+    entries = list(generate_entries(10, seed=1))
+    output = io.StringIO()
+    assert write_jsonl(entries, output) == 10
+    output.seek(0)
+    assert list(read_jsonl(output)) == entries
+
+
+def test_load_entries_adds_entries_and_rebuilds_counts(dummy_request):
+    """Test that a loaded corpus has its tags, months and related entries."""
+    from pyramid_learning_journal.data.corpus import generate_entries, load_entries
+    from pyramid_learning_journal.models import (
+        Entry, MonthlyCount, RelatedEntry, Tag)
+    from sqlalchemy import func
+    session = dummy_request.dbsession
+    before = session.query(Entry).count()
+    entries = list(generate_entries(60, seed=2))
+    assert load_entries(session, entries, batch_size=25) == 60
+    assert session.query(Entry).count() == before + 60
+
+    tagged = sum(len(entry['tags'].split(', ')) for entry in entries if entry['tags'])
+    assert session.query(func.sum(Tag.entry_count)).scalar() >= tagged
+    assert session.query(func.sum(MonthlyCount.entry_count)).scalar() == before + 60
+    assert session.query(RelatedEntry).count() > 0
+    loaded = session.query(Entry).filter(Entry.title == 'Day 60').first()
+    assert loaded.tags or not entries[-1]['tags']
+
+
+def test_load_entries_stores_the_rendered_html(dummy_request):
+    """Test that loaded entries need no rendering when they are read."""
+    from pyramid_learning_journal.data.corpus import generate_entries, load_entries
+    from pyramid_learning_journal.models import Entry
+    from pyramid_learning_journal.rendering import render_markdown, renderer_key
+    session = dummy_request.dbsession
+    entries = list(generate_entries(5, seed=3))
+    load_entries(session, entries, related=False)
+    loaded = session.query(Entry).order_by(Entry.id).all()[-5:]
+    assert [entry.html for entry in loaded] == [
+        render_markdown(entry['body']) for entry in entries]
+    assert {entry.html_key for entry in loaded} == {renderer_key()}
+
+
+""" TESTS FOR THE LOAD TEST """
+
+
+def test_parse_mix_reads_weights():
+    """Test that a traffic mix is read into (action, weight) pairs."""
+    from pyramid_learning_journal.scripts.loadtest import parse_mix
+    assert parse_mix('home:60, detail:30,login') == [
+        ('home', 60.0), ('detail', 30.0), ('login', 1.0)]
+
+
+def test_summarize_reports_percentiles_and_errors():
+    """Test that samples are summarized with nearest rank percentiles."""
+    from pyramid_learning_journal.scripts.loadtest import summarize
+    samples = [('home', n / 1000.0, n != 100) for n in range(1, 101)]
+    result = summarize(samples, 2.0)
+    assert result['requests'] == 100
+    assert result['throughput'] == 50.0
+    assert (result['p50'], result['p95'], result['p99']) == (0.05, 0.095, 0.099)
+    assert result['error_rate'] == 0.01
+
+
+def test_run_step_drives_a_served_app_from_many_threads():
+    """Test that client threads keep requesting until the step is over."""
+    from pyramid_learning_journal.scripts.loadtest import (
+        Client, run_step, serve, stop)
+
+    def app(environ, start_response):
+        status = '200 OK' if environ['PATH_INFO'] == '/' else '500 Error'
+        start_response(status, [('Content-Type', 'text/plain')])
+        return [b'ok']
+
+    server = serve(app, threads=2)
+    try:
+        def make_client(rng):
+            return Client('127.0.0.1', server.effective_port, [1], rng=rng)
+
+        result = run_step(make_client, 3, 0.3, [('home', 3), ('detail', 1)])
+    finally:
+        stop(server)
+    assert result['requests'] > 10
+    assert 0 < result['error_rate'] < 1
+
+
+def test_isolate_cache_keeps_load_test_pages_out_of_the_shared_cache(tmpdir):
+    """Test that the load test caches under its own file and prefix."""
+    from pyramid_learning_journal.scripts.loadtest import isolate_cache
+    settings = {'journal.cache.backend': 'sqlite',
+                'journal.cache.path': '/srv/journal-cache.sqlite',
+                'journal.cache.prefix': 'journal'}
+    isolated = isolate_cache(settings, str(tmpdir))
+    assert isolated['journal.cache.path'].startswith(str(tmpdir))
+    assert isolated['journal.cache.prefix'] != 'journal'
+    assert settings['journal.cache.path'] == '/srv/journal-cache.sqlite'
+
+
+""" TESTS FOR RETRY BACKOFF """
+
+
+def test_retry_monitor_delay_grows_with_attempts_up_to_the_cap():
+    """Test that the jittered backoff stays between zero and its limit."""
+    from pyramid_learning_journal.retry import RetryMonitor
+    monitor = RetryMonitor(base=0.1, cap=0.3)
+    for attempt, limit in [(0, 0.1), (1, 0.2), (2, 0.3), (5, 0.3)]:
+        delays = [monitor.delay(attempt) for _ in range(50)]
+        assert all(0 <= delay <= limit for delay in delays)
+        assert len(set(delays)) > 1
+
+
+@pytest.fixture
+def retry_app():
+    """Make an app whose views raise retryable errors."""
+    from pyramid.config import Configurator
+    from pyramid_retry import RetryableException
+    from webtest import TestApp
+    calls = []
+
+    def flaky(request):
+        calls.append(request.environ['retry.attempt'])
+        if request.environ['retry.attempt'] == 0:
+            raise RetryableException()
+        return request.response
+
+    def broken(request):
+        raise RetryableException()
+
+    config = Configurator(settings={'retry.attempts': '3'})
+    config.include('pyramid_retry')
+    config.include('pyramid_learning_journal.retry')
+    config.add_route('flaky', '/flaky')
+    config.add_route('broken', '/broken')
+    config.add_view(flaky, route_name='flaky')
+    config.add_view(broken, route_name='broken')
+    app = config.make_wsgi_app()
+    monitor = app.registry['retry_monitor']
+    monitor.sleeps = []
+    monitor.sleep = monitor.sleeps.append
+    return TestApp(app), monitor, calls
+
+
+def test_retried_request_is_counted_and_backs_off(retry_app):
+    """Test that a retry waits first and is counted for its route."""
+    app, monitor, calls = retry_app
+    app.get('/flaky', status=200)
+    assert calls == [0, 1]
+    assert len(monitor.sleeps) == 1
+    assert monitor.stats() == {
+        'retried': {'flaky': 1},
+        'exhausted': {},
+        'errors': {'RetryableException': 1}
+    }
+
+
+def test_request_out_of_attempts_is_counted_as_exhausted(retry_app):
+    """Test that a request failing every attempt is counted as exhausted."""
+    from pyramid_retry import RetryableException
+    app, monitor, calls = retry_app
+    with pytest.raises(RetryableException):
+        app.get('/broken')
+    stats = monitor.stats()
+    assert stats['retried'] == {'broken': 2}
+    assert stats['exhausted'] == {'broken': 1}
+    assert stats['errors'] == {'RetryableException': 3}
+
+
+""" TESTS FOR EDIT CONFLICTS """
+
+
+def test_entry_version_goes_up_with_each_update(dummy_request, add_entry):
+    """Test that each flushed change to an entry bumps its version."""
+    dummy_request.dbsession.flush()
+    assert add_entry.version == 1
+    add_entry.body = 'changed'
+    dummy_request.dbsession.flush()
+    assert add_entry.version == 2
+    assert add_entry.to_dict()['version'] == 2
+
+
+def test_entry_update_from_stale_copy_raises_stale_data_error(dummy_request, add_entry):
+    """Test that an update loses to a change made since the entry was read."""
+    from pyramid_learning_journal.models import Entry
+    from pyramid_retry import IRetryableError
+    from sqlalchemy.orm.exc import StaleDataError
+    session = dummy_request.dbsession
+    session.flush()
+    session.execute(Entry.__table__.update().where(
+        Entry.id == add_entry.id).values(version=Entry.version + 1))
+    add_entry.body = 'changed from an old copy'
+    with pytest.raises(StaleDataError) as error:
+        session.flush()
+    assert IRetryableError.providedBy(error.value)
+
+
+def test_update_view_post_with_old_version_gets_409_merge_page(dummy_request, add_entry):
+    """Test that a stale edit is not saved and gets a merge page instead."""
+    from pyramid_learning_journal.views.default import update_view
+    dummy_request.dbsession.flush()
+    add_entry.body = 'saved by someone else'
+    dummy_request.dbsession.flush()
+    dummy_request.method = 'POST'
+    dummy_request.matchdict['id'] = add_entry.id
+    dummy_request.POST.update({
+        'title': 'mine', 'body': 'my edit', 'version': '1'})
+    response = update_view(dummy_request)
+    assert response.status_code == 409
+    assert '+my edit' in response.text
+    assert '-saved by someone else' in response.text
+    assert add_entry.body == 'saved by someone else'
+    assert add_entry.version == 2
+
+
+def test_update_view_post_with_bad_version_raises_bad_request(dummy_request, add_entry):
+    """Test that a version that is not a number is a bad request."""
+    from pyramid_learning_journal.views.default import update_view
+    dummy_request.dbsession.flush()
+    dummy_request.method = 'POST'
+    dummy_request.matchdict['id'] = add_entry.id
+    dummy_request.POST.update({'title': 'a', 'body': 'b', 'version': 'new'})
+    with pytest.raises(HTTPBadRequest):
+        update_view(dummy_request)
+
+
+def test_edit_route_stale_submission_can_be_merged(logged_in, empty_the_db, csrf_token):
+    """Test that a stale edit gets a 409 and the merge form then saves it."""
+    logged_in.post('/journal/new-entry', {
+        'csrf_token': csrf_token, 'title': 'first', 'body': 'first body'})
+    form = logged_in.get('/journal/1/edit-entry')
+    version = form.html.find('input', {'name': 'version'}).attrs['value']
+    logged_in.post('/journal/1/edit-entry', {
+        'csrf_token': csrf_token, 'title': 'theirs', 'body': 'their body',
+        'version': version})
+
+    conflict = logged_in.post('/journal/1/edit-entry', {
+        'csrf_token': csrf_token, 'title': 'mine', 'body': 'my body',
+        'version': version}, status=409)
+    assert conflict.html.find('div', 'conflict')
+    assert 'their body' in logged_in.get('/journal/1').text
+
+    merged = conflict.forms[0].submit().follow()
+    assert 'mine' in merged.html.find('h2').text
+
+
+""" TESTS FOR THE BATCH API """
+
+
+def test_apply_batch_creates_updates_and_deletes(dummy_request):
+    """Test that one batch applies each kind of operation and its tags."""
+    from pyramid_learning_journal.models import Entry, EntryRevision, Tag
+    from pyramid_learning_journal.models.batch import apply_batch
+    session = dummy_request.dbsession
+    keep = Entry(title='keep', body='old body')
+    drop = Entry(title='drop', body='going away')
+    session.add_all([keep, drop])
+    session.flush()
+    keep_id, drop_id = keep.id, drop.id
+    session.expunge_all()
+
+    results, changed = apply_batch(session, [
+        {'op': 'create', 'title': 'new', 'body': 'new body', 'tags': 'batch'},
+        {'op': 'update', 'id': keep_id, 'body': 'new body', 'tags': ['batch']},
+        {'op': 'delete', 'id': drop_id},
+    ])
+    assert [result['status'] for result in results] == [
+        'created', 'updated', 'deleted']
+    new_id = results[0]['id']
+    assert sorted(changed) == sorted([new_id, keep_id, drop_id])
+
+    assert session.query(Entry).get(drop_id) is None
+    kept = session.query(Entry).get(keep_id)
+    assert (kept.title, kept.body, kept.version) == ('keep', 'new body', 2)
+    assert results[1]['version'] == 2
+    assert session.query(EntryRevision).filter_by(entry_id=keep_id).count() == 2
+    assert session.query(Tag).filter_by(name='batch').one().entry_count == 2
+    assert [tag.name for tag in session.query(Entry).get(new_id).tags] == ['batch']
+
+
+def test_apply_batch_reports_bad_and_stale_operations(dummy_request, add_entry):
+    """Test that bad and stale operations are skipped with a reason."""
+    from pyramid_learning_journal.models.batch import apply_batch
+    dummy_request.dbsession.flush()
+    entry_id = add_entry.id
+    results, changed = apply_batch(dummy_request.dbsession, [
+        {'op': 'create', 'title': 'no body'},
+        {'op': 'update', 'id': entry_id, 'version': 7, 'body': 'late'},
+        {'op': 'delete', 'id': 999999},
+        {'op': 'rename'},
+        'create',
+        {'op': 'update', 'id': entry_id, 'title': 'first'},
+        {'op': 'delete', 'id': entry_id},
+    ])
+    assert [result['status'] for result in results] == [
+        'error', 'conflict', 'error', 'error', 'error', 'updated', 'error']
+    assert results[1]['version'] == 1
+    assert 'already changed' in results[6]['error']
+    assert changed == [entry_id]
+
+
+def test_batch_route_applies_operations_for_logged_in_user(logged_in, empty_the_db, csrf_token):
+    """Test that the batch API takes JSON and answers with results."""
+    response = logged_in.post_json('/api/entries/batch', {'operations': [
+        {'op': 'create', 'title': 'one', 'body': 'first'},
+        {'op': 'create', 'title': 'two', 'body': 'second'},
+    ]}, headers={'X-CSRF-Token': csrf_token})
+    assert [r['status'] for r in response.json['results']] == ['created'] * 2
+    assert 'two' in logged_in.get('/').text
+
+
+def test_batch_route_rejects_malformed_payload(logged_in, csrf_token):
+    """Test that a payload without a list of operations is a bad request."""
+    logged_in.post_json('/api/entries/batch', {'operations': 'all'},
+                        headers={'X-CSRF-Token': csrf_token}, status=400)
+    logged_in.post('/api/entries/batch', 'not json',
+                   headers={'X-CSRF-Token': csrf_token}, status=400)
+
+
+""" TESTS FOR MARKDOWN RENDERING """
+
+
+def test_markdown_renderer_matches_markdown_and_reuses_instance():
+    """Test that the pooled renderer gives the same html as markdown()."""
+    from markdown import markdown
+    from pyramid_learning_journal.rendering import MarkdownRenderer
+    renderer = MarkdownRenderer()
+    texts = ['# Title\n\nSome *text*[^1]', '[^1]: not a footnote', '']
+    for text in texts:
+        assert renderer.render(text) == markdown(text)
+    assert renderer._instance() is renderer._instance()
+
+
+def test_markdown_renderer_has_one_instance_per_thread():
+    """Test that each thread renders with its own Markdown instance."""
+    from pyramid_learning_journal.rendering import MarkdownRenderer
+    import threading
+    renderer = MarkdownRenderer()
+    instances = []
+    thread = threading.Thread(target=lambda: instances.append(renderer._instance()))
+    thread.start()
+    thread.join()
+    assert instances[0] is not renderer._instance()
+
+
+def test_make_renderer_uses_extensions_and_dotted_backends():
+    """Test that backends are found by name or by dotted name."""
+    from pyramid.config import Configurator
+    from pyramid.exceptions import ConfigurationError
+    from pyramid_learning_journal.rendering import MarkdownRenderer, make_renderer
+    renderer = make_renderer('markdown', ['fenced_code'])
+    assert '<code' in renderer.render('```\nx = 1\n```')
+    maybe_dotted = Configurator().maybe_dotted
+    renderer = make_renderer(
+        'pyramid_learning_journal.rendering.MarkdownRenderer', [], maybe_dotted)
+    assert isinstance(renderer, MarkdownRenderer)
+    with pytest.raises(ConfigurationError):
+        make_renderer('nope')
+
+
+def test_to_html_dict_uses_configured_renderer(test_entry):
+    """Test that entries are rendered by the renderer set for the app."""
+    from pyramid_learning_journal.rendering import get_renderer, set_renderer
+
+    class Shouting(object):
+        def render(self, text):
+            return text.upper()
+
+    previous = get_renderer()
+    set_renderer(Shouting())
+    try:
+        assert test_entry.to_html_dict()['body'] == 'THIS IS A TEST.'
+    finally:
+        set_renderer(previous)
+
+
+""" TESTS FOR STORED HTML """
+
+
+def test_entry_html_is_stored_when_body_is_written(dummy_request, add_entry):
+    """Test that the html is rendered on insert and again on edit."""
+    from pyramid_learning_journal.rendering import renderer_key
+    dummy_request.dbsession.flush()
+    assert add_entry.html == '<p>This is a test.</p>'
+    assert add_entry.html_key == renderer_key()
+    add_entry.body = '*edited*'
+    dummy_request.dbsession.flush()
+    assert add_entry.html == '<p><em>edited</em></p>'
+    assert add_entry.to_html_dict()['body'] == add_entry.html
+
+
+def test_renderer_key_is_a_sha1_of_the_renderer_key():
+    """Test that the stored key fits its column whatever the extensions."""
+    from pyramid_learning_journal.models import Entry
+    from pyramid_learning_journal.rendering import MarkdownRenderer, renderer_key
+    many = MarkdownRenderer(['markdown.extensions.fenced_code'] * 20)
+    assert len(many.key) > Entry.html_key.type.length
+    assert len(renderer_key(many)) == Entry.html_key.type.length
+    assert renderer_key(many) != renderer_key(MarkdownRenderer())
+    assert renderer_key() == renderer_key(MarkdownRenderer())
+
+
+def test_to_html_dict_ignores_html_from_another_renderer(test_entry):
+    """Test that html stored by another renderer is not shown."""
+    test_entry.html = '<p>old</p>'
+    test_entry.html_key = 'someone:else'
+    assert test_entry.to_html_dict()['body'] == '<p>This is a test.</p>'
+
+
+@pytest.fixture
+def file_session_factory(tmpdir):
+    """Make a session factory for a database file of its own."""
+    from pyramid_learning_journal.models import get_engine, get_session_factory
+    from pyramid_learning_journal.models.meta import Base
+    engine = get_engine({'sqlalchemy.url': 'sqlite:///{}'.format(
+        tmpdir.join('journal.sqlite'))})
+    Base.metadata.create_all(engine)
+    yield get_session_factory(engine)
+    engine.dispose()
+
+
+def test_rerender_renders_stale_entries_and_resumes(file_session_factory):
+    """Test that only entries rendered some other way are rendered again."""
+    from pyramid_learning_journal.models import Entry
+    from pyramid_learning_journal.rendering import renderer_key
+    from pyramid_learning_journal.scripts.rerenderentries import rerender
+    import io
+    session = file_session_factory()
+    session.bulk_insert_mappings(Entry, [
+        {'title': str(n), 'body': '# {}'.format(n), 'version': 1}
+        for n in range(25)
+    ])
+    session.commit()
+
+    out = io.StringIO()
+    _, before = rerender(file_session_factory, batch_size=10, workers=1,
+                         dry_run=True, out=out)
+    assert 'Rendered 25/25' in out.getvalue()
+    assert session.query(Entry).filter(Entry.html.isnot(None)).count() == 0
+
+    session.query(Entry).filter(Entry.title == '3').update(
+        {'html': 'old', 'html_key': renderer_key()}, synchronize_session=False)
+    session.commit()
+    count, _ = rerender(file_session_factory, batch_size=10, workers=2, out=out)
+    assert count == 24
+    assert session.query(Entry).filter(Entry.title == '7').one().html == '<h1>7</h1>'
+    assert rerender(file_session_factory, workers=1, out=out)[0] == 0
+
+    assert rerender(file_session_factory, batch_size=7, workers=1,
+                    dry_run=True, out=out)[1] == before
+    session.close()
+
+
+def test_rerender_resolves_dotted_backends_and_forgets_cached_pages(
+        file_session_factory):
+    """Test that a dotted backend renders, and cached pages are forgotten."""
+    from pyramid_learning_journal.cache import (
+        SITE_LISTS, Cache, MemoryBackend, journal_namespace)
+    from pyramid_learning_journal.models import Entry
+    from pyramid_learning_journal.scripts.rerenderentries import rerender
+    import io
+    session = file_session_factory()
+    session.add(Entry(title='one', body='*one*', version=1))
+    session.commit()
+    session.query(Entry).update({'html_key': 'old'})
+    session.commit()
+    entry_id = session.query(Entry.id).scalar()
+    cache = Cache(MemoryBackend())
+    cache.set('entry', entry_id, {'html': 'old'})
+    cache.set(SITE_LISTS, 'home', ['old'])
+    cache.set(journal_namespace(1), 'page:', ['old'])
+
+    count, _ = rerender(
+        file_session_factory,
+        'pyramid_learning_journal.rendering.MarkdownRenderer',
+        workers=1, out=io.StringIO(), cache=cache)
+    assert count == 1
+    assert session.query(Entry.html).scalar() == '<p><em>one</em></p>'
+    assert cache.get('entry', entry_id) is None
+    assert cache.get(SITE_LISTS, 'home') is None
+    assert cache.get(journal_namespace(1), 'page:') is None
+    session.close()
+
+
+""" TESTS FOR THE CACHE """
+
+
+@pytest.fixture
+def redis_server():
+    """Serve the commands the Redis backend sends over RESP from a dict."""
+    import socketserver
+    import threading
+    data = {}
+
+    class Handler(socketserver.StreamRequestHandler):
+        def reply(self, value):
+            if value is None:
+                self.wfile.write(b'$-1\r\n')
+            elif isinstance(value, int):
+                self.wfile.write(b':%d\r\n' % value)
+            elif isinstance(value, bytes):
+                self.wfile.write(b'$%d\r\n%s\r\n' % (len(value), value))
+            else:
+                self.wfile.write(b'+' + value.encode('ascii') + b'\r\n')
+
+        def handle(self):
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    return
+                args = []
+                for _ in range(int(line[1:])):
+                    length = int(self.rfile.readline()[1:])
+                    args.append(self.rfile.read(length + 2)[:-2])
+                name = args[0].upper()
+                if name == b'GET':
+                    self.reply(data.get(args[1]))
+                elif name == b'SET':
+                    data[args[1]] = args[2]
+                    self.reply('OK')
+                elif name == b'DEL':
+                    self.reply(sum(
+                        1 for key in args[1:] if data.pop(key, None)))
+                elif name == b'ZADD':
+                    data.setdefault(args[1], {})[args[3]] = float(args[2])
+                    self.reply(1)
+                elif name == b'ZRANGE':
+                    members = sorted(data.get(args[1], {}).items(),
+                                     key=lambda item: item[1])
+                    stop = int(args[3])
+                    members = members[int(args[2]):stop + 1 or None]
+                    self.wfile.write(b'*%d\r\n' % len(members))
+                    for member, _ in members:
+                        self.reply(member)
+                elif name == b'ZREM':
+                    for member in args[2:]:
+                        data.get(args[1], {}).pop(member, None)
+                    self.reply(len(args) - 2)
+                elif name == b'INCR':
+                    data[args[1]] = b'%d' % (int(data.get(args[1], 0)) + 1)
+                    self.reply(int(data[args[1]]))
+                elif name == b'MGET':
+                    self.wfile.write(b'*%d\r\n' % (len(args) - 1))
+                    for key in args[1:]:
+                        self.reply(data.get(key))
+                else:
+                    self.reply('OK')
+
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield 'redis://127.0.0.1:{}/1'.format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+def test_memory_cache_drops_least_recently_used_values():
+    """Test that the memory backend keeps only the newest max_entries."""
+    from pyramid_learning_journal.cache import MemoryBackend
+    backend = MemoryBackend(max_entries=2)
+    backend.set('a', b'1')
+    backend.set('b', b'2')
+    backend.get('a')
+    backend.set('c', b'3')
+    assert backend.get('b') is None
+    assert backend.get('a') == b'1'
+    assert backend.get('c') == b'3'
+
+
+def test_memory_cache_values_expire():
+    """Test that a value is gone once its ttl has passed."""
+    from pyramid_learning_journal.cache import MemoryBackend
+    backend = MemoryBackend()
+    backend.set('a', b'1', ttl=-1)
+    assert backend.get('a') is None
+
+
+def test_cache_invalidate_hides_the_whole_namespace():
+    """Test that bumping a generation misses every old key."""
+    from pyramid_learning_journal.cache import Cache, MemoryBackend
+    cache = Cache(MemoryBackend())
+    cache.set('lists', 'home', [1, 2])
+    cache.set('entry', 1, {'id': 1})
+    assert cache.get('lists', 'home') == [1, 2]
+    cache.invalidate('lists')
+    assert cache.get('lists', 'home') is None
+    assert cache.get('entry', 1) == {'id': 1}
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['errors']) == (2, 1, 0)
+
+
+def test_cache_get_or_set_does_not_cache_none():
+    """Test that missing values are looked up again next time."""
+    from pyramid_learning_journal.cache import Cache, MemoryBackend
+    cache = Cache(MemoryBackend())
+    calls = []
+    assert cache.get_or_set('entry', 1, lambda: calls.append(1)) is None
+    assert cache.get_or_set('entry', 1, lambda: calls.append(1)) is None
+    assert len(calls) == 2
+    assert cache.get_or_set('entry', 2, lambda: 'x') == 'x'
+    assert cache.get_or_set('entry', 2, lambda: 'y') == 'x'
+
+
+def test_sqlite_cache_is_shared_between_processes(tmpdir):
+    """Test that two backends on one file see each other's invalidations."""
+    from pyramid_learning_journal.cache import Cache, SQLiteBackend
+    path = str(tmpdir.join('cache.sqlite'))
+    one = Cache(SQLiteBackend(path))
+    two = Cache(SQLiteBackend(path))
+    one.set('lists', 'home', ['a'])
+    assert two.get('lists', 'home') == ['a']
+    two.invalidate('lists')
+    assert one.get('lists', 'home') is None
+    one.set('entry', 3, {'id': 3})
+    two.delete('entry', 3)
+    assert one.get('entry', 3) is None
+
+
+def test_sqlite_cache_prunes_to_max_entries(tmpdir):
+    """Test that pruning keeps the newest values and the counters."""
+    from pyramid_learning_journal.cache import SQLiteBackend
+    backend = SQLiteBackend(str(tmpdir.join('cache.sqlite')), max_entries=3)
+    backend.incr('gen')
+    for n in range(5):
+        backend.set(str(n), b'x')
+    backend.prune()
+    assert [backend.get(str(n)) for n in range(5)] == [
+        None, None, b'x', b'x', b'x']
+    assert backend.counter('gen') == 1
+
+
+def test_redis_cache_talks_resp(redis_server):
+    """Test the Redis backend against a server speaking the protocol."""
+    from pyramid_learning_journal.cache import Cache, RedisBackend
+    cache = Cache(RedisBackend(redis_server))
+    assert cache.get('entry', 1) is None
+    cache.set('entry', 1, {'title': 'Day 1'}, ttl=60)
+    assert Cache(RedisBackend(redis_server)).get('entry', 1) == {
+        'title': 'Day 1'}
+    cache.invalidate('entry')
+    assert cache.get('entry', 1) is None
+
+
+def test_cache_errors_are_misses():
+    """Test that a backend that can't be reached doesn't break anything."""
+    from pyramid_learning_journal.cache import Cache, RedisBackend
+    cache = Cache(RedisBackend('redis://127.0.0.1:1/0', timeout=0.1))
+    assert cache.get_or_set('entry', 1, lambda: 'fresh') == 'fresh'
+    cache.invalidate('lists')
+    assert cache.stats()['errors'] == 2
+
+
+def test_make_backend_rejects_unknown_names():
+    """Test that a typo in the backend name is a configuration error."""
+    from pyramid.exceptions import ConfigurationError
+    from pyramid_learning_journal.cache import make_backend
+    with pytest.raises(ConfigurationError):
+        make_backend({'journal.cache.backend': 'memcache'})
+
+
+def test_changed_entries_are_dropped_from_the_cache():
+    """Test that an entry event forgets the entry and the lists."""
+    from pyramid.config import Configurator
+    from pyramid_learning_journal.events import EntriesChanged
+    from pyramid_learning_journal.cache import SITE_LISTS, invalidate_entries
+    config = Configurator(settings={'journal.events.workers': '0'})
+    config.include('pyramid_learning_journal.events')
+    config.include('pyramid_learning_journal.cache')
+    cache = config.registry['cache']
+    cache.set('entry', 1, {'id': 1})
+    cache.set('entry', 2, {'id': 2})
+    cache.set(SITE_LISTS, 'home', [])
+    event = EntriesChanged([1])
+    event.registry = config.registry
+    invalidate_entries(event)
+    assert cache.get('entry', 1) is None
+    assert cache.get('entry', 2) == {'id': 2}
+    assert cache.get(SITE_LISTS, 'home') is None
+
+
+def test_site_lists_are_a_partition_of_their_own():
+    """Test that a busy journal's pages never push out the site's lists."""
+    from pyramid_learning_journal.cache import (
+        SITE_LISTS, Cache, MemoryBackend, journal_namespace)
+    cache = Cache(MemoryBackend(max_entries=100, partition_entries=2))
+    cache.set(SITE_LISTS, 'home', ['home'])
+    cache.set(SITE_LISTS, 'tags', ['tags'])
+    for page in range(10):
+        cache.set(journal_namespace(1), 'page:{}'.format(page), [page])
+    assert cache.get(SITE_LISTS, 'home') == ['home']
+    cache.set(SITE_LISTS, 'months', ['months'])
+    assert cache.get(SITE_LISTS, 'tags') is None
+    assert cache.get(journal_namespace(1), 'page:9') == [9]
+
+
+def test_detail_view_is_served_from_the_cache(dummy_request, add_entry,
+                                              monkeypatch):
+    """Test that a cached entry is shown without loading it again."""
+    from pyramid_learning_journal.cache import Cache, MemoryBackend
+    from pyramid_learning_journal.views.default import detail_view
+    dummy_request.dbsession.flush()
+    monkeypatch.setitem(
+        dummy_request.registry, 'cache', Cache(MemoryBackend()))
+    dummy_request.matchdict['id'] = str(add_entry.id)
+    assert detail_view(dummy_request)['entry']['title'] == 'test entry'
+    add_entry.title = 'changed behind the cache'
+    assert detail_view(dummy_request)['page_title'] == 'test entry'
+
+
+""" TESTS FOR SINGLE-FLIGHT CACHE MISSES """
+
+
+def run_in_threads(count, target):
+    """Start count threads on target and give back the threads."""
+    import threading
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+def test_single_flight_makes_a_value_once_for_waiting_threads():
+    """Test that threads missing the same key share one computation."""
+    from pyramid_learning_journal.cache import SingleFlight
+    import threading
+    import time
+    flight = SingleFlight(timeout=5)
+    release = threading.Event()
+    calls, results = [], []
+
+    def create():
+        calls.append(1)
+        release.wait(5)
+        return 'home'
+
+    leader = run_in_threads(1, lambda: results.append(flight.run('k', create)))
+    while not flight._flights:
+        pass
+    followers = run_in_threads(4, lambda: results.append(flight.run('k', create)))
+    while flight._flights['k'].waiters < 4:
+        time.sleep(0.001)
+    release.set()
+    for thread in leader + followers:
+        thread.join()
+    assert results == ['home'] * 5
+    assert len(calls) == 1
+    stats = flight.stats()
+    assert stats['leaders'] == 1
+    assert stats['coalesced'] == 4
+
+
+def test_single_flight_hands_out_stale_values_while_rebuilding():
+    """Test that a thread with a stale value doesn't wait for the new one."""
+    from pyramid_learning_journal.cache import SingleFlight
+    import threading
+    import time
+    flight = SingleFlight(timeout=5)
+    release = threading.Event()
+    leader = run_in_threads(1, lambda: flight.run(
+        'k', lambda: release.wait(5) and 'new'))
+    while not flight._flights:
+        time.sleep(0.001)
+    assert flight.run('k', lambda: 'other', stale='old') == 'old'
+    release.set()
+    leader[0].join()
+    assert flight.stats()['stale'] == 1
+
+
+def test_single_flight_waiters_give_up_after_the_timeout():
+    """Test that a slow or failing leader doesn't hold the others up."""
+    from pyramid_learning_journal.cache import SingleFlight
+    import threading
+    import time
+    flight = SingleFlight(timeout=0.01)
+    release = threading.Event()
+    leader = run_in_threads(1, lambda: flight.run(
+        'k', lambda: release.wait(5)))
+    while not flight._flights:
+        time.sleep(0.001)
+    assert flight.run('k', lambda: 'mine') == 'mine'
+    release.set()
+    leader[0].join()
+    assert flight.stats()['timeouts'] == 1
+    assert flight.stats()['wait_seconds'] > 0
+
+
+def test_cache_get_or_set_serves_the_last_value_after_invalidation():
+    """Test that the old home page is served while it is rebuilt."""
+    from pyramid_learning_journal.cache import Cache, MemoryBackend
+    import threading
+    import time
+    cache = Cache(MemoryBackend())
+    cache.set('lists', 'home', ['old'])
+    cache.invalidate('lists')
+    release = threading.Event()
+    leader = run_in_threads(1, lambda: cache.get_or_set(
+        'lists', 'home', lambda: release.wait(5) and ['new']))
+    while not cache.flight._flights:
+        time.sleep(0.001)
+    assert cache.get_or_set('lists', 'home', lambda: ['late']) == ['old']
+    release.set()
+    leader[0].join()
+    assert cache.get('lists', 'home') == ['new']
+
+
+def test_cache_does_not_store_values_made_before_an_invalidation():
+    """Test that a value built from old data is kept under its old key."""
+    from pyramid_learning_journal.cache import Cache, MemoryBackend
+    cache = Cache(MemoryBackend(), stale_entries=0)
+
+    def create():
+        cache.invalidate('lists')
+        return ['built before the change was seen']
+
+    cache.get_or_set('lists', 'home', create)
+    assert cache.get('lists', 'home') is None
+
+
+def test_cache_does_not_store_values_made_before_a_delete():
+    """Test that an entry read before its change can't be stored after it."""
+    from pyramid_learning_journal.cache import Cache, MemoryBackend
+    cache = Cache(MemoryBackend())
+    cache.set('entry', 1, {'title': 'old'})
+    cache.delete('entry', 1)
+
+    def create():
+        cache.delete('entry', 1)
+        return {'title': 'read before the commit'}
+
+    cache.get_or_set('entry', 1, create)
+    assert cache.get('entry', 1) is None
+    assert cache.get_or_set('entry', 1, lambda: {'title': 'new'}) == {
+        'title': 'new'}
+
+
+def test_cache_never_hands_out_a_deleted_value_while_rebuilding():
+    """Test that only a namespace invalidation lets the last value out."""
+    from pyramid_learning_journal.cache import Cache, MemoryBackend
+    import threading
+    import time
+    cache = Cache(MemoryBackend())
+    cache.set('entry', 1, {'title': 'old'})
+    cache.delete('entry', 1)
+    release = threading.Event()
+    leader = run_in_threads(1, lambda: cache.get_or_set(
+        'entry', 1, lambda: release.wait(5) and None))
+    while not cache.flight._flights:
+        time.sleep(0.001)
+    waiter = run_in_threads(1, lambda: cache.get_or_set(
+        'entry', 1, lambda: None))
+    while not cache.flight._flights or not list(
+            cache.flight._flights.values())[0].waiters:
+        time.sleep(0.001)
+    release.set()
+    for thread in leader + waiter:
+        thread.join()
+    assert cache.flight.stats()['stale'] == 0
+
+
+""" TESTS FOR PREFORK SERVING """
+
+
+def pid_app(environ, start_response):
+    """Answer with the id of the worker process, slowly if asked."""
+    import time
+    time.sleep(float(environ.get('QUERY_STRING') or 0))
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [str(os.getpid()).encode('ascii')]
+
+
+@pytest.fixture
+def prefork_server():
+    """Run an arbiter with two workers in a process of its own."""
+    from pyramid_learning_journal.prefork import Arbiter, listen
+    import signal
+    import time
+    if not hasattr(os, 'fork'):
+        pytest.skip('prefork needs os.fork')
+    probe = listen('127.0.0.1', 0)
+    port = probe.getsockname()[1]
+    probe.close()
+    pid = os.fork()
+    if not pid:
+        try:
+            Arbiter(pid_app, '127.0.0.1', port, workers=2, threads=2,
+                    max_requests=3, graceful_timeout=5, after_fork=None).run()
+        finally:
+            os._exit(0)
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            get_from(port)
+            break
+        except OSError:
+            time.sleep(0.05)
+    yield pid, port
+    try:
+        os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
+    except OSError:
+        pass
+
+
+def get_from(port, path='/'):
+    """Get a page from a local server on a new connection."""
+    import http.client
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    try:
+        connection.request('GET', path)
+        return connection.getresponse().read().decode('ascii')
+    finally:
+        connection.close()
+
+
+def test_prefork_workers_are_recycled_after_max_requests(prefork_server):
+    """Test that workers are replaced once they have served enough."""
+    pid, port = prefork_server
+    pids = set(get_from(port) for _ in range(12))
+    assert str(pid) not in pids
+    assert len(pids) > 2
+
+
+def test_prefork_finishes_requests_in_progress_on_sigterm(prefork_server):
+    """Test that SIGTERM lets a slow request finish before exiting."""
+    import signal
+    import threading
+    import time
+    pid, port = prefork_server
+    answers = []
+    slow = threading.Thread(target=lambda: answers.append(
+        get_from(port, '/?0.5')))
+    slow.start()
+    time.sleep(0.2)
+    os.kill(pid, signal.SIGTERM)
+    slow.join()
+    _, status = os.waitpid(pid, 0)
+    assert answers and answers[0].isdigit()
+    assert status == 0
+
+
+""" TESTS FOR FRAGMENT CACHING """
+
+
+@pytest.fixture
+def fragment_env():
+    """Make a Jinja2 environment with the cache tag."""
+    from jinja2 import Environment
+    from pyramid_learning_journal.fragments import FragmentCacheExtension
+    return Environment(extensions=[FragmentCacheExtension], autoescape=True)
+
+
+def test_cache_tag_renders_each_key_once(fragment_env):
+    """Test that a fragment is reused until its key changes."""
+    template = fragment_env.from_string(
+        "{% cache 'card', entry.id, entry.version %}"
+        "{{ entry.title }} {{ calls.append(1) or '' }}{% endcache %}")
+    calls = []
+    entry = {'id': 1, 'version': 1, 'title': '<b>'}
+    assert template.render(entry=entry, calls=calls) == '&lt;b&gt; '
+    entry['title'] = 'not rendered'
+    assert template.render(entry=entry, calls=calls) == '&lt;b&gt; '
+    entry['version'] = 2
+    assert template.render(entry=entry, calls=calls) == 'not rendered '
+    assert len(calls) == 2
+    stats = fragment_env.fragment_cache.stats()
+    assert (stats['hits'], stats['misses']) == (1, 2)
+    assert stats['hit_rate'] == pytest.approx(1 / 3)
+
+
+def test_fragment_cache_keeps_the_most_recently_used():
+    """Test that the oldest fragments are evicted past max_entries."""
+    from pyramid_learning_journal.fragments import FragmentCache
+    cache = FragmentCache(max_entries=2)
+    for key in 'aba':
+        cache.get_or_render(key, lambda: key)
+    cache.get_or_render('c', lambda: 'c')
+    assert cache.get_or_render('b', lambda: 'again') == 'again'
+    assert cache.stats()['evictions'] == 2
+    assert cache.stats()['fragments'] == 2
+
+
+def test_home_page_reuses_rendered_cards(testapp, fill_the_db):
+    """Test that cards are rendered once and then served from the cache."""
+    cache = testapp.app.registry['fragment_cache']
+    cache.clear()
+    before = cache.stats()
+    first = testapp.get('/').text
+    assert testapp.get('/').text == first
+    stats = cache.stats()
+    cards = first.count('class="card mb-5"')
+    assert cards
+    assert stats['misses'] - before['misses'] == cards
+    assert stats['hits'] - before['hits'] == cards
+
+
+""" TESTS FOR VIEW COUNTS """
+
+
+def add_read_entries(session, count):
+    """Add count entries, returning their ids."""
+    from pyramid_learning_journal.models import Entry
+    entries = [Entry(title='Read {}'.format(n), body='') for n in range(count)]
+    session.add_all(entries)
+    session.flush()
+    return [entry.id for entry in entries]
+
+
+def test_add_views_adds_to_existing_counts(db_session):
+    """Test that the upsert creates counts and then adds to them."""
+    from pyramid_learning_journal.models.viewcount import (
+        EntryViewCount, add_views)
+    first, second = add_read_entries(db_session, 2)
+    add_views(db_session, {first: 2})
+    add_views(db_session, {first: 3, second: 1, 99999: 4})
+    counts = dict(db_session.query(
+        EntryViewCount.entry_id, EntryViewCount.views))
+    assert counts == {first: 5, second: 1}
+
+
+def test_most_read_is_ranked_and_skips_deleted_entries(db_session):
+    """Test that most_read lists the top counts of entries still there."""
+    from pyramid_learning_journal.models import Entry
+    from pyramid_learning_journal.models.viewcount import (
+        add_views, most_read, refresh_most_read)
+    ids = add_read_entries(db_session, 4)
+    add_views(db_session, dict(zip(ids, [5, 9, 1, 7])))
+    refresh_most_read(db_session, size=3)
+    assert [row['views'] for row in most_read(db_session)] == [9, 7, 5]
+    db_session.query(Entry).filter(Entry.id == ids[1]).delete()
+    assert [row['id'] for row in most_read(db_session)] == [ids[3], ids[0]]
+
+
+def test_refresh_most_read_writes_over_the_old_ranks(db_session):
+    """Test that a refresh replaces each rank and drops the ones past size."""
+    from pyramid_learning_journal.models.viewcount import (
+        MostRead, add_views, most_read, refresh_most_read)
+    ids = add_read_entries(db_session, 3)
+    add_views(db_session, dict(zip(ids, [1, 2, 3])))
+    refresh_most_read(db_session, size=3)
+    add_views(db_session, {ids[0]: 10})
+    refresh_most_read(db_session, size=2)
+    refresh_most_read(db_session, size=2)
+    assert [(row['id'], row['views']) for row in most_read(db_session)] == [
+        (ids[0], 11), (ids[2], 3)]
+    assert db_session.query(MostRead).count() == 2
+
+
+def test_refresh_most_read_reads_the_views_index(db_session):
+    """Test that refreshing most_read neither scans the counts nor sorts them."""
+    from sqlalchemy import event
+    from pyramid_learning_journal.models.viewcount import refresh_most_read
+    statements = []
+
+    def keep(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().startswith('SELECT') and 'entry_views' in statement:
+            statements.append((statement, parameters))
+
+    engine = db_session.get_bind()
+    event.listen(engine, 'before_cursor_execute', keep)
+    try:
+        refresh_most_read(db_session)
+    finally:
+        event.remove(engine, 'before_cursor_execute', keep)
+    assert len(statements) == 1
+    statement, parameters = statements[0]
+    plan = ' '.join(row[-1] for row in db_session.connection().execute(
+        'EXPLAIN QUERY PLAN ' + statement, parameters))
+    assert 'ix_entry_views_views_entry_id' in plan
+    assert 'TEMP B-TREE' not in plan
+
+
+def test_background_work_is_closed_at_exit_by_one_handler():
+    """Test that making apps adds what to close, not atexit handlers."""
+    import atexit
+    from pyramid.config import Configurator
+    from pyramid_learning_journal import flushing
+    before = atexit._ncallbacks()
+    for _ in range(2):
+        config = Configurator(settings={'sqlalchemy.url': 'sqlite://'})
+        config.include('pyramid_learning_journal.models')
+        config.include('pyramid_learning_journal.viewcounts')
+        config.include('pyramid_learning_journal.drafts')
+        config.include('pyramid_learning_journal.preview')
+        for name in ('view_counter', 'draft_buffer', 'previewer'):
+            assert config.registry[name] in flushing._closing
+        config.registry['previewer'].close()
+    assert atexit._ncallbacks() == before
+
+
+def test_view_counter_flushes_counts_in_one_batch(file_session_factory):
+    """Test that reads are kept in memory until they are flushed."""
+    from pyramid_learning_journal.models import Entry
+    from pyramid_learning_journal.models.viewcount import most_read
+    from pyramid_learning_journal.viewcounts import ViewCounter
+    session = file_session_factory()
+    session.add_all([Entry(title=str(n), body='') for n in range(3)])
+    session.commit()
+    ids = [entry_id for entry_id, in session.query(Entry.id)]
+    counter = ViewCounter(file_session_factory, interval=0)
+    for entry_id in ids + ids[:1]:
+        counter.count(entry_id)
+    assert most_read(session) == []
+    assert counter.flush() == 3
+    assert counter.flush() == 0
+    session.rollback()
+    assert [row['views'] for row in most_read(session)] == [2, 1, 1]
+    session.close()
+
+
+def test_view_counter_keeps_counts_that_fail_to_be_written():
+    """Test that counts are not lost when the database is unavailable."""
+    from pyramid_learning_journal.viewcounts import ViewCounter
+
+    def broken_session():
+        raise RuntimeError('database is down')
+
+    counter = ViewCounter(broken_session, interval=0)
+    counter.count(1)
+    with pytest.raises(RuntimeError):
+        counter.flush()
+    assert counter.counts == {1: 1}
+
+
+def test_detail_view_counts_the_read(dummy_request, add_entry, monkeypatch):
+    """Test that reading an entry counts a view without writing it."""
+    from pyramid_learning_journal.viewcounts import ViewCounter
+    from pyramid_learning_journal.views.default import detail_view
+    dummy_request.dbsession.flush()
+    counter = ViewCounter(None, interval=0)
+    monkeypatch.setitem(dummy_request.registry, 'view_counter', counter)
+    dummy_request.matchdict['id'] = str(add_entry.id)
+    detail_view(dummy_request)
+    detail_view(dummy_request)
+    assert counter.counts == {add_entry.id: 2}
+
+
+def test_most_read_route_lists_entries(testapp, fill_the_db):
+    """Test that the most read page shows the counts once flushed."""
+    from pyramid_learning_journal.models import Entry
+    session = testapp.app.registry['dbsession_factory']()
+    entry_id = session.query(Entry.id).order_by(Entry.id).first()[0]
+    session.close()
+    link = testapp.app.routes_mapper.get_route('detail').generate(
+        {'id': entry_id})
+    for _ in range(100):
+        testapp.get(link)
+    testapp.app.registry['view_counter'].flush()
+    top = testapp.get('/most-read').html.find('ol', 'most-read').find('li')
+    assert top.find('a')['href'].endswith(link)
+    assert int(top.find('span').text.split()[0]) >= 100
+
+
+""" TESTS FOR DRAFTS """
+
+
+def test_save_drafts_keeps_the_latest_save(db_session):
+    """Test that a batch never replaces a draft saved after it."""
+    from pyramid_learning_journal.models.draft import load_draft, save_drafts
+    from datetime import datetime, timedelta
+    now = datetime(2018, 1, 1, 12)
+
+    def draft(title, saved_at):
+        return {'username': 'name', 'key': 'new', 'title': title,
+                'body': '', 'tags': '', 'version': None, 'saved_at': saved_at}
+
+    save_drafts(db_session, [draft('first', now)])
+    save_drafts(db_session, [draft('later', now + timedelta(seconds=5))])
+    save_drafts(db_session, [draft('stale', now + timedelta(seconds=1))])
+    assert load_draft(db_session, 'name', 'new').title == 'later'
+
+
+def test_draft_buffer_coalesces_saves(file_session_factory):
+    """Test that many saves of a draft become one write of the last."""
+    from pyramid_learning_journal.drafts import DraftBuffer
+    from pyramid_learning_journal.models.draft import Draft
+    buffer = DraftBuffer(file_session_factory, interval=0)
+    for n in range(50):
+        buffer.save('name', 'new', 'Title', 'word ' * n, '')
+    buffer.save('name', '3', 'Other', '', 'a, b')
+    session = file_session_factory()
+    assert buffer.get(session, 'name', 'new')['body'] == 'word ' * 49
+    assert session.query(Draft).count() == 0
+    assert buffer.flush() == 2
+    assert buffer.saves == 51
+    assert buffer.get(session, 'name', 'new')['body'] == 'word ' * 49
+    buffer.discard(session, 'name', 'new')
+    session.commit()
+    assert buffer.get(session, 'name', 'new') is None
+    assert buffer.get(session, 'name', '3')['tags'] == 'a, b'
+    session.close()
+
+
+def test_draft_buffer_discards_every_users_drafts_of_an_entry(file_session_factory):
+    """Test that deleting an entry drops its drafts, pending and stored."""
+    from pyramid_learning_journal.drafts import DraftBuffer
+    buffer = DraftBuffer(file_session_factory, interval=0)
+    buffer.save('one', '3', 'Title', 'stored', '', 1)
+    buffer.flush()
+    buffer.save('two', '3', 'Title', 'pending', '', 1)
+    buffer.save('two', '4', 'Other', 'kept', '', 1)
+    session = file_session_factory()
+    buffer.discard_entries(session, ['3'])
+    session.commit()
+    assert buffer.flush() == 1
+    assert buffer.get(session, 'one', '3') is None
+    assert buffer.get(session, 'two', '3') is None
+    assert buffer.get(session, 'two', '4')['body'] == 'kept'
+    session.close()
+
+
+def test_deleted_entry_drafts_are_not_restored_into_a_new_entry(
+        logged_in, empty_the_db, csrf_token):
+    """Test that a new entry given a deleted entry's id starts clean."""
+    testapp = logged_in
+    testapp.post('/journal/new-entry', {
+        'csrf_token': csrf_token, 'title': 'first', 'body': 'first body'})
+    testapp.post('/journal/drafts?entry=1', {
+        'csrf_token': csrf_token, 'title': 'first', 'body': 'unsaved'})
+    testapp.post('/journal/1/delete-entry', {'csrf_token': csrf_token})
+    testapp.get('/journal/drafts?entry=1', status=404)
+
+
+def test_draft_buffer_keeps_drafts_that_fail_to_be_written():
+    """Test that drafts are not lost when the database is unavailable."""
+    from pyramid_learning_journal.drafts import DraftBuffer
+
+    def broken_session():
+        raise RuntimeError('database is down')
+
+    buffer = DraftBuffer(broken_session, interval=0)
+    buffer.save('name', 'new', 'Title', 'Body', '')
+    with pytest.raises(RuntimeError):
+        buffer.flush()
+    assert list(buffer.pending) == [('name', 'new')]
+
+
+def test_drafts_route_saves_restores_and_forgets_a_draft(logged_in,
+                                                         csrf_token):
+    """Test autosaving a new entry, reloading the editor and publishing."""
+    testapp = logged_in
+    testapp.post('/journal/drafts', {
+        'csrf_token': csrf_token,
+        'title': 'Half written',
+        'body': 'Some of it',
+        'tags': 'drafts'
+    })
+    assert testapp.get('/journal/drafts').json['body'] == 'Some of it'
+    testapp.app.registry['draft_buffer'].flush()
+    form = testapp.get('/journal/new-entry').html
+    assert form.find('input', {'name': 'title'})['value'] == 'Half written'
+    assert form.find('textarea').text == 'Some of it'
+    testapp.post('/journal/new-entry', {
+        'csrf_token': csrf_token,
+        'title': 'Half written',
+        'body': 'All of it'
+    })
+    testapp.get('/journal/drafts', status=404)
+
+
+def test_restored_draft_of_an_old_version_goes_to_the_merge_page(
+        logged_in, empty_the_db, csrf_token):
+    """Test that a draft keeps the version it was started from."""
+    from pyramid_learning_journal.models import Entry
+    testapp = logged_in
+    testapp.post('/journal/new-entry', {
+        'csrf_token': csrf_token, 'title': 'first', 'body': 'first body'})
+    form = testapp.get('/journal/1/edit-entry').html
+    version = form.find('input', {'name': 'version'})['value']
+    testapp.post('/journal/drafts?entry=1', {
+        'csrf_token': csrf_token, 'title': 'first', 'body': 'my draft',
+        'version': version})
+    testapp.app.registry['draft_buffer'].flush()
+    session = testapp.app.registry['dbsession_factory']()
+    session.execute(Entry.__table__.update().values(
+        body='their body', version=Entry.version + 1))
+    session.commit()
+    session.close()
+
+    form = testapp.get('/journal/1/edit-entry').forms[0]
+    assert form['body'].value == 'my draft'
+    assert form['version'].value == version
+    assert 'their body' in form.submit(status=409).text
+
+
+def test_drafts_route_needs_a_title_and_body(logged_in, csrf_token):
+    """Test that an incomplete autosave is a bad request."""
+    logged_in.post('/journal/drafts', {
+        'csrf_token': csrf_token, 'title': 'No body'}, status=400)
+    logged_in.post('/journal/drafts?entry=x', {
+        'csrf_token': csrf_token, 'title': 'x', 'body': 'y'}, status=400)
+    logged_in.post('/journal/drafts?entry=1', {
+        'csrf_token': csrf_token, 'title': 'x', 'body': 'y',
+        'version': 'new'}, status=400)
+
+
+""" TESTS FOR MARKDOWN PREVIEW """
+
+
+def test_previewer_renders_the_same_text_once():
+    """Test that repeated text is served from the cache."""
+    from pyramid_learning_journal.preview import Previewer
+    previewer = Previewer(max_entries=4)
+    first = previewer.render('# Title')
+    assert previewer.render('# Title') == first
+    assert '<h1>Title</h1>' in first
+    stats = previewer.stats()
+    assert (stats['hits'], stats['misses']) == (1, 1)
+    previewer.close()
+
+
+def test_previewer_keys_depend_on_the_renderer(monkeypatch):
+    """Test that html from another renderer is never served."""
+    from pyramid_learning_journal import rendering
+    from pyramid_learning_journal.preview import Previewer
+    previewer = Previewer()
+    before = previewer.key('text')
+    monkeypatch.setattr(rendering, '_renderer',
+                        rendering.MarkdownRenderer(['fenced_code']))
+    assert previewer.key('text') != before
+    previewer.close()
+
+
+def test_previewer_times_out_and_keeps_the_late_html(monkeypatch):
+    """Test that a slow render is an error, then a hit once it finishes."""
+    import threading
+    from pyramid_learning_journal import preview
+    from pyramid_learning_journal.preview import Previewer, PreviewTimeout
+    release = threading.Event()
+
+    def slow_render(text):
+        release.wait(5)
+        return '<p>{}</p>'.format(text)
+
+    monkeypatch.setattr(preview, 'render_markdown', slow_render)
+    previewer = Previewer(time_budget=0.05)
+    with pytest.raises(PreviewTimeout):
+        previewer.render('slow')
+    assert previewer.stats()['timeouts'] == 1
+    release.set()
+    previewer._executor.shutdown(wait=True)
+    assert previewer.render('slow') == '<p>slow</p>'
+    assert previewer.stats()['hits'] == 1
+
+
+def test_previewer_refuses_text_still_rendering_and_past_max_pending(monkeypatch):
+    """Test that over budget text isn't rendered again, nor queued past the cap."""
+    import threading
+    from pyramid_learning_journal import preview
+    from pyramid_learning_journal.preview import (
+        Previewer, PreviewBusy, PreviewTimeout)
+    release = threading.Event()
+    calls = []
+
+    def slow_render(text):
+        calls.append(text)
+        release.wait(5)
+        return '<p>{}</p>'.format(text)
+
+    monkeypatch.setattr(preview, 'render_markdown', slow_render)
+    previewer = Previewer(time_budget=0.05, workers=1, max_pending=2)
+    with pytest.raises(PreviewTimeout):
+        previewer.render('slow')
+    with pytest.raises(PreviewBusy):
+        previewer.render('slow')
+    with pytest.raises(PreviewTimeout):
+        previewer.render('queued')
+    with pytest.raises(PreviewBusy):
+        previewer.render('one too many')
+    stats = previewer.stats()
+    assert (stats['refused'], stats['pending']) == (2, 2)
+    release.set()
+    previewer._executor.shutdown(wait=True)
+    assert previewer.stats()['pending'] == 0
+    assert previewer.render('slow') == '<p>slow</p>'
+    assert calls == ['slow', 'queued']
+
+
+def test_previewer_renders_text_asked_for_at_once_once(monkeypatch):
+    """Test that requests for text being rendered wait for that render."""
+    import threading
+    from pyramid_learning_journal import preview
+    from pyramid_learning_journal.preview import Previewer
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def slow_render(text):
+        calls.append(text)
+        started.set()
+        release.wait(5)
+        return '<p>{}</p>'.format(text)
+
+    monkeypatch.setattr(preview, 'render_markdown', slow_render)
+    previewer = Previewer(time_budget=5)
+    results = []
+    threads = [threading.Thread(
+        target=lambda: results.append(previewer.render('same')))
+        for _ in range(3)]
+    threads[0].start()
+    started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert results == ['<p>same</p>'] * 3
+    assert calls == ['same']
+    previewer.close()
+
+
+def test_preview_route_renders_markdown(logged_in, csrf_token):
+    """Test that the preview is the html a saved entry would have."""
+    response = logged_in.post('/journal/preview', {
+        'csrf_token': csrf_token, 'body': 'Some *emphasis*'})
+    assert response.json['html'] == '<p>Some <em>emphasis</em></p>'
+
+
+def test_preview_route_needs_a_body(logged_in, csrf_token):
+    """Test that a preview of nothing is a bad request."""
+    logged_in.post('/journal/preview', {'csrf_token': csrf_token},
+                   status=400)
+
+
+def test_preview_route_refuses_long_text(logged_in, csrf_token):
+    """Test that text over the size cap is never rendered."""
+    logged_in.post('/journal/preview', {
+        'csrf_token': csrf_token, 'body': 'x' * 100001}, status=413)
+
+
+@pytest.mark.parametrize('error', ['PreviewTimeout', 'PreviewBusy'])
+def test_preview_route_answers_slow_renders_with_503(logged_in, csrf_token,
+                                                      monkeypatch, error):
+    """Test that a render over the time budget or refused is unavailable."""
+    from pyramid_learning_journal import preview
+    previewer = logged_in.app.registry['previewer']
+
+    def too_slow(text):
+        raise getattr(preview, error)(text)
+
+    monkeypatch.setattr(previewer, 'render', too_slow)
+    response = logged_in.post('/journal/preview', {
+        'csrf_token': csrf_token, 'body': 'text'}, status=503)
+    assert response.headers['Retry-After'] == '1'
+
+
+""" TESTS FOR ATTACHMENTS """
+
+
+def test_attachment_store_keeps_one_copy_of_each_content(tmpdir):
+    """Test that the same bytes uploaded twice are stored once."""
+    from io import BytesIO
+    from hashlib import sha256
+    from pyramid_learning_journal.attachments import AttachmentStore
+    store = AttachmentStore(str(tmpdir), chunk_size=7)
+    data = b'a picture of a cat' * 100
+    first = store.save(BytesIO(data))
+    assert store.save(BytesIO(data)) == first
+    assert first == (sha256(data).hexdigest(), len(data))
+    with open(store.path_of(first[0]), 'rb') as stored:
+        assert stored.read() == data
+    assert tmpdir.join('incoming').listdir() == []
+    assert len(tmpdir.join(first[0][:2]).listdir()) == 1
+
+
+def test_attachment_store_refuses_files_over_the_limit(tmpdir):
+    """Test that a large upload is dropped without being stored."""
+    from io import BytesIO
+    from pyramid_learning_journal.attachments import (
+        AttachmentStore, AttachmentTooLarge)
+    store = AttachmentStore(str(tmpdir), max_size=10, chunk_size=4)
+    with pytest.raises(AttachmentTooLarge):
+        store.save(BytesIO(b'x' * 11))
+    assert tmpdir.join('incoming').listdir() == []
+
+
+def test_clean_filename_drops_directories():
+    """Test that an uploaded name can't point outside its own name."""
+    from pyramid_learning_journal.views.attachments import clean_filename
+    assert clean_filename('C:\\Users\\me\\cat.png') == 'cat.png'
+    assert clean_filename('../../etc/passwd') == 'passwd'
+    assert clean_filename('dir/') == 'file'
+
+
+@pytest.fixture
+def attachment_entry(testapp):
+    """Add an entry for files to be attached to, returning its url."""
+    import transaction
+    from pyramid_learning_journal.models import Entry, get_tm_session
+    with transaction.manager:
+        session = get_tm_session(
+            testapp.app.registry['dbsession_factory'], transaction.manager)
+        entry = Entry(title='With files', body='See attached')
+        session.add(entry)
+        session.flush()
+        entry_id = entry.id
+    return '/journal/{}/attachments'.format(entry_id)
+
+
+def test_attachment_routes_upload_list_and_send(logged_in, csrf_token,
+                                                attachment_entry):
+    """Test uploading a file twice, listing it and fetching it back."""
+    data = b'\x89PNG' + bytes(range(256)) * 40
+    upload = {'csrf_token': csrf_token}
+    first = logged_in.post(attachment_entry, upload,
+                           upload_files=[('file', 'cat.png', data)])
+    assert first.status_code == 201
+    again = logged_in.post(attachment_entry, upload,
+                           upload_files=[('file', 'cat.png', data)])
+    assert again.status_code == 200
+    assert again.json == first.json
+    listed = logged_in.get(attachment_entry).json['attachments']
+    assert listed == [first.json]
+    response = logged_in.get(first.json['url'])
+    assert response.body == data
+    assert response.content_type == 'image/png'
+    assert response.etag == first.json['sha256']
+    assert 'immutable' in response.headers['Cache-Control']
+    assert 'Content-Disposition' not in response.headers
+
+
+def test_attachment_route_serves_ranges_and_not_modified(logged_in,
+                                                         csrf_token,
+                                                         attachment_entry):
+    """Test a partial download and a revalidation."""
+    data = b''.join(str(n).encode('ascii') for n in range(5000))
+    url = logged_in.post(attachment_entry, {'csrf_token': csrf_token},
+                         upload_files=[('file', 'numbers.txt', data)]
+                         ).json['url']
+    part = logged_in.get(url, headers={'Range': 'bytes=100-199'}, status=206)
+    assert part.body == data[100:200]
+    assert part.headers['Content-Range'] == 'bytes 100-199/{}'.format(
+        len(data))
+    tail = logged_in.get(url, headers={'Range': 'bytes=-10'}, status=206)
+    assert tail.body == data[-10:]
+    etag = logged_in.get(url).headers['ETag']
+    logged_in.get(url, headers={'If-None-Match': etag}, status=304)
+    logged_in.get(url, headers={'Range': 'bytes=999999-'}, status=416)
+
+
+def test_attachment_route_makes_html_a_download(logged_in, csrf_token,
+                                                attachment_entry):
+    """Test that an uploaded page is never shown on the journal's origin."""
+    url = logged_in.post(attachment_entry, {'csrf_token': csrf_token},
+                         upload_files=[('file', 'page.html', b'<script>')]
+                         ).json['url']
+    response = logged_in.get(url)
+    assert response.headers['Content-Disposition'].startswith('attachment')
+    assert response.headers['X-Content-Type-Options'] == 'nosniff'
+
+
+def test_attachment_route_downloads_a_file_with_a_non_ascii_name(
+        logged_in, csrf_token, attachment_entry):
+    """Test that the name goes out as ASCII and as percent-encoded UTF-8."""
+    name = '\u6587\u4ef6.zip'
+    url = logged_in.post(attachment_entry, {'csrf_token': csrf_token},
+                         upload_files=[('file', name, b'PK\x03\x04')]
+                         ).json['url']
+    response = logged_in.get(url)
+    assert response.body == b'PK\x03\x04'
+    assert response.headers['Content-Disposition'] == (
+        "attachment; filename=\"file.zip\"; "
+        "filename*=UTF-8''%E6%96%87%E4%BB%B6.zip")
+
+
+def test_content_disposition_keeps_an_ascii_fallback():
+    """Test the plain filename given to clients without filename*."""
+    from pyramid_learning_journal.attachments import content_disposition
+    assert content_disposition('r\u00e9sum\u00e9 "1".pdf').startswith(
+        'attachment; filename="resume 1.pdf"; ')
+    assert 'filename="file";' in content_disposition('\u6587\u4ef6')
+
+
+def test_attachment_routes_refuse_bad_uploads(logged_in, csrf_token,
+                                              attachment_entry):
+    """Test uploads with no file, too large a file or no entry."""
+    logged_in.post(attachment_entry, {'csrf_token': csrf_token}, status=400)
+    store = logged_in.app.registry['attachment_store']
+    max_size, store.max_size = store.max_size, 10
+    try:
+        logged_in.post(attachment_entry, {'csrf_token': csrf_token},
+                       upload_files=[('file', 'big.txt', b'x' * 11)],
+                       status=413)
+    finally:
+        store.max_size = max_size
+    logged_in.post('/journal/999999/attachments', {'csrf_token': csrf_token},
+                   upload_files=[('file', 'a.txt', b'a')], status=404)
+    logged_in.get('/attachments/{}/a.txt'.format('0' * 64), status=404)
+
+
+""" TESTS FOR BAKED QUERIES """
+
+
+def test_counting_cache_counts_queries_and_statements_apart():
+    """Test that lookups are counted by the kind of key."""
+    from sqlalchemy.dialects.sqlite.pysqlite import SQLiteDialect_pysqlite
+    from pyramid_learning_journal.models.baking import CountingLRUCache
+    cache = CountingLRUCache(10)
+    query_key = (test_counting_cache_counts_queries_and_statements_apart
+                 .__code__,)
+    statement_key = (SQLiteDialect_pysqlite(), 'statement')
+    assert cache.get(query_key) is None
+    cache[query_key] = 'query'
+    assert cache.get(query_key) == 'query'
+    assert cache.get(statement_key) is None
+    stats = cache.stats()
+    assert stats['queries'] == {'hits': 1, 'misses': 1, 'hit_rate': 0.5}
+    assert stats['statements'] == {'hits': 0, 'misses': 1, 'hit_rate': 0.0}
+    assert stats['size'] == 1
+    cache.reset_counts()
+    assert cache.stats()['queries']['hits'] == 0
+
+
+def test_baked_queries_are_reused(db_session):
+    """Test that running a hot path again is served from the cache."""
+    from pyramid_learning_journal.models.baking import bakery
+    from pyramid_learning_journal.models.related import related_entries
+    related_entries(db_session, 1)
+    bakery.cache.reset_counts()
+    for entry_id in range(2, 12):
+        related_entries(db_session, entry_id)
+    stats = bakery.cache.stats()
+    assert stats['queries'] == {'hits': 10, 'misses': 0, 'hit_rate': 1.0}
+    assert stats['statements']['misses'] == 0
+
+
+def test_entry_batch_walks_every_entry_newest_first(db_session):
+    """Test that baked batches go through entries like one ordered query."""
+    from pyramid_learning_journal.models import Entry
+    from pyramid_learning_journal.models.mymodel import (
+        entry_batch, newest_entries)
+    db_session.add_all([Entry(title='Batch {}'.format(n), body='')
+                        for n in range(7)])
+    db_session.flush()
+    walked = []
+    batch = entry_batch(db_session, 3)
+    while batch:
+        walked.extend(batch)
+        batch = entry_batch(db_session, 3, after=batch[-1])
+    assert walked == newest_entries(db_session)
+    assert len(walked) == db_session.query(Entry).count()
+
+
+def test_tagged_entries_pages_with_bound_limits(db_session):
+    """Test that the baked tag page query honours its limit and offset."""
+    from pyramid_learning_journal.models import Entry
+    from pyramid_learning_journal.models.tag import (
+        find_tag, set_tags, tagged_entries)
+    entries = [Entry(title='Paged {}'.format(n), body='') for n in range(5)]
+    db_session.add_all(entries)
+    db_session.flush()
+    for entry in entries:
+        set_tags(db_session, entry, ['paged'])
+    db_session.flush()
+    tag = find_tag(db_session, 'paged')
+    assert find_tag(db_session, 'no such tag') is None
+    first = tagged_entries(db_session, tag.id, 3)
+    rest = tagged_entries(db_session, tag.id, 3, offset=3)
+    assert len(first) == 3 and len(rest) == 2
+    assert set(first + rest) == set(entries)
+
+
+""" TESTS FOR ENTRY NEIGHBORS """
+
+
+def test_entry_neighbors_follow_the_home_page_order(db_session):
+    """Test that entries written at the same moment are ordered by id."""
+    from datetime import datetime
+    from pyramid_learning_journal.models import Entry
+    from pyramid_learning_journal.models.mymodel import (
+        entry_neighbors, newest_entries)
+    moment = datetime(1999, 1, 1)
+    db_session.add_all([Entry(title='Same {}'.format(n), body='',
+                              creation_date=moment) for n in range(3)])
+    db_session.add(Entry(title='Earlier', body='',
+                         creation_date=datetime(1998, 1, 1)))
+    db_session.flush()
+    ids = [entry.id for entry in newest_entries(db_session)]
+    for newer, entry_id, older in zip(ids, ids[1:], ids[2:]):
+        neighbors = entry_neighbors(db_session, entry_id)
+        assert neighbors['newer']['id'] == newer
+        assert neighbors['older']['id'] == older
+    assert entry_neighbors(db_session, ids[0])['newer'] is None
+    assert entry_neighbors(db_session, ids[-1])['older'] is None
+    assert entry_neighbors(db_session, 999999) == {
+        'older': None, 'newer': None}
+
+
+def test_entry_neighbors_search_the_journal_index(db_session):
+    """Test that neither lookup scans or sorts the whole table."""
+    from sqlalchemy import event
+    from pyramid_learning_journal.models.mymodel import entry_neighbors
+    statements = []
+
+    def keep(conn, cursor, statement, parameters, context, executemany):
+        if 'entries_title' in statement:
+            statements.append((statement, parameters))
+
+    db_session.flush()
+    engine = db_session.get_bind()
+    event.listen(engine, 'before_cursor_execute', keep)
+    try:
+        entry_neighbors(db_session, 1)
+    finally:
+        event.remove(engine, 'before_cursor_execute', keep)
+    assert len(statements) == 2
+    for statement, parameters in statements:
+        plan = ' '.join(row[-1] for row in db_session.connection().execute(
+            'EXPLAIN QUERY PLAN ' + statement, parameters))
+        assert 'USING INDEX ix_entries_journal_id_creation_date' in plan
+        assert 'SCAN' not in plan and 'TEMP B-TREE' not in plan
+
+
+def test_detail_route_links_to_the_entries_either_side(testapp):
+    """Test that the detail page links to the next newer and older entry."""
+    from pyramid_learning_journal.models.mymodel import newest_entries
+    session = testapp.app.registry['dbsession_factory']()
+    ids = [entry.id for entry in newest_entries(session)][:3]
+    session.close()
+    nav = testapp.get('/journal/{}'.format(ids[1])).html.find(
+        'nav', 'neighbors')
+    testapp.app.registry['view_counter'].flush()
+    assert nav.find('a', rel='prev')['href'].endswith(
+        '/journal/{}'.format(ids[0]))
+    assert nav.find('a', rel='next')['href'].endswith(
+        '/journal/{}'.format(ids[2]))
+
+
+""" TESTS FOR JOURNALS """
+
+
+def test_add_journal_makes_the_user_once(db_session, username):
+    """Test that a second journal of a user reuses the user."""
+    from pyramid_learning_journal.models import User
+    from pyramid_learning_journal.models.journal import (
+        add_journal, find_journal)
+    add_journal(db_session, 'ada', 'Notes', 'ada', 'lovelace')
+    add_journal(db_session, 'ada-2', '', 'ada')
+    assert db_session.query(User).count() == 1
+    assert find_journal(db_session, slug='ada') == {
+        'id': 2, 'slug': 'ada', 'title': 'Notes', 'owner': 'ada'}
+    assert find_journal(db_session, slug='ada-2')['title'] == 'ada-2'
+    assert find_journal(db_session, journal_id=1)['owner'] == username
+    assert find_journal(db_session, slug='nobody') is None
+
+
+@pytest.mark.parametrize('slug, name, password', [
+    ('Not A Slug', 'ada', 'pw'),
+    ('main', 'ada', 'pw'),
+    ('ada', 'name', 'pw'),
+    ('ada', 'ada', ''),
+])
+def test_add_journal_rejects_bad_arguments(db_session, username, slug, name,
+                                           password):
+    """Test that bad slugs, taken slugs and missing passwords are refused."""
+    from pyramid_learning_journal.models.journal import add_journal
+    with pytest.raises(ValueError):
+        add_journal(db_session, slug, 'Notes', name, password)
+
+
+def test_check_credentials_looks_in_the_users_table(db_session, username,
+                                                    password):
+    """Test that users in the table log in with their own password."""
+    from pyramid_learning_journal.models.journal import add_journal
+    from pyramid_learning_journal.security import check_credentials
+    add_journal(db_session, 'ada', 'Notes', 'ada', 'lovelace')
+    assert check_credentials('ada', 'lovelace', db_session)
+    assert not check_credentials('ada', 'password', db_session)
+    assert not check_credentials('ada', 'lovelace')
+    assert check_credentials(username, password, db_session)
+
+
+def test_memory_cache_partitions_evict_only_their_own_values():
+    """Test that a busy journal can't push another journal out."""
+    from pyramid_learning_journal.cache import MemoryBackend
+    backend = MemoryBackend(max_entries=10, partition_entries=2)
+    backend.set('journal:journal/2:0:page:', b'quiet')
+    for n in range(5):
+        backend.set('journal:journal/3:0:page:{}'.format(n), b'busy')
+    assert backend.get('journal:journal/2:0:page:') == b'quiet'
+    assert [backend.get('journal:journal/3:0:page:{}'.format(n))
+            for n in range(5)] == [None, None, None, b'busy', b'busy']
+
+
+@pytest.mark.parametrize('make_backend', ['sqlite', 'redis'])
+def test_shared_cache_partitions_evict_only_their_own_values(
+        make_backend, tmpdir, request):
+    """Test that the shared backends cap each journal's pages too."""
+    from pyramid_learning_journal.cache import RedisBackend, SQLiteBackend
+    if make_backend == 'sqlite':
+        backend = SQLiteBackend(str(tmpdir.join('cache.sqlite')),
+                                partition_entries=2)
+    else:
+        backend = RedisBackend(request.getfixturevalue('redis_server'),
+                               partition_entries=2)
+    backend.set('journal:journal/2:0.0:page:', b'quiet')
+    backend.set('journal:lists:0.0:home', b'site')
+    for n in range(5):
+        backend.set('journal:journal/3:0.0:page:{}'.format(n), b'busy')
+    assert backend.get('journal:journal/2:0.0:page:') == b'quiet'
+    assert backend.get('journal:lists:0.0:home') == b'site'
+    assert [backend.get('journal:journal/3:0.0:page:{}'.format(n))
+            for n in range(5)] == [None, None, None, b'busy', b'busy']
+
+
+def test_sqlite_cache_adds_partitions_to_an_old_file(tmpdir):
+    """Test that a cache file from before partitions is brought up to date."""
+    import sqlite3
+    from pyramid_learning_journal.cache import SQLiteBackend
+    path = str(tmpdir.join('cache.sqlite'))
+    old = sqlite3.connect(path)
+    old.execute('CREATE TABLE cache ('
+                'key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL)')
+    old.commit()
+    old.close()
+    backend = SQLiteBackend(path, partition_entries=1)
+    backend.set('journal:journal/2:0.0:page:', b'x')
+    assert backend.get('journal:journal/2:0.0:page:') == b'x'
+
+
+def test_changed_entries_invalidate_only_their_journal():
+    """Test that an entry event misses the pages of its own journal."""
+    from pyramid.config import Configurator
+    from pyramid_learning_journal.events import EntriesChanged
+    from pyramid_learning_journal.cache import (
+        invalidate_entries, journal_namespace)
+    config = Configurator(settings={'journal.events.workers': '0'})
+    config.include('pyramid_learning_journal.events')
+    config.include('pyramid_learning_journal.cache')
+    cache = config.registry['cache']
+    cache.set(journal_namespace(2), 'page:', ['two'])
+    cache.set(journal_namespace(3), 'page:', ['three'])
+    event = EntriesChanged([1], [2])
+    event.registry = config.registry
+    invalidate_entries(event)
+    assert cache.get(journal_namespace(2), 'page:') is None
+    assert cache.get(journal_namespace(3), 'page:') == ['three']
+
+
+def test_journal_entries_page_through_one_journal(db_session, username):
+    """Test that a journal's pages hold only its entries, newest first."""
+    from pyramid_learning_journal.models import Entry
+    from pyramid_learning_journal.models.journal import add_journal
+    from pyramid_learning_journal.models.mymodel import journal_entries
+    journal = add_journal(db_session, 'ada', 'Notes', 'ada', 'lovelace')
+    db_session.add_all([Entry(title='Main {}'.format(n), body='')
+                        for n in range(3)])
+    mine = [Entry(title='Ada {}'.format(n), body='', journal_id=journal.id)
+            for n in range(5)]
+    db_session.add_all(mine)
+    db_session.flush()
+    walked = []
+    page = journal_entries(db_session, journal.id, 2)
+    while page:
+        walked.extend(page)
+        page = journal_entries(db_session, journal.id, 2, before=page[-1].id)
+    assert walked == sorted(mine, key=lambda entry: (
+        entry.creation_date, entry.id), reverse=True)
+
+
+def test_journal_entries_search_the_journal_index(db_session):
+    """Test that both pages of a journal are read from its index."""
+    from sqlalchemy import event
+    from pyramid_learning_journal.models.mymodel import journal_entries
+    statements = []
+
+    def keep(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('SELECT entries.'):
+            statements.append((statement, parameters))
+
+    db_session.flush()
+    engine = db_session.get_bind()
+    event.listen(engine, 'before_cursor_execute', keep)
+    try:
+        journal_entries(db_session, 1, 10)
+        journal_entries(db_session, 1, 10, before=1)
+    finally:
+        event.remove(engine, 'before_cursor_execute', keep)
+    assert len(statements) == 2
+    for statement, parameters in statements:
+        plan = ' '.join(row[-1] for row in db_session.connection().execute(
+            'EXPLAIN QUERY PLAN ' + statement, parameters))
+        assert 'INDEX ix_entries_journal_id_creation_date' in plan
+        assert 'TEMP B-TREE' not in plan
+
+
+def test_apply_batch_leaves_other_journals_alone(db_session, username):
+    """Test that a batch can't change an entry of another journal."""
+    from pyramid_learning_journal.models import Entry
+    from pyramid_learning_journal.models.batch import apply_batch
+    from pyramid_learning_journal.models.journal import add_journal
+    journal = add_journal(db_session, 'ada', 'Notes', 'ada', 'lovelace')
+    theirs = Entry(title='Ada', body='', journal_id=journal.id)
+    db_session.add(theirs)
+    db_session.flush()
+    results, changed = apply_batch(db_session, [
+        {'op': 'update', 'id': theirs.id, 'title': 'mine now'},
+        {'op': 'delete', 'id': theirs.id},
+        {'op': 'create', 'title': 'new', 'body': 'b'},
+    ])
+    assert [result['status'] for result in results] == [
+        'error', 'error', 'created']
+    new = db_session.query(Entry).get(results[2]['id'])
+    assert new.journal_id == 1
+    assert db_session.query(Entry).get(theirs.id).title == 'Ada'
+
+
+def test_journal_view_caches_only_the_first_page(dummy_request, username,
+                                                 monkeypatch):
+    """Test that pages starting at an entry from the url are not cached."""
+    from pyramid.httpexceptions import HTTPNotFound
+    from pyramid_learning_journal.cache import Cache, MemoryBackend
+    from pyramid_learning_journal.models import Entry
+    from pyramid_learning_journal.models.journal import (
+        add_journal, find_journal)
+    from pyramid_learning_journal.security import JournalContext
+    from pyramid_learning_journal.views.journals import journal_view
+    session = dummy_request.dbsession
+    journal = add_journal(session, 'ada', 'Notes', 'ada', 'lovelace')
+    session.add_all([Entry(title='Ada {}'.format(n), body='',
+                           journal_id=journal.id) for n in range(12)])
+    other = Entry(title='Main', body='')
+    session.add(other)
+    session.flush()
+    backend = MemoryBackend()
+    monkeypatch.setitem(dummy_request.registry, 'cache', Cache(backend))
+    dummy_request.context = JournalContext(
+        dummy_request, find_journal(session, slug='ada'))
+    first = journal_view(dummy_request)
+    assert len(first['entries']) == 10 and first['older']
+    dummy_request.params['before'] = str(first['older'])
+    assert len(journal_view(dummy_request)['entries']) == 2
+    assert len(backend._values) == 1
+    dummy_request.params['before'] = str(other.id)
+    with pytest.raises(HTTPNotFound):
+        journal_view(dummy_request)
+    dummy_request.params['before'] = 'x'
+    with pytest.raises(HTTPBadRequest):
+        journal_view(dummy_request)
+
+
+def test_journal_routes_let_only_the_owner_write(logged_in, csrf_token):
+    """Test a second author writing to their own journal and no other."""
+    import transaction
+    from pyramid_learning_journal.models import get_tm_session
+    from pyramid_learning_journal.models.journal import add_journal
+    with transaction.manager:
+        session = get_tm_session(
+            logged_in.app.registry['dbsession_factory'], transaction.manager)
+        add_journal(session, 'ada', 'Ada Notes', 'ada', 'lovelace')
+    assert logged_in.get('/journals/nobody', status=404)
+    assert logged_in.get('/').html.find('a', 'new')['href'].endswith(
+        '/journal/new-entry')
+    logged_in.post('/journals/ada/new-entry', {
+        'csrf_token': csrf_token, 'title': 'sneaky', 'body': 'b'}, status=403)
+
+    logged_in.get('/logout')
+    logged_in.post('/login', {
+        'csrf_token': csrf_token, 'username': 'ada', 'password': 'lovelace'})
+    response = logged_in.post('/journals/ada/new-entry', {
+        'csrf_token': csrf_token, 'title': 'Analytical', 'body': 'engine'})
+    assert response.location.endswith('/journals/ada')
+    page = logged_in.get('/journals/ada')
+    assert page.html.find('a', 'new')['href'].endswith(
+        '/journals/ada/new-entry')
+    assert page.html.find('h1').text == 'Ada Notes'
+    assert [h2.text for h2 in page.html.find_all('h2')] == ['Analytical']
+    logged_in.post('/journal/new-entry', {
+        'csrf_token': csrf_token, 'title': 'x', 'body': 'b'}, status=403)
+    detail = page.html.find('a', string='Read more')['href']
+    assert logged_in.get(detail).html.find('a', 'edit')
+    assert logged_in.get('/journal/1').html.find('a', 'edit') is None
+    logged_in.app.registry['view_counter'].flush()
+    assert logged_in.get(detail + '/edit-entry').status_code == 200
+    logged_in.get('/journal/1/edit-entry', status=403)
+    logged_in.get('/logout')
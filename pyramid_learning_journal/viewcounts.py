@@ -0,0 +1,71 @@
+"""Count entry reads in memory and write them out in batches.
+
+Writing a count on every read would turn each page view into a database
+write. Instead ``count()`` adds to a dict in this process, and a background
+thread writes everything counted so far every ``journal.views.flush_interval``
+seconds, as one batched upsert followed by a refresh of ``most_read``, all
+in one transaction. Counts that fail to be written are kept for the next
+try. What is still in memory is written when the process exits.
+"""
+from collections import Counter
+
+from .flushing import PeriodicFlush, close_at_exit
+from .models.viewcount import MOST_READ, add_views, refresh_most_read
+
+
+class ViewCounter(PeriodicFlush):
+    """Collect entry reads and flush them to the database together."""
+
+    name = 'view-counter'
+
+    def __init__(self, session_factory, interval=10.0, most_read=MOST_READ):
+        super(ViewCounter, self).__init__(interval)
+        self.session_factory = session_factory
+        self.most_read = most_read
+        self.counts = Counter()
+
+    def count(self, entry_id):
+        """Count one read of an entry."""
+        with self._lock:
+            self.counts[entry_id] += 1
+        self._start()
+
+    def flush(self):
+        """Write every count collected so far, returning how many entries."""
+        with self._lock:
+            counts, self.counts = self.counts, Counter()
+        if not counts:
+            return 0
+        try:
+            session = self.session_factory()
+            try:
+                add_views(session, counts)
+                refresh_most_read(session, self.most_read)
+                session.commit()
+            finally:
+                session.close()
+        except Exception:
+            with self._lock:
+                self.counts.update(counts)
+            raise
+        self.flushes += 1
+        return len(counts)
+
+
+def count_view(request, entry_id):
+    """Count a read of an entry, if the app counts them."""
+    counter = request.registry.get('view_counter')
+    if counter is not None:
+        counter.count(entry_id)
+
+
+def includeme(config):
+    """Count entry reads. Needs pyramid_learning_journal.models."""
+    settings = config.get_settings()
+    counter = ViewCounter(
+        config.registry['dbsession_factory'],
+        interval=float(settings.get('journal.views.flush_interval', 10)),
+        most_read=int(settings.get('journal.views.most_read', MOST_READ))
+    )
+    config.registry['view_counter'] = counter
+    close_at_exit(counter)
@@ -0,0 +1,32 @@
+from pyramid.view import view_config
+from pyramid.httpexceptions import HTTPBadRequest
+from pyramid_learning_journal.drafts import discard_entry_drafts
+from pyramid_learning_journal.models.batch import apply_batch
+from pyramid_learning_journal.models.journal import DEFAULT_JOURNAL
+from pyramid_learning_journal.events import EntriesChanged, notify_after_commit
+
+MAX_OPERATIONS = 1000
+
+
+@view_config(
+    route_name='api_batch',
+    renderer='json',
+    request_method='POST',
+    permission='secret'
+)
+def batch_view(request):
+    """Create, update and delete many entries in one transaction."""
+    try:
+        operations = request.json_body['operations']
+    except (ValueError, KeyError, TypeError):
+        raise HTTPBadRequest
+    if not isinstance(operations, list) or len(operations) > MAX_OPERATIONS:
+        raise HTTPBadRequest
+
+    journal_id = getattr(request.context, 'journal_id', DEFAULT_JOURNAL)
+    results, changed = apply_batch(request.dbsession, operations, journal_id)
+    discard_entry_drafts(request, [result['id'] for result in results
+                                   if result.get('status') == 'deleted'])
+    if changed:
+        notify_after_commit(request, EntriesChanged(changed, [journal_id]))
+    return {"results": results}
@@ -0,0 +1,25 @@
+from pyramid.view import view_config
+from pyramid.httpexceptions import HTTPNotFound
+from pyramid_learning_journal.models.archive import (
+    entries_between,
+    month_range,
+)
+from pyramid_learning_journal.views.default import cached_archive_months
+
+
+@view_config(route_name='archive', renderer='pyramid_learning_journal:templates/archive.jinja2')
+def archive_view(request):
+    """The journal entries written in one month."""
+    year = int(request.matchdict['year'])
+    month = int(request.matchdict['month'])
+    try:
+        start, end = month_range(year, month)
+    except ValueError:
+        raise HTTPNotFound
+    entries = entries_between(request.dbsession, start, end)
+
+    return {
+        "page_title": start.strftime('%B %Y'),
+        "entries": [entry.to_html_dict() for entry in entries],
+        "months": cached_archive_months(request)
+    }
@@ -0,0 +1,101 @@
+from pyramid.view import view_config
+from pyramid.httpexceptions import (
+    HTTPBadRequest,
+    HTTPNotFound,
+    HTTPRequestEntityTooLarge,
+)
+from pyramid_learning_journal.attachments import (
+    AttachmentResponse,
+    AttachmentTooLarge,
+    get_store,
+)
+from pyramid_learning_journal.models import Entry
+from pyramid_learning_journal.models.attachment import (
+    Attachment,
+    find_attachment,
+)
+import mimetypes
+import posixpath
+
+
+def clean_filename(filename):
+    """Keep only the last part of an uploaded file's name."""
+    filename = posixpath.basename(filename.replace('\\', '/')).strip()
+    return filename[-255:] or 'file'
+
+
+def attachment_dict(request, attachment):
+    """Describe an attachment, with the url to fetch it from."""
+    attr = attachment.to_dict()
+    attr['url'] = request.route_url(
+        'attachment', sha256=attachment.sha256, filename=attachment.filename)
+    return attr
+
+
+def get_entry(request):
+    """Get the entry in the url, or raise HTTPNotFound."""
+    entry = request.dbsession.query(Entry).get(int(request.matchdict['id']))
+    if entry is None:
+        raise HTTPNotFound
+    return entry
+
+
+@view_config(route_name='attachments', renderer='json', request_method='GET')
+def list_attachments_view(request):
+    """The files attached to an entry."""
+    entry = get_entry(request)
+    return {"attachments": [
+        attachment_dict(request, attachment)
+        for attachment in entry.attachments
+    ]}
+
+
+@view_config(
+    route_name='attachments',
+    renderer='json',
+    request_method='POST',
+    permission='secret'
+)
+def upload_attachment_view(request):
+    """Attach an uploaded file to an entry."""
+    store = get_store(request)
+    if (request.content_length or 0) > store.max_size:
+        raise HTTPRequestEntityTooLarge
+    entry = get_entry(request)
+    upload = request.POST.get('file')
+    if getattr(upload, 'file', None) is None or not upload.filename:
+        raise HTTPBadRequest
+    try:
+        digest, size = store.save(upload.file)
+    except AttachmentTooLarge:
+        raise HTTPRequestEntityTooLarge
+    filename = clean_filename(upload.filename)
+    attachment = entry.attachments.filter(
+        Attachment.sha256 == digest, Attachment.filename == filename
+    ).first()
+    if attachment is None:
+        content_type = mimetypes.guess_type(filename)[0]
+        attachment = Attachment(
+            sha256=digest,
+            filename=filename,
+            content_type=content_type or 'application/octet-stream',
+            size=size
+        )
+        entry.attachments.append(attachment)
+        request.dbsession.flush()
+        request.response.status = 201
+    return attachment_dict(request, attachment)
+
+
+@view_config(route_name='attachment', request_method=('GET', 'HEAD'))
+def attachment_view(request):
+    """Send an attached file."""
+    digest = request.matchdict['sha256']
+    attachment = find_attachment(
+        request.dbsession, digest, request.matchdict['filename'])
+    store = get_store(request)
+    if attachment is None or not store.exists(digest):
+        raise HTTPNotFound
+    return AttachmentResponse(
+        request, store.path_of(digest), digest,
+        attachment.content_type, attachment.filename)
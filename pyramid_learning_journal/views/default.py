@@ -1,18 +1,123 @@
 from pyramid.view import view_config
+from pyramid.renderers import render_to_response
 from pyramid.httpexceptions import HTTPNotFound, HTTPFound, HTTPBadRequest
 from pyramid_learning_journal.models import Entry
+from pyramid_learning_journal.models.mymodel import (
+    entry_batch,
+    entry_neighbors,
+    load_entry,
+    newest_entries,
+)
+from pyramid_learning_journal.models.revision import record_revision
+from pyramid_learning_journal.models.tag import parse_tags, set_tags, tag_cloud
+from pyramid_learning_journal.models.archive import archive_months, count_entry
+from pyramid_learning_journal.models.related import related_entries
+from pyramid_learning_journal.cache import (
+    SITE_LISTS,
+    get_cache,
+    journal_namespace,
+)
+from pyramid_learning_journal.models.journal import DEFAULT_JOURNAL
+from pyramid_learning_journal.models.viewcount import most_read
+from pyramid_learning_journal.viewcounts import count_view
+from pyramid_learning_journal.drafts import (
+    discard_draft,
+    discard_entry_drafts,
+    get_draft,
+)
+from pyramid_learning_journal.events import (
+    EntryCreated,
+    EntryDeleted,
+    EntryUpdated,
+    notify_after_commit,
+)
 from pyramid.security import remember, forget
-from pyramid_learning_journal.security import check_credentials
+from pyramid_learning_journal.security import (
+    check_credentials,
+    journal_context,
+)
+from pyramid_learning_journal.streaming import render_to_stream, streaming_enabled
+from difflib import unified_diff
+
+
+def stream_entries(request, batch_size=20):
+    """Lazily fetch entries as html dicts, newest first, in batches.
+
+    The rows are read through a session of their own, since a streamed
+    response is sent after pyramid_tm has already ended the request's
+    transaction. Each batch starts where the last one ended, so every query
+    is a short scan of the creation_date index.
+    """
+    session = request.registry['dbsession_factory']()
+    try:
+        batch = entry_batch(session, batch_size)
+        while batch:
+            for entry in batch:
+                yield entry.to_html_dict()
+            last = batch[-1]
+            session.expunge_all()
+            batch = entry_batch(session, batch_size, after=last)
+    finally:
+        session.close()
+
+
+def cached_tag_cloud(request):
+    """Get the tag cloud, from the cache when it is there."""
+    return get_cache(request).get_or_set(
+        SITE_LISTS, 'tags', lambda: tag_cloud(request.dbsession))
+
+
+def cached_archive_months(request):
+    """Get the months with entries, from the cache when they are there."""
+    return get_cache(request).get_or_set(
+        SITE_LISTS, 'months', lambda: archive_months(request.dbsession))
+
+
+def cached_entry(request, entry_id):
+    """Get one entry as an html dict, or None, from the cache if there."""
+    def load():
+        entry = load_entry(request.dbsession, entry_id)
+        return entry.to_html_dict() if entry else None
+    return get_cache(request).get_or_set('entry', entry_id, load)
+
+
+def cached_neighbors(request, entry):
+    """Get the entries before and after one, from the cache if there.
+
+    They are kept with the pages of the entry's journal rather than with the
+    entry, since adding or removing any entry of the journal can change
+    which entries are next to this one.
+    """
+    return get_cache(request).get_or_set(
+        # entries cached before there were journals are in the default one
+        journal_namespace(entry.get('journal_id', DEFAULT_JOURNAL)),
+        'neighbors:{}'.format(entry['id']),
+        lambda: entry_neighbors(request.dbsession, entry['id']))
 
 
 @view_config(route_name='home', renderer='pyramid_learning_journal:templates/list_view.jinja2')
 def list_view(request):
     """List of journal entries."""
-    entries = request.dbsession.query(Entry).all()
-    entries = sorted(entries, key=lambda e: e.creation_date, reverse=True)
-    entries = [entry.to_html_dict() for entry in entries]
+    if streaming_enabled(request):
+        return render_to_stream(
+            'pyramid_learning_journal:templates/list_view.jinja2',
+            {
+                "entries": stream_entries(request),
+                "tags": cached_tag_cloud(request),
+                "months": cached_archive_months(request),
+                "page_title": "Home"
+            },
+            request
+        )
+
+    def load():
+        entries = newest_entries(request.dbsession)
+        return [entry.to_html_dict() for entry in entries]
+
     return {
-        "entries": entries,
+        "entries": get_cache(request).get_or_set(SITE_LISTS, 'home', load),
+        "tags": cached_tag_cloud(request),
+        "months": cached_archive_months(request),
         "page_title": "Home"
     }
 
@@ -22,39 +127,96 @@ def detail_view(request):
     """A single journal entry."""
     entry_id = int(request.matchdict['id'])
 
-    entry = request.dbsession.query(Entry).get(entry_id)
+    entry = cached_entry(request, entry_id)
 
     if entry:
+        count_view(request, entry_id)
+        can_edit = False
+        if request.authenticated_userid:
+            context = journal_context(
+                request, entry.get('journal_id', DEFAULT_JOURNAL))
+            can_edit = bool(request.has_permission('secret', context))
         return {
-            "page_title": entry.title,
-            "entry": entry.to_html_dict()
+            "page_title": entry['title'],
+            "entry": entry,
+            "can_edit": can_edit,
+            "neighbors": cached_neighbors(request, entry),
+            "related": related_entries(request.dbsession, entry_id)
         }
     raise HTTPNotFound
 
 
+@view_config(route_name='most_read', renderer='pyramid_learning_journal:templates/most_read.jinja2')
+def most_read_view(request):
+    """The entries read the most."""
+    return {
+        "page_title": "Most Read",
+        "entries": get_cache(request).get_or_set(
+            SITE_LISTS, 'most_read', lambda: most_read(request.dbsession),
+            ttl=60)
+    }
+
+
 @view_config(
     route_name='create',
     renderer='pyramid_learning_journal:templates/create.jinja2',
     permission='secret'
 )
+@view_config(
+    route_name='journal_create',
+    renderer='pyramid_learning_journal:templates/create.jinja2',
+    permission='secret'
+)
 def create_view(request):
-    """Create a new entry."""
+    """Create a new entry, in the journal of the url or the default one."""
+    journal_id = getattr(request.context, 'journal_id', DEFAULT_JOURNAL)
     if request.method == 'GET':
         return {
-            "page_title": "New Entry"
+            "page_title": "New Entry",
+            "draft": get_draft(request)
         }
 
     if request.method == 'POST':
         if not all([field in request.POST for field in ['title', 'body']]):
             raise HTTPBadRequest
         new_entry = Entry(
+            journal_id=journal_id,
             title=request.POST['title'],
             body=request.POST['body']
         )
         request.dbsession.add(new_entry)
+        set_tags(request.dbsession, new_entry,
+                 parse_tags(request.POST.get('tags')))
+        count_entry(request.dbsession, new_entry.creation_date)
+        discard_draft(request)
+        request.dbsession.flush()
+        notify_after_commit(request, EntryCreated(new_entry.id, journal_id))
+        if journal_id != DEFAULT_JOURNAL:
+            return HTTPFound(request.route_url(
+                'journal', slug=request.context.journal['slug']))
         return HTTPFound(request.route_url('home'))
 
 
+def edit_conflict(request, entry):
+    """Answer an edit of an old version with a 409 and a merge page."""
+    mine = {
+        'title': request.POST['title'],
+        'body': request.POST['body'],
+        'tags': request.POST.get('tags', '')
+    }
+    diff = unified_diff(
+        entry.body.splitlines(), mine['body'].splitlines(), lineterm='')
+    response = render_to_response(
+        'pyramid_learning_journal:templates/merge.jinja2', {
+            "page_title": "Edit '{}'".format(entry.title),
+            "entry": entry.to_dict(),
+            "mine": mine,
+            "diff": list(diff)[2:]
+        }, request=request)
+    response.status = 409
+    return response
+
+
 @view_config(
     route_name='edit',
     renderer='pyramid_learning_journal:templates/edit.jinja2',
@@ -72,16 +234,31 @@ def update_view(request):
     if request.method == 'GET':
         return {
             "page_title": "Edit '{}'".format(entry.title),
-            "entry": entry.to_dict()
+            "entry": entry.to_dict(),
+            "draft": get_draft(request, entry_id)
         }
 
     if request.method == 'POST':
         if not all([field in request.POST for field in ['title', 'body']]):
             raise HTTPBadRequest
+        try:
+            version = int(request.POST.get('version', entry.version))
+        except ValueError:
+            raise HTTPBadRequest
+        if version != entry.version:
+            return edit_conflict(request, entry)
+        previous_title, previous_body = entry.title, entry.body
         entry.title = request.POST['title']
         entry.body = request.POST['body']
+        if 'tags' in request.POST:
+            set_tags(request.dbsession, entry,
+                     parse_tags(request.POST['tags']))
         request.dbsession.add(entry)
+        record_revision(
+            request.dbsession, entry, previous_title, previous_body)
+        discard_draft(request, entry_id)
         request.dbsession.flush()
+        notify_after_commit(request, EntryUpdated(entry_id, entry.journal_id))
         return HTTPFound(request.route_url('detail', id=entry_id))
 
 
@@ -99,7 +276,11 @@ def delete_journal_entry(request):
         raise HTTPNotFound
 
     if request.method == 'POST':
+        set_tags(request.dbsession, entry, [])
+        count_entry(request.dbsession, entry.creation_date, -1)
         request.dbsession.delete(entry)
+        discard_entry_drafts(request, [entry_id])
+        notify_after_commit(request, EntryDeleted(entry_id, entry.journal_id))
         return HTTPFound(request.route_url('home'))
 
 
@@ -117,7 +298,7 @@ def login(request):
             raise HTTPBadRequest
         username = request.POST['username']
         password = request.POST['password']
-        if check_credentials(username, password):
+        if check_credentials(username, password, request.dbsession):
             headers = remember(request, username)
             return HTTPFound(request.route_url('home'), headers=headers)
         return {
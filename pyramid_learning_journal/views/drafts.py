@@ -0,0 +1,54 @@
+from pyramid.view import view_config
+from pyramid.httpexceptions import HTTPBadRequest, HTTPNotFound
+from pyramid_learning_journal.drafts import get_draft
+from pyramid_learning_journal.models.draft import draft_key
+
+MAX_BODY = 100000
+
+
+def get_entry_id(request):
+    """Get the id of the entry a draft is for, or None for a new entry."""
+    entry_id = request.params.get('entry')
+    if not entry_id:
+        return None
+    try:
+        return int(entry_id)
+    except ValueError:
+        raise HTTPBadRequest
+
+
+@view_config(
+    route_name='drafts',
+    renderer='json',
+    request_method='GET',
+    permission='secret'
+)
+def load_draft_view(request):
+    """The saved draft of an entry, or of a new one."""
+    draft = get_draft(request, get_entry_id(request))
+    if draft is None:
+        raise HTTPNotFound
+    return draft
+
+
+@view_config(
+    route_name='drafts',
+    renderer='json',
+    request_method='POST',
+    permission='secret'
+)
+def save_draft_view(request):
+    """Autosave a draft. It is written to the database a little later."""
+    entry_id = get_entry_id(request)
+    fields = [request.POST.get(field) for field in ('title', 'body')]
+    if None in fields or len(fields[1]) > MAX_BODY:
+        raise HTTPBadRequest
+    version = request.POST.get('version')
+    try:
+        version = int(version) if version and entry_id is not None else None
+    except ValueError:
+        raise HTTPBadRequest
+    draft = request.registry['draft_buffer'].save(
+        request.authenticated_userid, draft_key(entry_id),
+        fields[0], fields[1], request.POST.get('tags', ''), version)
+    return {"saved_at": draft['saved_at'].isoformat()}
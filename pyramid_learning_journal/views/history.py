@@ -0,0 +1,89 @@
+from pyramid.view import view_config
+from pyramid.httpexceptions import HTTPNotFound, HTTPFound
+from pyramid_learning_journal.models import Entry, EntryRevision
+from pyramid_learning_journal.models.revision import (
+    get_revision,
+    record_revision,
+)
+from pyramid_learning_journal.events import EntryUpdated, notify_after_commit
+from difflib import unified_diff
+
+
+def _get_entry(request):
+    """Get the entry from the matchdict id, or raise HTTPNotFound."""
+    entry = request.dbsession.query(Entry).get(int(request.matchdict['id']))
+    if not entry:
+        raise HTTPNotFound
+    return entry
+
+
+@view_config(
+    route_name='history',
+    renderer='pyramid_learning_journal:templates/history.jinja2',
+    permission='secret'
+)
+def history_view(request):
+    """List the past revisions of an entry."""
+    entry = _get_entry(request)
+    revisions = request.dbsession.query(EntryRevision).filter_by(
+        entry_id=entry.id
+    ).order_by(EntryRevision.number.desc()).all()
+    return {
+        "page_title": "History of '{}'".format(entry.title),
+        "entry": entry.to_dict(),
+        "revisions": [revision.to_dict() for revision in revisions]
+    }
+
+
+@view_config(
+    route_name='revision',
+    renderer='pyramid_learning_journal:templates/revision.jinja2',
+    permission='secret'
+)
+def revision_view(request):
+    """Show what changed in one revision of an entry."""
+    entry = _get_entry(request)
+    number = int(request.matchdict['rev'])
+
+    revision = get_revision(request.dbsession, entry.id, number)
+    if not revision:
+        raise HTTPNotFound
+
+    previous = get_revision(request.dbsession, entry.id, number - 1)
+    if not previous:
+        previous = {'title': '', 'body': ''}
+
+    diff = unified_diff(
+        previous['body'].splitlines(),
+        revision['body'].splitlines(),
+        lineterm=''
+    )
+    return {
+        "page_title": "Revision {} of '{}'".format(number, entry.title),
+        "entry": entry.to_dict(),
+        "number": number,
+        "revision": revision,
+        "previous": previous,
+        "diff": list(diff)[2:]
+    }
+
+
+@view_config(route_name='restore', permission='secret')
+def restore_revision(request):
+    """Make an old revision the current version of an entry."""
+    if request.method == 'GET':
+        raise HTTPNotFound
+
+    entry = _get_entry(request)
+    revision = get_revision(
+        request.dbsession, entry.id, int(request.matchdict['rev']))
+    if not revision:
+        raise HTTPNotFound
+
+    previous_title, previous_body = entry.title, entry.body
+    entry.title = revision['title']
+    entry.body = revision['body']
+    record_revision(request.dbsession, entry, previous_title, previous_body)
+    request.dbsession.flush()
+    notify_after_commit(request, EntryUpdated(entry.id, entry.journal_id))
+    return HTTPFound(request.route_url('detail', id=entry.id))
@@ -0,0 +1,53 @@
+from pyramid.view import view_config
+from pyramid.httpexceptions import HTTPBadRequest, HTTPNotFound
+from pyramid_learning_journal.cache import get_cache, journal_namespace
+from pyramid_learning_journal.models.mymodel import journal_entries
+
+PAGE_SIZE = 10
+
+
+def get_before(request):
+    """Get the id of the entry the page starts after, or None."""
+    before = request.params.get('before')
+    if not before:
+        return None
+    try:
+        return int(before)
+    except ValueError:
+        raise HTTPBadRequest
+
+
+@view_config(route_name='journal', renderer='pyramid_learning_journal:templates/journal.jinja2')
+def journal_view(request):
+    """One page of the entries of one journal, newest first.
+
+    Only the first page is cached. Older pages start at any entry given in
+    the url, so caching them would let any client fill the journal's cache
+    with keys read once; they are a single indexed query each anyway.
+    """
+    journal = request.context.journal
+    before = get_before(request)
+
+    def load():
+        entries = journal_entries(
+            request.dbsession, journal['id'], PAGE_SIZE + 1, before)
+        return [entry.to_html_dict() for entry in entries]
+
+    if before is None:
+        entries = get_cache(request).get_or_set(
+            journal_namespace(journal['id']), 'page:', load)
+    else:
+        entries = load()
+        if not entries:
+            # no entry of this journal is older than before, or before is
+            # not one of its entries at all
+            raise HTTPNotFound
+    older = None
+    if len(entries) > PAGE_SIZE:
+        older = entries[PAGE_SIZE - 1]['id']
+    return {
+        "page_title": journal['title'],
+        "journal": journal,
+        "entries": entries[:PAGE_SIZE],
+        "older": older
+    }
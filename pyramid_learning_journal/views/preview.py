@@ -0,0 +1,27 @@
+from pyramid.view import view_config
+from pyramid.httpexceptions import (
+    HTTPBadRequest,
+    HTTPRequestEntityTooLarge,
+    HTTPServiceUnavailable,
+)
+from pyramid_learning_journal.preview import PreviewBusy, PreviewTimeout
+
+
+@view_config(
+    route_name='preview',
+    renderer='json',
+    request_method='POST',
+    permission='secret'
+)
+def preview_view(request):
+    """Render markdown as a saved entry's body would be."""
+    body = request.POST.get('body')
+    if body is None:
+        raise HTTPBadRequest
+    settings = request.registry.settings
+    if len(body) > int(settings.get('journal.preview.max_length', 100000)):
+        raise HTTPRequestEntityTooLarge
+    try:
+        return {"html": request.registry['previewer'].render(body)}
+    except (PreviewTimeout, PreviewBusy):
+        raise HTTPServiceUnavailable(headers={'Retry-After': '1'})
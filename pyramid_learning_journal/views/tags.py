@@ -0,0 +1,36 @@
+from pyramid.view import view_config
+from pyramid.httpexceptions import HTTPNotFound
+from pyramid_learning_journal.models.tag import find_tag, tagged_entries
+from pyramid_learning_journal.views.default import cached_tag_cloud
+
+PAGE_SIZE = 10
+
+
+def get_page(request):
+    """Get the page number from the query string, starting at 1."""
+    try:
+        return max(int(request.params.get('page', 1)), 1)
+    except ValueError:
+        return 1
+
+
+@view_config(route_name='tag', renderer='pyramid_learning_journal:templates/tag.jinja2')
+def tag_view(request):
+    """One page of the journal entries with a tag."""
+    name = request.matchdict['name'].lower()
+    tag = find_tag(request.dbsession, name)
+    if not tag:
+        raise HTTPNotFound
+
+    page = get_page(request)
+    entries = tagged_entries(
+        request.dbsession, tag.id, PAGE_SIZE + 1, (page - 1) * PAGE_SIZE)
+
+    return {
+        "page_title": "Tagged '{}'".format(tag.name),
+        "tag": tag.name,
+        "entries": [entry.to_html_dict() for entry in entries[:PAGE_SIZE]],
+        "tags": cached_tag_cloud(request),
+        "page": page,
+        "has_next": len(entries) > PAGE_SIZE
+    }
@@ -3,8 +3,21 @@ import os
 from paste.deploy import loadapp
 from waitress import serve
 
+from pyramid_learning_journal import prefork
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
+    workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+    threads = int(os.environ.get("WEB_THREADS", 4))
     app = loadapp('config:production.ini', relative_to='.')
 
-    serve(app, host='0.0.0.0', port=port)
+    if workers > 1:
+        prefork.serve(
+            app, host='0.0.0.0', port=port, workers=workers, threads=threads,
+            max_requests=int(os.environ.get("MAX_REQUESTS", 0)),
+            max_requests_jitter=int(os.environ.get("MAX_REQUESTS_JITTER", 0)),
+            graceful_timeout=float(os.environ.get("GRACEFUL_TIMEOUT", 30)),
+            reuse_port=os.environ.get("REUSE_PORT", "") == "1"
+        )
+    else:
+        serve(app, host='0.0.0.0', port=port, threads=threads)
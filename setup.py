@@ -22,13 +22,15 @@ requires = [
     'psycopg2',
     'markdown',
     'pytz',
-    'passlib'
+    'passlib',
+    'numpy'
 ]
 
 tests_require = [
     'WebTest >= 1.3.1',  # py3 compat
     'pytest',
     'pytest-cov',
+    'pytest-xdist',
     'tox'
 ]
 
@@ -39,6 +41,7 @@ setup(
     long_description=README + '\n\n' + CHANGES,
     classifiers=[
         'Programming Language :: Python',
+        'Programming Language :: Python :: 3',
         'Framework :: Pyramid',
         'Topic :: Internet :: WWW/HTTP',
         'Topic :: Internet :: WWW/HTTP :: WSGI :: Application',
@@ -50,8 +53,10 @@ setup(
     packages=find_packages(),
     include_package_data=True,
     zip_safe=False,
+    python_requires='>=3.6',
     extras_require={
         'testing': tests_require,
+        'mistune': ['mistune'],
     },
     install_requires=requires,
     entry_points={
@@ -60,6 +65,13 @@ setup(
         ],
         'console_scripts': [
             'initializedb = pyramid_learning_journal.scripts.initializedb:main',
+            'rebuildrelated = pyramid_learning_journal.scripts.rebuildrelated:main',
+            'generatecorpus = pyramid_learning_journal.scripts.generatecorpus:main',
+            'loadtest = pyramid_learning_journal.scripts.loadtest:main',
+            'benchmarkmarkdown = pyramid_learning_journal.scripts.benchmarkmarkdown:main',
+            'rerenderentries = pyramid_learning_journal.scripts.rerenderentries:main',
+            'benchmarkqueries = pyramid_learning_journal.scripts.benchmarkqueries:main',
+            'addjournal = pyramid_learning_journal.scripts.addjournal:main',
         ],
     },
 )